@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Columnar archive of café registrations
+
+Registrations are written to Parquet files with one partition per month:
+
+    archive/month=2025-01/registrations.parquet
+
+The archive command moves whole months older than a cutoff out of the hot
+cafe_registrations table into these files, so the table and its unique
+indexes stay small for inserts however long the history gets. The export
+command writes the same layout for the rows still in SQLite, for analysis
+tools that read Parquet directly.
+
+Archived data is read through a pyarrow dataset, which only opens the
+files and columns a query asks for. pyarrow is optional: the backend and
+the Excel export work without it, only this module needs it. It is
+imported on first use, so checking for an archive costs nothing.
+
+Usage: python archive.py archive [--older-than-months 12] [--dry-run]
+       python archive.py export --output DIR
+"""
+
+import argparse
+import os
+import sqlite3
+import logging
+from datetime import date
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from db import Database
+from migrations import run_migrations
+
+# Set by require_pyarrow()
+pa = pc = ds = pq = None
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = Path(os.environ.get("DB_PATH", Path(__file__).parent / "politekcafe.db"))
+ARCHIVE_DIR = Path(os.environ.get("ARCHIVE_DIR", Path(__file__).parent / "archive"))
+ARCHIVE_AFTER_MONTHS = int(os.environ.get("ARCHIVE_AFTER_MONTHS", "12"))
+PARTITION_FILE = "registrations.parquet"
+
+# SQLite declared types to Arrow types; anything else is stored as text
+_ARROW_TYPES = {
+    'INTEGER': 'int64',
+    'REAL': 'float64',
+    'BLOB': 'binary',
+}
+
+
+def require_pyarrow():
+    """Import pyarrow into this module's globals on first use"""
+    global pa, pc, ds, pq
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is not installed; run: pip install pyarrow")
+    pa, pc, ds, pq = pyarrow, pyarrow.compute, pyarrow.dataset, pyarrow.parquet
+
+
+def has_archive(directory: Path = ARCHIVE_DIR) -> bool:
+    return any(directory.glob(f"month=*/{PARTITION_FILE}"))
+
+
+def arrow_schema(conn: sqlite3.Connection):
+    """Arrow schema matching the current cafe_registrations columns"""
+    require_pyarrow()
+    return pa.schema([
+        (name, pa.type_for_alias(_ARROW_TYPES.get(declared.upper(), 'string')))
+        for _, name, declared, *_ in conn.execute("PRAGMA table_info(cafe_registrations)")
+    ])
+
+
+def month_start(months_ago: int, today: Optional[date] = None) -> str:
+    """First day of the month months_ago before today, as YYYY-MM"""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - months_ago
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def next_month(month: str) -> str:
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def hot_months(conn: sqlite3.Connection, before: Optional[str] = None) -> List[str]:
+    """Months (YYYY-MM) that still have rows in cafe_registrations, optionally only those before a month"""
+    rows = conn.execute(
+        "SELECT DISTINCT substr(timestamp, 1, 7) FROM cafe_registrations WHERE timestamp < ? ORDER BY 1",
+        (before or '9999',)
+    )
+    return [row[0] for row in rows]
+
+
+def read_month(conn: sqlite3.Connection, month: str, schema):
+    """All rows of one month as an Arrow table"""
+    cursor = conn.execute(
+        "SELECT * FROM cafe_registrations WHERE timestamp >= ? AND timestamp < ? ORDER BY id",
+        (month, next_month(month))
+    )
+    columns = [description[0] for description in cursor.description]
+    rows = cursor.fetchall()
+    data = {name: [row[index] for row in rows] for index, name in enumerate(columns)}
+    return pa.Table.from_pydict(data, schema=schema)
+
+
+def write_partition(table, directory: Path, month: str, merge: bool = False) -> Path:
+    """Write one month's partition atomically; with merge, rows already in it are kept"""
+    partition = directory / f"month={month}"
+    partition.mkdir(parents=True, exist_ok=True)
+    path = partition / PARTITION_FILE
+    if merge and path.exists():
+        # A previous run was interrupted after writing: keep one copy of every id
+        existing = pq.read_table(path)
+        existing = existing.filter(pc.invert(pc.is_in(existing['id'], value_set=table['id'])))
+        table = pa.concat_tables([existing, table], promote_options='default').sort_by('id')
+    # Dot-prefixed, so dataset scans skip a file left behind by a crash
+    tmp_path = partition / f".{PARTITION_FILE}.tmp"
+    pq.write_table(table, tmp_path, compression='zstd')
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_registrations(db: Database, older_than_months: int = ARCHIVE_AFTER_MONTHS,
+                          directory: Path = ARCHIVE_DIR, dry_run: bool = False) -> int:
+    """Move whole months older than the cutoff to Parquet; returns the number of rows moved
+
+    Each month is written and synced before its rows are deleted, so an
+    interrupted run loses nothing and the next run picks up where it stopped.
+    The month's queued mails and bulk deliveries are deleted in the same
+    transaction, so no row is left pointing at a registration that moved.
+    """
+    require_pyarrow()
+    conn = db.connection
+    schema = arrow_schema(conn)
+    cutoff = month_start(older_than_months)
+    moved = 0
+    for month in hot_months(conn, before=cutoff):
+        table = read_month(conn, month, schema)
+        if dry_run:
+            logger.info(f"Would archive {table.num_rows} registrations from {month}")
+            moved += table.num_rows
+            continue
+        path = write_partition(table, directory, month, merge=True)
+        max_id = pc.max(table['id']).as_py()
+        archived = "SELECT id FROM cafe_registrations WHERE timestamp >= ? AND timestamp < ? AND id <= ?"
+        params = (month, next_month(month), max_id)
+        with db.transaction() as cursor:
+            cursor.execute(f"DELETE FROM mail_queue WHERE registration_id IN ({archived})", params)
+            mails = cursor.rowcount
+            cursor.execute(f"DELETE FROM bulk_deliveries WHERE registration_id IN ({archived})", params)
+            deliveries = cursor.rowcount
+            cursor.execute(f"DELETE FROM cafe_registrations WHERE id IN ({archived})", params)
+            deleted = cursor.rowcount
+        logger.info(f"Archived {deleted} registrations from {month} to {path}, "
+                    f"dropping {mails} queued mails and {deliveries} bulk deliveries")
+        moved += deleted
+    return moved
+
+
+def export_partitions(db: Database, directory: Path) -> int:
+    """Write every hot row to monthly Parquet partitions under directory; returns the row count"""
+    require_pyarrow()
+    conn = db.connection
+    schema = arrow_schema(conn)
+    count = 0
+    for month in hot_months(conn):
+        table = read_month(conn, month, schema)
+        write_partition(table, directory, month)
+        count += table.num_rows
+    logger.info(f"Exported {count} registrations to {directory}")
+    return count
+
+
+def archived_dataset(directory: Path = ARCHIVE_DIR, schema=None):
+    """Lazy dataset over all archived partitions
+
+    Pass the current arrow_schema() so columns added after a month was
+    archived read as nulls instead of failing.
+    """
+    require_pyarrow()
+    return ds.dataset(directory, schema=schema, format='parquet', partitioning='hive')
+
+
+def read_archive(columns: Iterable[str], since_id: int = 0, until_id: Optional[int] = None,
+                 directory: Path = ARCHIVE_DIR, schema=None):
+    """Archived rows with since_id < id <= until_id as a DataFrame, reading only the given columns"""
+    require_pyarrow()
+    expression = ds.field('id') > since_id
+    if until_id is not None:
+        expression = expression & (ds.field('id') <= until_id)
+    table = archived_dataset(directory, schema).to_table(columns=list(columns), filter=expression)
+    return table.to_pandas()
+
+
+def archived_max_id(directory: Path = ARCHIVE_DIR) -> int:
+    """Highest registration id in the archive, or 0 if it is empty"""
+    table = archived_dataset(directory).to_table(columns=['id'])
+    return pc.max(table['id']).as_py() or 0
+
+
+def archived_stat_groups(directory: Path = ARCHIVE_DIR) -> list:
+    """Grouped counts of archived rows in the shape stats.summarize() expects"""
+    table = archived_dataset(directory).to_table(
+        columns=['timestamp', 'komt_naar_cafe_flag', 'lid_van_samenwerkt_flag']
+    )
+    table = table.append_column('day', pc.utf8_slice_codeunits(table['timestamp'], 0, 10))
+    grouped = table.group_by(['day', 'komt_naar_cafe_flag', 'lid_van_samenwerkt_flag']).aggregate(
+        [('timestamp', 'count')]
+    )
+    return list(zip(
+        grouped['day'].to_pylist(),
+        grouped['komt_naar_cafe_flag'].to_pylist(),
+        grouped['lid_van_samenwerkt_flag'].to_pylist(),
+        grouped['timestamp_count'].to_pylist(),
+    ))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive or export café registrations as monthly Parquet files")
+    commands = parser.add_subparsers(dest='command', required=True)
+    archive_parser = commands.add_parser('archive', help="Move old months out of the database")
+    archive_parser.add_argument('--older-than-months', type=int, default=ARCHIVE_AFTER_MONTHS)
+    archive_parser.add_argument('--dry-run', action='store_true', help="Only report what would be moved")
+    export_parser = commands.add_parser('export', help="Write the rows in the database as Parquet")
+    export_parser.add_argument('--output', type=Path, required=True)
+    args = parser.parse_args()
+
+    if not DB_PATH.exists():
+        print("❌ Database file not found!")
+        return
+
+    db = Database(DB_PATH)
+    try:
+        run_migrations(db)
+        if args.command == 'archive':
+            moved = archive_registrations(db, args.older_than_months, dry_run=args.dry_run)
+            print(f"✅ {'Would archive' if args.dry_run else 'Archived'} {moved} café registrations")
+        else:
+            count = export_partitions(db, args.output)
+            print(f"✅ Exported {count} café registrations to {args.output}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,27 +4,153 @@ Python backend for SamenWerkt membership registration
 Replaces the Express.js server with FastAPI
 """
 
+import asyncio
 import json
-import sqlite3
-import smtplib
+from collections import OrderedDict
 from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from html import escape
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple
+import hmac
+import math
 import re
+import os
+import time
 import logging
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, field_validator
-import uvicorn
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, EmailStr, GetCoreSchemaHandler, GetJsonSchemaHandler, ValidationError, constr
+from pydantic_core import core_schema
+
+import bulk_mail
+from db import Database, GroupCommitWriter
+from email_templates import build_html_message, templates
+from executors import BoundedExecutor, ExecutorSaturated
+from health import HealthMonitor
+from ids import new_ulid
+from mail_queue import MailQueue, enqueue_mails, submission_payload
+import metrics
+from metrics import RATE_LIMITED, REQUESTS, REQUEST_DURATION, REQUESTS_IN_FLIGHT, STAGE_DURATION
+from migrations import run_migrations
+from rate_limit import RateLimiter, TokenBucket
+import serialization
+from serialization import loads
+from smtp_pool import smtp_pool
+from storage import DATABASE_URL, STORAGE_BACKEND, STORAGE_BACKENDS, PostgresStore, RegistrationStore, SQLiteStore
+from submissions import normalize_email, registration_row
+import tracing
+from tracing import maybe_trace, span
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="SamenWerkt Aanmelding PolitiekCafe API", version="1.0.0")
+# Database setup
+DB_PATH = Path(os.environ.get("DB_PATH", Path(__file__).parent / "politekcafe.db"))
+
+# Opt-in group commit: concurrent inserts share one transaction and fsync,
+# which makes full fsync durability affordable
+DB_GROUP_COMMIT = os.environ.get("DB_GROUP_COMMIT", "0") == "1"
+DB_GROUP_COMMIT_BATCH = int(os.environ.get("DB_GROUP_COMMIT_BATCH", "100"))
+DB_GROUP_COMMIT_DELAY_MS = float(os.environ.get("DB_GROUP_COMMIT_DELAY_MS", "5"))
+
+# Set by serve.py: migrations already ran, and other worker processes share the database
+SCHEMA_READY = os.environ.get("SCHEMA_READY", "0") == "1"
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+
+db = Database(
+    DB_PATH,
+    synchronous="FULL" if DB_GROUP_COMMIT else "NORMAL",
+    close_checkpoint="PASSIVE" if WEB_WORKERS > 1 else "TRUNCATE",
+)
+group_writer: Optional[GroupCommitWriter] = None
+
+# Event that new registrations belong to; one registration per email per event
+CAFE_EVENT = os.environ.get("CAFE_EVENT", "politiek-cafe")
+
+# Token for the /api/admin endpoints; they are disabled when it is not set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Mail queue setup
+MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS", "2"))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", "6"))
+# Outbound mails per minute per process, 0 for no cap
+MAIL_MAX_PER_MINUTE = float(os.environ.get("MAIL_MAX_PER_MINUTE", "120"))
+MAIL_BURST = int(os.environ.get("MAIL_BURST", "20"))
+CAFE_MAILS = ('cafe_notification', 'cafe_confirmation')
+
+# Executors for blocking storage and mail work ("thread" or "process")
+STORAGE_POOL = os.environ.get("STORAGE_POOL", "thread")
+STORAGE_POOL_SIZE = int(os.environ.get("STORAGE_POOL_SIZE", "4"))
+STORAGE_POOL_QUEUE = int(os.environ.get("STORAGE_POOL_QUEUE", "64"))
+MAIL_POOL = os.environ.get("MAIL_POOL", "thread")
+MAIL_POOL_SIZE = int(os.environ.get("MAIL_POOL_SIZE", str(MAIL_WORKERS)))
+MAIL_POOL_QUEUE = int(os.environ.get("MAIL_POOL_QUEUE", "64"))
+
+store: Optional[RegistrationStore] = None
+mail_queue: Optional[MailQueue] = None
+health_monitor: Optional[HealthMonitor] = None
+storage_executor: Optional[BoundedExecutor] = None
+mail_executor: Optional[BoundedExecutor] = None
+# Bulk campaigns sending in this process, by name, so shutdown can pause them;
+# starting and pausing go through the campaign row, which every worker sees
+bulk_senders: Dict[str, Tuple[bulk_mail.BulkSender, asyncio.Task]] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the storage backend and start the mail queue on startup; shut both down cleanly"""
+    global store, mail_queue, health_monitor, storage_executor, mail_executor
+    templates.load_all()
+    storage_executor = BoundedExecutor('storage', STORAGE_POOL, STORAGE_POOL_SIZE, STORAGE_POOL_QUEUE)
+    mail_executor = BoundedExecutor('mail', MAIL_POOL, MAIL_POOL_SIZE, MAIL_POOL_QUEUE)
+    store = create_store()
+    await store.open()
+    if not SCHEMA_READY:
+        await store.migrate()
+    mail_queue = MailQueue(
+        store,
+        senders={
+            'cafe_notification': send_cafe_notification_email,
+            'cafe_confirmation': send_cafe_confirmation_email,
+        },
+        workers=MAIL_WORKERS,
+        max_attempts=MAIL_MAX_ATTEMPTS,
+        executor=mail_executor,
+        max_per_minute=MAIL_MAX_PER_MINUTE,
+        burst=MAIL_BURST,
+    )
+    await mail_queue.start()
+    health_monitor = HealthMonitor(store, smtp_pool, DB_PATH.parent, extra=executor_stats)
+    await health_monitor.start()
+    yield
+    for sender, _ in bulk_senders.values():
+        sender.stop()
+    await asyncio.gather(*(task for _, task in bulk_senders.values()), return_exceptions=True)
+    await health_monitor.stop()
+    await mail_queue.stop()
+    await store.close()
+    storage_executor.shutdown()
+    mail_executor.shutdown()
+    smtp_pool.close()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON responses rendered by serialization.py's backend (orjson when installed)"""
+
+    def render(self, content) -> bytes:
+        return serialization.dumps(content)
+
+
+app = FastAPI(
+    title="SamenWerkt Aanmelding PolitiekCafe API", version="1.0.0", lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
 
 # Enable CORS for localhost development
 app.add_middleware(
@@ -35,110 +161,234 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database setup
-DB_PATH = Path(__file__).parent / "politekcafe.db"
-
 def init_database():
-    """Initialize SQLite database with cafe table"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cafe_registrations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            naam TEXT NOT NULL,
-            email TEXT NOT NULL,
-            lid_van_samenwerkt TEXT NOT NULL,
-            komt_naar_cafe TEXT NOT NULL,
-            telefoonnummer TEXT NOT NULL,
-            opmerkingen TEXT,
-            timestamp TEXT NOT NULL,
-            submission_data TEXT NOT NULL
+    """Bring the SQLite schema up to date by applying pending migrations"""
+    run_migrations(db)
+
+def create_store() -> RegistrationStore:
+    """The storage backend selected by STORAGE_BACKEND"""
+    global group_writer
+    if STORAGE_BACKEND not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', expected one of {STORAGE_BACKENDS}")
+    if STORAGE_BACKEND == 'postgres':
+        return PostgresStore(DATABASE_URL, CAFE_EVENT, CAFE_MAILS)
+    if DB_GROUP_COMMIT:
+        group_writer = GroupCommitWriter(
+            db,
+            insert_registrations,
+            max_batch=DB_GROUP_COMMIT_BATCH,
+            max_delay=DB_GROUP_COMMIT_DELAY_MS / 1000,
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    return SQLiteStore(db, store_cafe_submission, storage_executor, group_writer)
+
+
+# At least 8 digits, optionally with a leading + and spaces, dashes, dots, slashes or parentheses
+PHONE_PATTERN = r'^\+?(?:[\s().\/-]*\d){8,}[\s().\/-]*$'
+# Plain addresses that email-validator accepts and returns unchanged: short dot-separated
+# local parts, a lower-case domain without double hyphens and a common TLD. Segment
+# counts and lengths stay within its 64 and 63 character limits
+FAST_EMAIL_PATTERN = (
+    r'^[A-Za-z0-9_%+-]{1,20}(?:\.[A-Za-z0-9_%+-]{1,20}){0,2}'
+    r'@(?:[a-z0-9]{1,20}(?:-[a-z0-9]{1,20}){0,2}\.){1,4}(?:nl|com|net|org|eu|be|de|info)$'
+)
+
+class CafeEmailStr(str):
+    """EmailStr, with the common case checked by FAST_EMAIL_PATTERN inside pydantic-core
 
-# Initialize database on startup
-init_database()
+    Anything the pattern does not match goes through EmailStr, so the
+    accepted addresses and their normalized form are the same as with
+    EmailStr alone.
+    """
 
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        return core_schema.union_schema(
+            [handler.generate_schema(constr(max_length=254, pattern=FAST_EMAIL_PATTERN)),
+             handler.generate_schema(EmailStr)],
+            mode='left_to_right',
+            custom_error_type='email_invalid',
+            custom_error_message='value is not a valid email address',
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema: core_schema.CoreSchema, handler: GetJsonSchemaHandler) -> dict:
+        return {'type': 'string', 'format': 'email'}
 
 class CafeForm(BaseModel):
-    """Pydantic model for political café form validation"""
-    naam: str
-    email: EmailStr
-    lidVanSamenwerkt: str
-    komtNaarCafe: str
-    telefoonnummer: str
+    """Pydantic model for political café form validation
+
+    The field constraints are checked by pydantic-core itself, without
+    Python validators, except for email addresses that CafeEmailStr hands
+    to email-validator. CAFE_FORM_MESSAGES supplies the Dutch messages.
+    """
+    naam: constr(strip_whitespace=True, min_length=2)
+    email: CafeEmailStr
+    lidVanSamenwerkt: Literal['ja', 'nee']
+    komtNaarCafe: Literal['ja', 'nee']
+    telefoonnummer: constr(strip_whitespace=True, pattern=PHONE_PATTERN)
     opmerkingen: Optional[str] = None
+
+# Dutch message per CafeForm field, whichever constraint failed
+CAFE_FORM_MESSAGES = {
+    'naam': 'Naam is verplicht en moet minimaal 2 karakters bevatten.',
+    'email': 'Vul een geldig e-mailadres in.',
+    'telefoonnummer': 'Telefoonnummer is verplicht en moet minimaal 8 cijfers bevatten.',
+    'lidVanSamenwerkt': 'Geef aan of u lid bent van SamenWerkt.',
+    'komtNaarCafe': 'Geef aan of u naar het politiek café komt.',
+}
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    """The usual 422 response, with the Dutch messages for café form fields"""
+    errors = exc.errors()
+    for error in errors:
+        loc = error.get('loc', ())
+        if len(loc) >= 2 and loc[0] == 'body' and loc[1] in CAFE_FORM_MESSAGES:
+            error['msg'] = CAFE_FORM_MESSAGES[loc[1]]
+    return FastJSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
+def validate_cafe_form(data: Dict[str, Any]) -> CafeForm:
+    """Validate a café form body as the validation stage; errors become the usual 422"""
+    with STAGE_DURATION.time('validation'), span('validation'):
+        try:
+            return CafeForm.model_validate(data)
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**error, 'loc': ('body', *error['loc'])} for error in e.errors(include_url=False)],
+                body=data
+            )
+
+
+# Kept as one constant so sqlite3's statement cache reuses the prepared INSERT
+INSERT_REGISTRATION_SQL = '''
+    INSERT INTO cafe_registrations (
+        naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer,
+        opmerkingen, timestamp, submission_data,
+        registration_uid, email_normalized, event, idempotency_key,
+        lid_van_samenwerkt_flag, komt_naar_cafe_flag
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def find_registration(cursor, email_normalized: str, idempotency_key: Optional[str]) -> Optional[str]:
+    """Return the registration ID of an earlier submission with the same key or email"""
+    if idempotency_key:
+        row = cursor.execute(
+            "SELECT registration_uid FROM cafe_registrations WHERE idempotency_key = ?",
+            (idempotency_key,)
+        ).fetchone()
+        if row:
+            return row[0]
+    row = cursor.execute(
+        "SELECT registration_uid FROM cafe_registrations WHERE email_normalized = ? AND event = ?",
+        (email_normalized, CAFE_EVENT)
+    ).fetchone()
+    return row[0] if row else None
+
+def insert_registrations(cursor, submissions: List[Tuple[dict, Optional[str]]]) -> List[Tuple[str, bool]]:
+    """Insert new registrations and queue their emails inside the caller's transaction
     
-    @field_validator('naam')
-    @classmethod
-    def validate_naam(cls, v):
-        if not v or len(v.strip()) < 2:
-            raise ValueError('Naam is verplicht en moet minimaal 2 karakters bevatten.')
-        return v.strip()
-    
-    @field_validator('telefoonnummer')
-    @classmethod
-    def validate_telefoonnummer(cls, v):
-        if not v or len(v.strip()) < 8:
-            raise ValueError('Telefoonnummer is verplicht en moet minimaal 8 cijfers bevatten.')
-        return v.strip()
+    Takes (form_data, idempotency_key) pairs and returns (registration_uid, created)
+    for each. Repeats of an earlier submission return the original ID and are
+    neither stored nor mailed again.
+    """
+    results: List[Optional[Tuple[str, bool]]] = [None] * len(submissions)
+    new_rows, new_forms, new_indexes = [], [], []
+    seen: Dict[tuple, str] = {}
     
-    @field_validator('lidVanSamenwerkt')
-    @classmethod
-    def validate_lid_van_samenwerkt(cls, v):
-        if v not in ['ja', 'nee']:
-            raise ValueError('Geef aan of u lid bent van SamenWerkt.')
-        return v
+    for index, (form_data, idempotency_key) in enumerate(submissions):
+        email_normalized = normalize_email(form_data.get('email', ''))
+        # Check earlier submissions in this batch first, then the table
+        original = seen.get(('key', idempotency_key)) or seen.get(('email', email_normalized))
+        if original is None:
+            original = find_registration(cursor, email_normalized, idempotency_key)
+        if original:
+            results[index] = (original, False)
+            continue
+        
+        seen[('email', email_normalized)] = form_data['id']
+        if idempotency_key:
+            seen[('key', idempotency_key)] = form_data['id']
+        new_rows.append(registration_row(form_data, CAFE_EVENT, idempotency_key))
+        new_forms.append(form_data)
+        new_indexes.append(index)
+        results[index] = (form_data['id'], True)
     
-    @field_validator('komtNaarCafe')
-    @classmethod
-    def validate_komt_naar_cafe(cls, v):
-        if v not in ['ja', 'nee']:
-            raise ValueError('Geef aan of u naar het politiek café komt.')
-        return v
-
-
-def store_cafe_submission(form_data: dict) -> bool:
-    """Store café form submission in SQLite database"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+    if new_rows:
+        cursor.executemany(INSERT_REGISTRATION_SQL, new_rows)
         
-        # Extract main fields
-        naam = form_data.get('naam', '')
-        email = form_data.get('email', '')
-        lid_van_samenwerkt = form_data.get('lidVanSamenwerkt', '')
-        komt_naar_cafe = form_data.get('komtNaarCafe', '')
-        telefoonnummer = form_data.get('telefoonnummer', '')
-        opmerkingen = form_data.get('opmerkingen', '')
-        timestamp = datetime.now().isoformat()
-        submission_data = json.dumps(form_data)
+        # Rowids are consecutive because the transaction holds the write lock
+        last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        registration_ids = range(last_id - len(new_rows) + 1, last_id + 1)
         
-        cursor.execute('''
-            INSERT INTO cafe_registrations (
-                naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer,
-                opmerkingen, timestamp, submission_data
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer,
-            opmerkingen, timestamp, submission_data
-        ))
+        # Queue the emails so they are sent after the response; each
+        # submission is serialized once and its mails share the payload
+        enqueue_mails(cursor, [
+            (registration_id, kind, payload)
+            for registration_id, payload in zip(registration_ids, map(submission_payload, new_forms))
+            for kind in CAFE_MAILS
+        ])
+    return results
+
+def store_cafe_submission(form_data: dict, idempotency_key: Optional[str] = None) -> Optional[Tuple[str, bool]]:
+    """Store café form submission and queue its emails in one SQLite transaction
+    
+    Returns (registration_uid, created), or None when storing failed.
+    """
+    try:
+        with db.transaction() as cursor:
+            result = insert_registrations(cursor, [(form_data, idempotency_key)])[0]
         
-        conn.commit()
-        conn.close()
-        logger.info(f"Stored café registration for {naam}")
-        return True
+        if result[1]:
+            logger.info(f"Stored café registration for {form_data.get('naam', '')}")
+        return result
         
     except Exception as e:
         logger.error(f"Error storing café registration: {e}")
-        return False
+        return None
+
+
+class IdempotencyCache:
+    """Bounded in-memory map from recent Idempotency-Key values to registration IDs"""
+    
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+    
+    def get(self, key: str) -> Optional[str]:
+        registration_uid = self._entries.get(key)
+        if registration_uid is not None:
+            self._entries.move_to_end(key)
+        return registration_uid
+    
+    def put(self, key: str, registration_uid: str):
+        self._entries[key] = registration_uid
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+idempotency_cache = IdempotencyCache()
+
+# Admission control for /api/cafe, per client IP and for all clients together; 0 turns a limit off
+RATE_LIMIT_CLIENT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_CLIENT_PER_MINUTE", "10"))
+RATE_LIMIT_CLIENT_BURST = int(os.environ.get("RATE_LIMIT_CLIENT_BURST", "5"))
+RATE_LIMIT_GLOBAL_PER_MINUTE = float(os.environ.get("RATE_LIMIT_GLOBAL_PER_MINUTE", "600"))
+RATE_LIMIT_GLOBAL_BURST = int(os.environ.get("RATE_LIMIT_GLOBAL_BURST", "100"))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+client_limiter = (
+    RateLimiter(RATE_LIMIT_CLIENT_PER_MINUTE, RATE_LIMIT_CLIENT_BURST, RATE_LIMIT_MAX_CLIENTS)
+    if RATE_LIMIT_CLIENT_PER_MINUTE > 0 else None
+)
+global_bucket = (
+    TokenBucket(RATE_LIMIT_GLOBAL_PER_MINUTE / 60, RATE_LIMIT_GLOBAL_BURST)
+    if RATE_LIMIT_GLOBAL_PER_MINUTE > 0 else None
+)
 
 def send_notification_email(form_data: dict) -> bool:
     """Send notification email to organization"""
+    # The café mails are built by email_templates; only these membership mails need email.mime
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
     try:
         # Create message
         msg = MIMEMultipart('alternative')
@@ -162,10 +412,8 @@ def send_notification_email(form_data: dict) -> bool:
         html_part = MIMEText(html_content, 'html', 'utf-8')
         msg.attach(html_part)
         
-        # Send via local Postfix
-        server = smtplib.SMTP('localhost', 25)
-        server.sendmail('info@samenwerktwbd.nl', 'info@samenwerktwbd.nl', msg.as_string())
-        server.quit()
+        # Send via local Postfix over a pooled connection
+        smtp_pool.sendmail('info@samenwerktwbd.nl', 'info@samenwerktwbd.nl', msg.as_string())
         
         logger.info(f"Notification email sent for {form_data['naam']}")
         return True
@@ -176,6 +424,8 @@ def send_notification_email(form_data: dict) -> bool:
 
 def send_confirmation_email(form_data: dict) -> bool:
     """Send confirmation email to the form sender"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
     try:
         # Create message
         msg = MIMEMultipart('alternative')
@@ -233,10 +483,8 @@ def send_confirmation_email(form_data: dict) -> bool:
         html_part = MIMEText(html_content, 'html', 'utf-8')
         msg.attach(html_part)
         
-        # Send via local Postfix
-        server = smtplib.SMTP('localhost', 25)
-        server.sendmail('info@samenwerktwbd.nl', form_data['email'], msg.as_string())
-        server.quit()
+        # Send via local Postfix over a pooled connection
+        smtp_pool.sendmail('info@samenwerktwbd.nl', form_data['email'], msg.as_string())
         
         logger.info(f"Confirmation email sent to {form_data['email']}")
         return True
@@ -245,181 +493,172 @@ def send_confirmation_email(form_data: dict) -> bool:
         logger.error(f"Error sending confirmation email: {e}")
         return False
 
-def send_cafe_notification_email(form_data: dict) -> bool:
+def cafe_template_context(form_data: dict, payload: Optional[str] = None) -> dict:
+    """Values shared by the café email templates, computed once per message
+
+    payload is the submission as queued; it is shown as is instead of
+    serializing form_data again.
+    """
+    timestamp = form_data.get('timestamp')
+    registered = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    opmerkingen = form_data.get('opmerkingen')
+    
+    return {
+        'naam': form_data['naam'],
+        'email': form_data['email'],
+        'telefoonnummer': form_data['telefoonnummer'],
+        'lidVanSamenwerkt': form_data['lidVanSamenwerkt'],
+        'komtNaarCafe': form_data['komtNaarCafe'],
+        'datum': registered.strftime('%d-%m-%Y'),
+        'cafe_status': "komt graag naar het politiek café" if form_data['komtNaarCafe'] == 'ja' else "komt mogelijk niet naar het politiek café",
+        'member_status': "bent lid van SamenWerkt" if form_data['lidVanSamenwerkt'] == 'ja' else "bent nog geen lid van SamenWerkt",
+        'opmerkingen_html': f"<p><strong>Opmerkingen:</strong> {escape(opmerkingen)}</p>" if opmerkingen else "",
+        'gegevens_json': submission_payload(form_data) if payload is None else payload,
+    }
+
+# The senders raise on failure; the mail queue records the error and decides on a retry
+
+def send_cafe_notification_email(payload: str):
     """Send notification email to organization for café registration"""
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = f"Nieuwe aanmelding politiek café: {form_data['naam']}"
-        msg['From'] = 'info@samenwerktwbd.nl'
-        msg['To'] = 'info@samenwerktwbd.nl'
-        
-        # Create HTML content
-        html_content = f"""
-        <h2>Nieuwe aanmelding politiek café</h2>
-        <p><strong>Naam:</strong> {form_data['naam']}</p>
-        <p><strong>E-mail:</strong> {form_data['email']}</p>
-        <p><strong>Telefoon:</strong> {form_data['telefoonnummer']}</p>
-        <p><strong>Lid van SamenWerkt:</strong> {form_data['lidVanSamenwerkt']}</p>
-        <p><strong>Komt naar café:</strong> {form_data['komtNaarCafe']}</p>
-        <p><strong>Datum aanmelding:</strong> {datetime.now().strftime('%d-%m-%Y')}</p>
-        {f"<p><strong>Opmerkingen:</strong> {form_data['opmerkingen']}</p>" if form_data.get('opmerkingen') else ""}
-        <hr>
-        <h3>Volledige gegevens:</h3>
-        <pre>{json.dumps(form_data, indent=2, ensure_ascii=False)}</pre>
-        """
-        
-        html_part = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(html_part)
-        
-        # Send via local Postfix
-        server = smtplib.SMTP('localhost', 25)
-        server.sendmail('info@samenwerktwbd.nl', 'info@samenwerktwbd.nl', msg.as_string())
-        server.quit()
-        
-        logger.info(f"Café notification email sent for {form_data['naam']}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Error sending café notification email: {e}")
-        return False
+    form_data = loads(payload)
+    with STAGE_DURATION.time('render'):
+        html_content = templates.render('cafe_notification.html', cafe_template_context(form_data, payload))
+        message = build_html_message(
+            f"Nieuwe aanmelding politiek café: {form_data['naam']}",
+            'info@samenwerktwbd.nl', 'info@samenwerktwbd.nl', html_content
+        )
+    
+    # Send via local Postfix over a pooled connection
+    smtp_pool.sendmail('info@samenwerktwbd.nl', 'info@samenwerktwbd.nl', message)
+    
+    logger.info(f"Café notification email sent for {form_data['naam']}")
 
-def send_cafe_confirmation_email(form_data: dict) -> bool:
+def send_cafe_confirmation_email(payload: str):
     """Send confirmation email to café form sender"""
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = "Bevestiging aanmelding politiek café SamenWerkt"
-        msg['From'] = 'info@samenwerktwbd.nl'
-        msg['To'] = form_data['email']
-        
-        # Create HTML content
-        cafe_status = "komt graag naar het politiek café" if form_data['komtNaarCafe'] == 'ja' else "komt mogelijk niet naar het politiek café"
-        member_status = "bent lid van SamenWerkt" if form_data['lidVanSamenwerkt'] == 'ja' else "bent nog geen lid van SamenWerkt"
-        
-        html_content = f"""
-        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-            <div style="background: linear-gradient(135deg, #e53935, #4caf50); padding: 20px; text-align: center;">
-                <h1 style="color: white; margin: 0;">SamenWerkt Wijk bij Duurstede</h1>
-                <h2 style="color: white; margin: 10px 0 0 0; font-size: 18px;">Politiek Café</h2>
-            </div>
-            
-            <div style="padding: 30px; background-color: #f9f9f9;">
-                <h2 style="color: #333;">Beste {form_data['naam']},</h2>
-                
-                <p style="font-size: 16px; line-height: 1.6; color: #555;">
-                    Hartelijk dank voor uw aanmelding voor het politiek café van SamenWerkt!
-                </p>
-                
-                <p style="font-size: 16px; line-height: 1.6; color: #555;">
-                    We hebben uw aanmelding in goede orde ontvangen. U {cafe_status} en {member_status}.
-                </p>
-                
-                <div style="background: white; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #8B4513;">
-                    <h3 style="margin-top: 0; color: #333;">Uw gegevens:</h3>
-                    <p><strong>Naam:</strong> {form_data['naam']}</p>
-                    <p><strong>E-mailadres:</strong> {form_data['email']}</p>
-                    <p><strong>Telefoonnummer:</strong> {form_data['telefoonnummer']}</p>
-                    <p><strong>Lid van SamenWerkt:</strong> {form_data['lidVanSamenwerkt']}</p>
-                    <p><strong>Komt naar café:</strong> {form_data['komtNaarCafe']}</p>
-                    <p><strong>Datum aanmelding:</strong> {datetime.now().strftime('%d-%m-%Y')}</p>
-                    {f"<p><strong>Opmerkingen:</strong> {form_data['opmerkingen']}</p>" if form_data.get('opmerkingen') else ""}
-                </div>
-                
-                <p style="font-size: 16px; line-height: 1.6; color: #555;">
-                    We sturen u binnenkort meer informatie over de datum, tijd en locatie van het eerstvolgende politiek café.
-                </p>
-                
-                <p style="font-size: 16px; line-height: 1.6; color: #555;">
-                    Heeft u vragen? Neem gerust contact met ons op via 
-                    <a href="mailto:info@samenwerktwbd.nl" style="color: #e53935;">info@samenwerktwbd.nl</a>.
-                </p>
-                
-                <p style="font-size: 16px; line-height: 1.6; color: #555;">
-                    Tot ziens bij het politiek café!<br>
-                    Het team van SamenWerkt Wijk bij Duurstede
-                </p>
-                
-                <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #ddd; text-align: center;">
-                    <p style="font-size: 14px; color: #888;">
-                        <a href="https://samenwerktwijkbijduurstede.nl" style="color: #e53935;">samenwerktwijkbijduurstede.nl</a><br>
-                        Lokale politiek die ertoe doet
-                    </p>
-                </div>
-            </div>
-        </div>
-        """
-        
-        html_part = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(html_part)
-        
-        # Send via local Postfix
-        server = smtplib.SMTP('localhost', 25)
-        server.sendmail('info@samenwerktwbd.nl', form_data['email'], msg.as_string())
-        server.quit()
-        
-        logger.info(f"Café confirmation email sent to {form_data['email']}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Error sending café confirmation email: {e}")
-        return False
+    form_data = loads(payload)
+    with STAGE_DURATION.time('render'):
+        html_content = templates.render('cafe_confirmation.html', cafe_template_context(form_data, payload))
+        message = build_html_message(
+            "Bevestiging aanmelding politiek café SamenWerkt",
+            'info@samenwerktwbd.nl', form_data['email'], html_content
+        )
+    
+    # Send via local Postfix over a pooled connection
+    smtp_pool.sendmail('info@samenwerktwbd.nl', form_data['email'], message)
+    
+    logger.info(f"Café confirmation email sent to {form_data['email']}")
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Log all incoming requests"""
-    logger.info(f"{datetime.now().isoformat()} - {request.method} {request.url.path}")
-    response = await call_next(request)
-    return response
+    """Log all incoming requests, record request metrics and trace sampled requests"""
+    started = time.perf_counter()
+    status = 500
+    # Admins can ask for a profile of one request
+    force_trace = request.headers.get('x-profile') == '1' and is_admin(request.headers.get('x-admin-token'))
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        async with maybe_trace(f"{request.method} {request.url.path}", force=force_trace) as trace:
+            response = await call_next(request)
+        status = response.status_code
+        if trace:
+            response.headers['X-Trace-Id'] = trace.trace_id
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - started
+        # Label by route template, so arbitrary paths cannot create new series
+        route = request.scope.get('route')
+        route = route.path if route else 'unmatched'
+        REQUESTS.inc(request.method, route, str(status))
+        REQUEST_DURATION.observe(elapsed, route)
+        logger.info(f"{request.method} {request.url.path} {status} {elapsed * 1000:.1f}ms")
 
 
-@app.post("/api/cafe")
-async def submit_cafe_form(form: CafeForm):
-    """Handle café form submission - store in database and send email"""
+def cafe_success_response(registration_uid: str, replayed: bool = False) -> FastJSONResponse:
+    """Rendered here in one step, skipping FastAPI's encoding pass over a returned dict"""
+    return FastJSONResponse(
+        {
+            "success": True,
+            "message": "Formulier succesvol verzonden! U ontvangt een bevestigingsmail.",
+            "id": registration_uid
+        },
+        headers={"Idempotent-Replayed": "true"} if replayed else None
+    )
+
+
+async def cafe_admission(request: Request):
+    """Reject café submissions over the per-client or global rate with 429"""
+    scope, retry_after = 'client', 0.0
+    if client_limiter is not None:
+        retry_after = client_limiter.check(request.client.host if request.client else 'unknown')
+    if not retry_after and global_bucket is not None:
+        scope, retry_after = 'global', global_bucket.take()
+    if retry_after:
+        RATE_LIMITED.inc(scope)
+        logger.warning(f"Café submission rate limited ({scope}), retry after {retry_after:.1f}s")
+        raise HTTPException(
+            status_code=429,
+            detail="Te veel aanmeldingen in korte tijd. Probeer het over enkele ogenblikken opnieuw.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+
+# The body is validated in the endpoint so the validation stage can be timed;
+# the schema still documents it as a CafeForm
+@app.post(
+    "/api/cafe", dependencies=[Depends(cafe_admission)],
+    openapi_extra={"requestBody": {"content": {"application/json": {"schema": CafeForm.model_json_schema()}}}},
+)
+async def submit_cafe_form(
+    body: Dict[str, Any] = Body(...),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    """Handle café form submission - store in database and queue emails"""
+    form = validate_cafe_form(body)
     try:
-        form_data = form.dict()
+        # A retried request answers from memory without touching the database or SMTP
+        if idempotency_key:
+            registration_uid = idempotency_cache.get(idempotency_key)
+            if registration_uid:
+                return cafe_success_response(registration_uid, replayed=True)
+        
+        form_data = form.model_dump()
         
         # Add metadata
         form_data['timestamp'] = datetime.now().isoformat()
-        form_data['id'] = str(int(datetime.now().timestamp() * 1000))
+        form_data['id'] = new_ulid()
         
         # Store in database
-        if not store_cafe_submission(form_data):
+        with STAGE_DURATION.time('store'), span('store'):
+            stored = await store.store_submission(form_data, idempotency_key)
+        if stored is None:
             raise HTTPException(
                 status_code=500,
                 detail="Fout bij opslaan van gegevens."
             )
         
-        # Send notification email to organization
-        notification_sent = send_cafe_notification_email(form_data)
+        registration_uid, created = stored
+        if idempotency_key:
+            idempotency_cache.put(idempotency_key, registration_uid)
         
-        # Send confirmation email to form sender
-        confirmation_sent = send_cafe_confirmation_email(form_data)
+        if created:
+            # Notification and confirmation emails are sent by the mail queue workers
+            if mail_queue:
+                mail_queue.wake()
         
-        if notification_sent and confirmation_sent:
-            return {
-                "success": True,
-                "message": "Formulier succesvol verzonden! U ontvangt een bevestigingsmail."
-            }
-        elif notification_sent:
-            return {
-                "success": True,
-                "message": "Formulier opgeslagen en melding verstuurd. Bevestigingsmail kon niet worden verzonden.",
-                "warning": "Bevestigingsmail mislukt"
-            }
-        elif confirmation_sent:
-            return {
-                "success": True,
-                "message": "Formulier opgeslagen en bevestigingsmail verzonden. Interne melding mislukt.",
-                "warning": "Interne melding mislukt"
-            }
-        else:
-            return {
-                "success": True,
-                "message": "Formulier opgeslagen, maar e-mails konden niet worden verstuurd. We nemen contact met u op.",
-                "warning": "E-mail verzending mislukt"
-            }
+        # A duplicate of an earlier registration gets no new row and no new emails
+        return cafe_success_response(registration_uid, replayed=not created)
             
+    except ExecutorSaturated as e:
+        # Backpressure: ask the client to come back instead of queueing without bound
+        logger.warning(f"Café submission rejected: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="De server is momenteel erg druk. Probeer het over enkele ogenblikken opnieuw.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except HTTPException:
+        raise
     except ValueError as e:
         # Validation errors
         raise HTTPException(
@@ -437,15 +676,206 @@ async def submit_cafe_form(form: CafeForm):
             detail="Er is een onverwachte fout opgetreden bij het verwerken van uw aanmelding."
         )
 
+def executor_stats() -> dict:
+    return {
+        "executors": {
+            executor.name: executor.stats()
+            for executor in (storage_executor, mail_executor) if executor
+        }
+    }
+
+HEALTH_OK_BODY = b'{"status":"OK"}'
+HEALTH_ERROR_BODY = b'{"status":"ERROR"}'
+
 @app.get("/api/health")
 async def health_check():
-    """Health check endpoint"""
+    """Latest snapshot of the background health checks"""
+    if health_monitor is None or not health_monitor.body:
+        return Response(HEALTH_ERROR_BODY, status_code=503, media_type="application/json")
+    return Response(health_monitor.body, media_type="application/json")
+
+@app.get("/api/health/live")
+async def health_live():
+    """Liveness: the event loop still completes health check rounds"""
+    if health_monitor is not None and health_monitor.live:
+        return Response(HEALTH_OK_BODY, media_type="application/json")
+    return Response(HEALTH_ERROR_BODY, status_code=503, media_type="application/json")
+
+@app.get("/api/health/ready")
+async def health_ready():
+    """Readiness: the database is writable and the disk has room, as of the last round"""
+    if health_monitor is not None and health_monitor.ready:
+        return Response(HEALTH_OK_BODY, media_type="application/json")
+    return Response(HEALTH_ERROR_BODY, status_code=503, media_type="application/json")
+
+def health_check_values() -> dict:
+    """Outcome of each check in the last health round, read when metrics are scraped"""
+    checks = health_monitor.snapshot.get('checks', {}) if health_monitor else {}
+    return {(name,): int(check['ok']) for name, check in checks.items()}
+
+def mail_queue_depth() -> dict:
+    queue = health_monitor.snapshot.get('checks', {}).get('mail_queue', {}) if health_monitor else {}
+    return {(status,): queue[status] for status in ('pending', 'sending', 'failed') if status in queue}
+
+HEALTH_CHECK_OK = metrics.Gauge(
+    'health_check_ok', 'Result of each background health check in the last round (1 passed, 0 failed)',
+    ('check',), callback=health_check_values
+)
+MAIL_QUEUE_DEPTH = metrics.Gauge(
+    'mail_queue_depth', 'Mails in the queue by status, as of the last health round',
+    ('status',), callback=mail_queue_depth
+)
+
+def executor_in_flight() -> dict:
+    """Active and queued tasks per executor, read when metrics are scraped"""
+    values = {}
+    for executor in (storage_executor, mail_executor):
+        if executor:
+            stats = executor.stats()
+            values[(executor.name, 'active')] = stats['active']
+            values[(executor.name, 'queued')] = stats['queued']
+    return values
+
+EXECUTOR_IN_FLIGHT = metrics.Gauge(
+    'executor_tasks_in_flight', 'Tasks running or waiting in the storage and mail executors',
+    ('executor', 'state'), callback=executor_in_flight
+)
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Request, stage, database and SMTP metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
+
+def require_admin(token: Optional[str]):
+    """Reject admin requests without the configured X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Geen toegang.")
+
+@app.get("/api/admin/stats")
+async def admin_stats(x_admin_token: Optional[str] = Header(None)):
+    """Attendance and membership statistics, per day and per week, including archived months"""
+    require_admin(x_admin_token)
+    stats = await store.registration_stats()
     return {
-        "status": "OK",
         "timestamp": datetime.now().isoformat(),
-        "database": "SQLite",
-        "email": "Postfix (localhost:25)"
+        **stats
     }
 
+TRACE_ID_RE = re.compile(r'^[0-9A-HJKMNP-TV-Z]{26}$')
+
+@app.get("/api/admin/registrations/{registration_uid}/mail")
+async def admin_mail_status(registration_uid: str, x_admin_token: Optional[str] = Header(None)):
+    """Delivery status of the notification and confirmation mail of one registration"""
+    require_admin(x_admin_token)
+    mails = await store.mail_status(registration_uid)
+    if not mails:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {"id": registration_uid, "mails": mails}
+
+@app.get("/api/admin/profiles")
+async def admin_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Saved traces and profiles, newest first"""
+    require_admin(x_admin_token)
+    return {"traces": await asyncio.to_thread(tracing.list_traces)}
+
+@app.get("/api/admin/profiles/{trace_id}")
+async def admin_profile(trace_id: str, format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """One saved trace as JSON, or its raw cProfile data with ?format=pstats"""
+    require_admin(x_admin_token)
+    if not TRACE_ID_RE.match(trace_id) or format not in ("json", "pstats"):
+        raise HTTPException(status_code=404, detail="Not Found")
+    path = tracing.PROFILE_DIR / f"{trace_id}.{'prof' if format == 'pstats' else 'json'}"
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if format == "pstats":
+        return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+    return FileResponse(path, media_type="application/json")
+
+class BulkRequest(BaseModel):
+    name: str
+    subject: Optional[str] = None
+    template: str = bulk_mail.DEFAULT_TEMPLATE
+    context: Dict[str, str] = {}
+    audience: str = 'all'
+    retry_failed: bool = False
+
+def require_bulk_db() -> Database:
+    """Bulk campaigns live in the SQLite database"""
+    if not isinstance(store, SQLiteStore):
+        raise HTTPException(status_code=409, detail="Bulkmail is alleen beschikbaar met SQLite-opslag.")
+    return store.db
+
+async def run_bulk_campaign(name: str, sender: bulk_mail.BulkSender):
+    try:
+        result = await sender.send()
+        logger.info(f"Bulk campaign {name} finished: {result}")
+    except bulk_mail.BulkMailError as e:
+        logger.warning(f"Bulk campaign {name} paused: {e}")
+    except Exception as e:
+        logger.error(f"Bulk campaign {name} failed: {e}")
+    finally:
+        bulk_senders.pop(name, None)
+
+@app.post("/api/admin/bulk", status_code=202)
+async def admin_bulk_send(request: BulkRequest, x_admin_token: Optional[str] = Header(None)):
+    """Create a bulk campaign, or resume an existing one, and send it in the background"""
+    require_admin(x_admin_token)
+    bulk_db = require_bulk_db()
+    campaign = await asyncio.to_thread(bulk_mail.get_campaign, bulk_db, request.name)
+    if campaign is None:
+        if not request.subject:
+            raise HTTPException(status_code=400, detail="Een onderwerp is verplicht voor een nieuwe campagne.")
+        try:
+            campaign = await asyncio.to_thread(
+                bulk_mail.create_campaign, bulk_db, request.name, request.subject, request.context,
+                request.template, request.audience
+            )
+        except bulk_mail.BulkMailError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if campaign['status'] == bulk_mail.CAMPAIGN_DONE and not request.retry_failed:
+        raise HTTPException(status_code=409, detail="Deze campagne is al verzonden.")
+    sender = bulk_mail.BulkSender(bulk_db, campaign)
+    try:
+        # Claimed before answering, so a campaign running on another worker is refused here
+        await asyncio.to_thread(sender.claim, request.retry_failed)
+    except bulk_mail.BulkMailError:
+        raise HTTPException(status_code=409, detail="Deze campagne wordt al verzonden.")
+    task = asyncio.create_task(run_bulk_campaign(request.name, sender))
+    bulk_senders[request.name] = (sender, task)
+    return await asyncio.to_thread(bulk_mail.campaign_status, bulk_db, request.name)
+
+@app.get("/api/admin/bulk/{name}")
+async def admin_bulk_status(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Progress of a bulk campaign"""
+    require_admin(x_admin_token)
+    status = await asyncio.to_thread(bulk_mail.campaign_status, require_bulk_db(), name)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return status
+
+@app.post("/api/admin/bulk/{name}/pause")
+async def admin_bulk_pause(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Pause a running campaign after its current batches; sending it again resumes
+
+    The request is stored in the campaign row, so it reaches the sender
+    whichever worker runs it; the status shows 'pausing' until it stopped.
+    """
+    require_admin(x_admin_token)
+    bulk_db = require_bulk_db()
+    if not await asyncio.to_thread(bulk_mail.request_pause, bulk_db, name):
+        status = await asyncio.to_thread(bulk_mail.campaign_status, bulk_db, name)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        if status['status'] != bulk_mail.CAMPAIGN_PAUSING:
+            raise HTTPException(status_code=409, detail="Deze campagne wordt niet verzonden.")
+        return status
+    return await asyncio.to_thread(bulk_mail.campaign_status, bulk_db, name)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8521)
\ No newline at end of file
+    from serve import main
+    main()
\ No newline at end of file
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Load benchmark: POST /api/cafe at increasing concurrency
+
+Drives the real application with distinct registrations, either in-process
+through httpx's ASGI transport or over HTTP against a uvicorn server started
+for the run. Mail goes to a local SMTPSink, and every run uses a fresh
+database, so nothing reaches Postfix or politekcafe.db. For each concurrency
+level it reports throughput, latency percentiles and the error rate.
+The request and mail rate limits are turned off, because every request
+comes from the same client.
+
+Usage: python benchmarks/bench_api_load.py [--mode asgi|uvicorn|both]
+           [--concurrency 1,10,50,100] [--requests 500] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+
+from common import REPO_ROOT, latency_summary, sample_form, write_report
+from smtp_sink import SMTPSink
+
+# Measure the server, not the admission control
+UNLIMITED = {
+    'RATE_LIMIT_CLIENT_PER_MINUTE': '0',
+    'RATE_LIMIT_GLOBAL_PER_MINUTE': '0',
+    'MAIL_MAX_PER_MINUTE': '0',
+}
+
+# Distinct email addresses across all levels and modes of one run
+_registration_numbers = itertools.count()
+
+
+async def drive(client: httpx.AsyncClient, requests: int, concurrency: int) -> dict:
+    """Send requests with a fixed number of concurrent clients and summarize the results"""
+    latencies, statuses = [], Counter()
+    remaining = iter(range(requests))
+
+    async def client_loop():
+        for _ in remaining:
+            form = sample_form(next(_registration_numbers))
+            started = time.perf_counter()
+            try:
+                response = await client.post('/api/cafe', json=form)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    errors = sum(count for status, count in statuses.items() if status != 200)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(requests / elapsed, 1),
+        'error_rate': round(errors / requests, 4),
+        'statuses': {str(status): count for status, count in statuses.items()},
+        **latency_summary(latencies),
+    }
+
+
+async def run_asgi(levels, requests: int, directory: Path, sink: SMTPSink) -> list:
+    """Run the app in this process and call it through the ASGI transport"""
+    os.environ.update(UNLIMITED)
+    import backend
+    import smtp_pool
+    from db import Database
+
+    smtp_pool.smtp_pool.host, smtp_pool.smtp_pool.port = sink.host, sink.port
+    backend.db = Database(directory / 'asgi.db')
+    results = []
+    async with backend.lifespan(backend.app):
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for concurrency in levels:
+                results.append(dict(mode='asgi', **await drive(client, requests, concurrency)))
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_until_healthy(base_url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get('/api/health')).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become healthy")
+
+
+async def run_uvicorn(levels, requests: int, directory: Path, sink: SMTPSink) -> list:
+    """Start uvicorn in a subprocess and call it over HTTP"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        DB_PATH=str(directory / 'uvicorn.db'),
+        SMTP_HOST=sink.host,
+        SMTP_PORT=str(sink.port),
+        **UNLIMITED,
+    )
+    # The backend logs every request; keep that out of the report
+    log = open(directory / 'uvicorn.log', 'wb')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'backend:app', '--host', '127.0.0.1',
+         '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        await wait_until_healthy(base_url)
+        for concurrency in levels:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+                results.append(dict(mode='uvicorn', **await drive(client, requests, concurrency)))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        log.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('asgi', 'uvicorn', 'both'), default='both')
+    parser.add_argument('--concurrency', default='1,10,50,100',
+                        help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per concurrency level")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    sink = SMTPSink(keep_messages=False).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = Path(tmp)
+            if args.mode in ('asgi', 'both'):
+                results += asyncio.run(run_asgi(levels, args.requests, directory, sink))
+            if args.mode in ('uvicorn', 'both'):
+                results += asyncio.run(run_uvicorn(levels, args.requests, directory, sink))
+    finally:
+        sink.stop()
+
+    write_report({
+        'benchmark': 'api_load',
+        'mails_received': sink.message_count,
+        'results': results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
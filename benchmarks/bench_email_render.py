@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: render cost per café confirmation email
+
+Compares the original f-string + MIMEMultipart + as_string() path with the
+precompiled template engine and single-pass message builder. No mail is
+sent; only rendering and serialization are timed.
+
+Usage: python benchmarks/bench_email_render.py [--messages 5000]
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import backend
+from email_templates import build_html_message, templates
+
+SAMPLE_FORM = {
+    'naam': 'Jan Jansen',
+    'email': 'jan@example.com',
+    'lidVanSamenwerkt': 'ja',
+    'komtNaarCafe': 'ja',
+    'telefoonnummer': '0612345678',
+    'opmerkingen': 'Ik neem een introducé mee.',
+    'timestamp': '2025-01-01T20:00:00',
+    'id': '1735758000000',
+}
+
+
+def legacy_cafe_confirmation(form_data: dict) -> str:
+    """The confirmation mail as it was built before the template engine"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = "Bevestiging aanmelding politiek café SamenWerkt"
+    msg['From'] = 'info@samenwerktwbd.nl'
+    msg['To'] = form_data['email']
+
+    cafe_status = "komt graag naar het politiek café" if form_data['komtNaarCafe'] == 'ja' else "komt mogelijk niet naar het politiek café"
+    member_status = "bent lid van SamenWerkt" if form_data['lidVanSamenwerkt'] == 'ja' else "bent nog geen lid van SamenWerkt"
+
+    html_content = f"""
+        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+            <div style="background: linear-gradient(135deg, #e53935, #4caf50); padding: 20px; text-align: center;">
+                <h1 style="color: white; margin: 0;">SamenWerkt Wijk bij Duurstede</h1>
+                <h2 style="color: white; margin: 10px 0 0 0; font-size: 18px;">Politiek Café</h2>
+            </div>
+            
+            <div style="padding: 30px; background-color: #f9f9f9;">
+                <h2 style="color: #333;">Beste {form_data['naam']},</h2>
+                
+                <p style="font-size: 16px; line-height: 1.6; color: #555;">
+                    Hartelijk dank voor uw aanmelding voor het politiek café van SamenWerkt!
+                </p>
+                
+                <p style="font-size: 16px; line-height: 1.6; color: #555;">
+                    We hebben uw aanmelding in goede orde ontvangen. U {cafe_status} en {member_status}.
+                </p>
+                
+                <div style="background: white; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #8B4513;">
+                    <h3 style="margin-top: 0; color: #333;">Uw gegevens:</h3>
+                    <p><strong>Naam:</strong> {form_data['naam']}</p>
+                    <p><strong>E-mailadres:</strong> {form_data['email']}</p>
+                    <p><strong>Telefoonnummer:</strong> {form_data['telefoonnummer']}</p>
+                    <p><strong>Lid van SamenWerkt:</strong> {form_data['lidVanSamenwerkt']}</p>
+                    <p><strong>Komt naar café:</strong> {form_data['komtNaarCafe']}</p>
+                    <p><strong>Datum aanmelding:</strong> {datetime.now().strftime('%d-%m-%Y')}</p>
+                    {f"<p><strong>Opmerkingen:</strong> {form_data['opmerkingen']}</p>" if form_data.get('opmerkingen') else ""}
+                </div>
+                
+                <p style="font-size: 16px; line-height: 1.6; color: #555;">
+                    We sturen u binnenkort meer informatie over de datum, tijd en locatie van het eerstvolgende politiek café.
+                </p>
+                
+                <p style="font-size: 16px; line-height: 1.6; color: #555;">
+                    Heeft u vragen? Neem gerust contact met ons op via 
+                    <a href="mailto:info@samenwerktwbd.nl" style="color: #e53935;">info@samenwerktwbd.nl</a>.
+                </p>
+                
+                <p style="font-size: 16px; line-height: 1.6; color: #555;">
+                    Tot ziens bij het politiek café!<br>
+                    Het team van SamenWerkt Wijk bij Duurstede
+                </p>
+                
+                <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #ddd; text-align: center;">
+                    <p style="font-size: 14px; color: #888;">
+                        <a href="https://samenwerktwijkbijduurstede.nl" style="color: #e53935;">samenwerktwijkbijduurstede.nl</a><br>
+                        Lokale politiek die ertoe doet
+                    </p>
+                </div>
+            </div>
+        </div>
+        """
+
+    msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+    return msg.as_string()
+
+
+def template_cafe_confirmation(form_data: dict) -> bytes:
+    """The confirmation mail as the backend builds it now"""
+    html_content = templates.render('cafe_confirmation.html', backend.cafe_template_context(form_data))
+    return build_html_message(
+        "Bevestiging aanmelding politiek café SamenWerkt",
+        'info@samenwerktwbd.nl', form_data['email'], html_content
+    )
+
+
+def measure(name: str, builder, messages: int) -> dict:
+    builder(SAMPLE_FORM)  # warm up
+    started = time.perf_counter()
+    for _ in range(messages):
+        builder(SAMPLE_FORM)
+    elapsed = time.perf_counter() - started
+    return {
+        'path': name,
+        'messages': messages,
+        'seconds': round(elapsed, 4),
+        'us_per_message': round(elapsed / messages * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    templates.load_all()
+
+    report = {
+        'benchmark': 'email_render',
+        'results': [
+            measure('legacy_fstring_multipart', legacy_cafe_confirmation, args.messages),
+            measure('compiled_template', template_cafe_confirmation, args.messages),
+        ],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
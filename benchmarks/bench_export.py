@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the export pipeline at 1k, 100k and 1M registrations
+
+For each table size a database is filled with synthetic registrations.
+Each export mode then runs in its own subprocess, so the peak memory
+(max RSS) reported is that of the mode alone:
+
+    pandas      read_database + statistics + process_dataframe + create_excel_export
+    streaming   the lite engine: create_excel_export_streaming + the SQL
+                statistics query
+    csv         the lite engine writing CSV: create_csv_export + the SQL
+                statistics query
+    stats       the SQL statistics query on its own
+
+The timer starts before export_members is imported, so the seconds include
+loading pandas or openpyxl where a mode needs them, as a real run would.
+The pandas mode is skipped above --pandas-max-rows, because it holds the
+whole table and workbook in memory. No mail is sent.
+
+Usage: python benchmarks/bench_export.py [--sizes 1000,100000,1000000]
+           [--modes pandas,streaming,csv,stats] [--output FILE]
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common import write_report
+from db import Database
+from migrations import run_migrations
+
+INSERT_SQL = '''
+    INSERT INTO cafe_registrations (
+        naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer, opmerkingen,
+        timestamp, submission_data, registration_uid, email_normalized, event,
+        lid_van_samenwerkt_flag, komt_naar_cafe_flag
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def synthetic_rows(count: int):
+    for n in range(count):
+        member, attending = n % 2 == 0, n % 3 != 0
+        email = f"lid{n}@example.com"
+        yield (
+            f"Deelnemer {n}", email, 'ja' if member else 'nee', 'ja' if attending else 'nee',
+            '0612345678', 'Graag een plek bij het raam' if n % 10 == 0 else None,
+            f"2025-{1 + n % 12:02d}-{1 + n % 28:02d}T{n % 24:02d}:00:00.{n % 1000000:06d}",
+            '{}', f"BENCH{n:021d}", email, 'politiek-cafe', int(member), int(attending),
+        )
+
+
+def create_database(path: Path, rows: int):
+    db = Database(path).open()
+    run_migrations(db)
+    with db.transaction() as cursor:
+        cursor.executemany(INSERT_SQL, synthetic_rows(rows))
+    db.close()
+
+
+def run_mode(mode: str, db_path: Path) -> dict:
+    """Run one export mode in this process and time it"""
+    started = time.perf_counter()
+    import export_members
+    from stats import registration_stats
+
+    export_members.DB_PATH = db_path
+    filepath = None
+    if mode == 'pandas':
+        from stats import registration_stats_from_dataframe
+        df = export_members.read_database()
+        registration_stats_from_dataframe(df)
+        filepath = export_members.create_excel_export(export_members.process_dataframe(df))
+    elif mode in ('streaming', 'csv'):
+        conn = sqlite3.connect(db_path)
+        until_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cafe_registrations").fetchone()[0]
+        if mode == 'csv':
+            filepath, _ = export_members.create_csv_export(0, until_id)
+        else:
+            filepath, _ = export_members.create_excel_export_streaming(0, until_id)
+        registration_stats(conn)
+        conn.close()
+    elif mode == 'stats':
+        conn = sqlite3.connect(db_path)
+        registration_stats(conn)
+        conn.close()
+    else:
+        raise ValueError(f"Unknown mode {mode}")
+    elapsed = time.perf_counter() - started
+
+    file_bytes = None
+    if filepath:
+        file_bytes = os.path.getsize(filepath)
+        os.remove(filepath)
+    return {
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'file_bytes': file_bytes,
+    }
+
+
+def measure(mode: str, rows: int, db_path: Path) -> dict:
+    child = subprocess.run(
+        [sys.executable, __file__, '--child', mode, str(db_path)],
+        capture_output=True, text=True,
+    )
+    if child.returncode != 0:
+        return {'mode': mode, 'rows': rows, 'error': child.stderr.strip().splitlines()[-1:]}
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    return {
+        'mode': mode,
+        'rows': rows,
+        **result,
+        'rows_per_second': round(rows / result['seconds'], 1) if result['seconds'] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000', help="Comma-separated table sizes")
+    parser.add_argument('--modes', default='pandas,streaming,csv,stats', help="Comma-separated export modes")
+    parser.add_argument('--pandas-max-rows', type=int, default=100000)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'DB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.child:
+        mode, db_path = args.child
+        print(json.dumps(run_mode(mode, Path(db_path))))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in (int(size) for size in args.sizes.split(',')):
+            db_path = Path(tmp) / f"export_{rows}.db"
+            started = time.perf_counter()
+            create_database(db_path, rows)
+            print(f"Created {rows} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            for mode in args.modes.split(','):
+                if mode == 'pandas' and rows > args.pandas_max_rows:
+                    results.append({'mode': mode, 'rows': rows, 'skipped': "above --pandas-max-rows"})
+                    continue
+                results.append(measure(mode, rows, db_path))
+                print(f"  {mode}: {results[-1]}", file=sys.stderr)
+            db_path.unlink()
+
+    write_report({'benchmark': 'export', 'results': results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-request commits versus group commit for registration inserts
+
+Inserts the same number of registrations with a fixed number of concurrent
+submitters, once with one transaction per registration and once through
+GroupCommitWriter, each on a fresh database file.
+
+Usage: python benchmarks/bench_group_commit.py [--rows 2000] [--concurrency 50]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import backend
+from common import sample_form, write_report
+from db import Database, GroupCommitWriter
+
+
+def registration(n: int) -> dict:
+    """sample_form(n) with the metadata the backend adds before storing"""
+    return dict(sample_form(n), timestamp='2025-01-01T20:00:00', id=str(n))
+
+
+def open_database(directory: Path, name: str, synchronous: str) -> Database:
+    db = Database(directory / f"{name}.db", synchronous=synchronous).open()
+    backend.db = db
+    backend.init_database()
+    return db
+
+
+async def run_per_request(db: Database, rows: int, concurrency: int):
+    """One transaction (and fsync) per registration"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def insert_one(form_data):
+        with db.transaction() as cursor:
+            backend.insert_registrations(cursor, [(form_data, None)])
+
+    async def submit(n):
+        async with semaphore:
+            await asyncio.to_thread(insert_one, registration(n))
+
+    await asyncio.gather(*(submit(n) for n in range(rows)))
+
+
+async def run_group_commit(db: Database, rows: int, concurrency: int, batch: int, delay_ms: float):
+    """Concurrent registrations share transactions through GroupCommitWriter"""
+    writer = GroupCommitWriter(db, backend.insert_registrations, max_batch=batch, max_delay=delay_ms / 1000)
+    await writer.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def submit(n):
+        async with semaphore:
+            await writer.submit((registration(n), None))
+
+    await asyncio.gather(*(submit(n) for n in range(rows)))
+    await writer.stop()
+
+
+def measure(name: str, directory: Path, synchronous: str, rows: int, runner) -> dict:
+    db = open_database(directory, name, synchronous)
+    started = time.perf_counter()
+    asyncio.run(runner(db))
+    elapsed = time.perf_counter() - started
+    stored = db.execute("SELECT COUNT(*) FROM cafe_registrations")[0][0]
+    db.close()
+    if stored != rows:
+        # A failing insert must not pass for a fast one
+        raise RuntimeError(f"{name} stored {stored} of {rows} registrations")
+    return {
+        'path': name,
+        'synchronous': synchronous,
+        'rows': stored,
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(rows / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--delay-ms', type=float, default=5.0)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        results = [
+            measure('per_request', directory, 'FULL', args.rows,
+                    lambda db: run_per_request(db, args.rows, args.concurrency)),
+            measure('per_request_normal', directory, 'NORMAL', args.rows,
+                    lambda db: run_per_request(db, args.rows, args.concurrency)),
+            measure('group_commit', directory, 'FULL', args.rows,
+                    lambda db: run_group_commit(db, args.rows, args.concurrency, args.batch, args.delay_ms)),
+        ]
+
+    write_report({'benchmark': 'group_commit', 'concurrency': args.concurrency, 'results': results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the per-registration work in the backend
+
+Times CafeForm validation (valid and rejected input), store_cafe_submission
+against a fresh SQLite file, and building the notification and confirmation
+emails. No mail is sent. Each operation reports its mean and percentile
+latency per call.
+
+CafeForm validation is also timed against LegacyCafeForm, the earlier
+model with a Python field validator per field, so one run shows the cost
+per request before and after the move to pydantic-core constraints.
+
+Usage: python benchmarks/bench_micro.py [--iterations 2000] [--output FILE]
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, EmailStr, ValidationError, field_validator
+
+import backend
+from common import SAMPLE_FORM, latency_summary, sample_form, write_report
+from db import Database
+from email_templates import build_html_message, templates
+from ids import new_ulid
+
+
+def measure(name: str, operation, iterations: int, warmup: int = 50) -> dict:
+    """Call operation(i) iterations times and summarize the per-call latency"""
+    for i in range(warmup):
+        operation(-i - 1)
+    durations = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        operation(i)
+        durations.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {
+        'operation': name,
+        'iterations': iterations,
+        'ops_per_second': round(iterations / elapsed, 1),
+        **{key.replace('_ms', '_us'): round(value * 1000, 2) for key, value in latency_summary(durations).items()},
+    }
+
+
+class LegacyCafeForm(BaseModel):
+    """The earlier CafeForm: EmailStr and a Python field validator per field"""
+    naam: str
+    email: EmailStr
+    lidVanSamenwerkt: str
+    komtNaarCafe: str
+    telefoonnummer: str
+    opmerkingen: Optional[str] = None
+
+    @field_validator('naam')
+    @classmethod
+    def validate_naam(cls, v):
+        if not v or len(v.strip()) < 2:
+            raise ValueError('Naam is verplicht en moet minimaal 2 karakters bevatten.')
+        return v.strip()
+
+    @field_validator('telefoonnummer')
+    @classmethod
+    def validate_telefoonnummer(cls, v):
+        if not v or len(v.strip()) < 8:
+            raise ValueError('Telefoonnummer is verplicht en moet minimaal 8 cijfers bevatten.')
+        return v.strip()
+
+    @field_validator('lidVanSamenwerkt')
+    @classmethod
+    def validate_lid_van_samenwerkt(cls, v):
+        if v not in ['ja', 'nee']:
+            raise ValueError('Geef aan of u lid bent van SamenWerkt.')
+        return v
+
+    @field_validator('komtNaarCafe')
+    @classmethod
+    def validate_komt_naar_cafe(cls, v):
+        if v not in ['ja', 'nee']:
+            raise ValueError('Geef aan of u naar het politiek café komt.')
+        return v
+
+
+def validate_legacy(data: dict) -> LegacyCafeForm:
+    """LegacyCafeForm with the same stage timing as backend.validate_cafe_form"""
+    with backend.STAGE_DURATION.time('validation'), backend.span('validation'):
+        return LegacyCafeForm.model_validate(data)
+
+
+def validator(validate):
+    """Operations that validate a valid and an invalid form with validate, then dump it"""
+    def valid(_):
+        validate(SAMPLE_FORM).model_dump()
+
+    def invalid(_):
+        try:
+            validate(dict(SAMPLE_FORM, naam=' ', telefoonnummer='abc'))
+        except (ValidationError, RequestValidationError):
+            pass
+    return valid, invalid
+
+
+def store(i):
+    form_data = dict(sample_form(i + 1_000_000), timestamp=datetime.now().isoformat(), id=new_ulid())
+    backend.store_cafe_submission(form_data)
+
+
+def stored_form(i) -> dict:
+    return dict(SAMPLE_FORM, timestamp='2025-01-01T20:00:00', id=new_ulid())
+
+
+def build_notification(i):
+    form_data = stored_form(i)
+    html_content = templates.render('cafe_notification.html', backend.cafe_template_context(form_data))
+    build_html_message(f"Nieuwe aanmelding politiek café: {form_data['naam']}",
+                       'info@samenwerktwbd.nl', 'info@samenwerktwbd.nl', html_content)
+
+
+def build_confirmation(i):
+    form_data = stored_form(i)
+    html_content = templates.render('cafe_confirmation.html', backend.cafe_template_context(form_data))
+    build_html_message("Bevestiging aanmelding politiek café SamenWerkt",
+                       'info@samenwerktwbd.nl', form_data['email'], html_content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    templates.load_all()
+
+    validate_valid, validate_invalid = validator(backend.validate_cafe_form)
+    legacy_valid, legacy_invalid = validator(validate_legacy)
+    results = [
+        measure('cafe_form_validate', validate_valid, args.iterations),
+        measure('cafe_form_validate_invalid', validate_invalid, args.iterations),
+        measure('cafe_form_validate_legacy', legacy_valid, args.iterations),
+        measure('cafe_form_validate_invalid_legacy', legacy_invalid, args.iterations),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        backend.db = Database(Path(tmp) / 'micro.db').open()
+        backend.init_database()
+        results.append(measure('store_cafe_submission', store, args.iterations))
+        backend.db.close()
+    results += [
+        measure('build_cafe_notification', build_notification, args.iterations),
+        measure('build_cafe_confirmation', build_confirmation, args.iterations),
+    ]
+
+    write_report({'benchmark': 'micro', 'results': results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold start of the backend and the command-line tools
+
+Each entry point is imported in a fresh interpreter under -X importtime,
+--repeats times. For every module the report gives the cumulative import
+time (median and minimum over the runs), the wall time of the whole
+process, and the direct imports that cost the most. It also lists which
+heavy optional modules were loaded, so a top-level import of pandas or
+smtplib sneaking back in shows up even when the timings are noisy.
+
+An empty interpreter (python -c pass) is measured as the baseline.
+
+Usage: python benchmarks/bench_startup.py [--modules backend,export_members]
+           [--repeats 7] [--top 8] [--output FILE]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from common import REPO_ROOT, write_report
+
+DEFAULT_MODULES = ('backend', 'export_members', 'bulk_mail', 'archive')
+
+# Modules that should only load when a code path needs them
+HEAVY_MODULES = (
+    'pandas', 'openpyxl', 'pyarrow', 'asyncpg', 'smtplib',
+    'email.mime.multipart', 'multiprocessing', 'cProfile',
+)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    """(depth, cumulative microseconds, module) for each line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, int(cumulative), name.strip()))
+    return entries
+
+
+def direct_imports(entries: List[Tuple[int, int, str]], module: str) -> Dict[str, int]:
+    """Cumulative time of the modules that module imported first, by name
+
+    importtime lists a module after everything it imported, one level deeper.
+    """
+    for index, (depth, _, name) in enumerate(entries):
+        if name == module:
+            children = {}
+            for child_depth, cumulative, child in reversed(entries[:index]):
+                if child_depth <= depth:
+                    break
+                if child_depth == depth + 1:
+                    children[child] = cumulative
+            return children
+    return {}
+
+
+def run_import(statement: str) -> Tuple[float, str]:
+    """Run statement in a fresh interpreter; returns (wall seconds, importtime output)"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"'{statement}' failed: {completed.stderr.strip().splitlines()[-1]}")
+    return elapsed, completed.stderr
+
+
+def measure_module(module: str, repeats: int, top: int) -> dict:
+    import_us, process_seconds = [], []
+    entries = []
+    for _ in range(repeats):
+        elapsed, stderr = run_import(f"import {module}")
+        entries = parse_importtime(stderr)
+        cumulative = next((us for _, us, name in reversed(entries) if name == module), 0)
+        import_us.append(cumulative)
+        process_seconds.append(elapsed)
+    loaded = {name for _, _, name in entries}
+    children = direct_imports(entries, module)
+    return {
+        'operation': f"import {module}",
+        'repeats': repeats,
+        'import_ms': round(statistics.median(import_us) / 1000, 2),
+        'import_min_ms': round(min(import_us) / 1000, 2),
+        'process_ms': round(statistics.median(process_seconds) * 1000, 2),
+        'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in loaded],
+        'top_imports': [
+            {'module': name, 'ms': round(us / 1000, 2)}
+            for name, us in sorted(children.items(), key=lambda item: -item[1])[:top]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', default=','.join(DEFAULT_MODULES),
+                        help="Comma-separated modules to import")
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--top', type=int, default=8, help="Number of direct imports to list per module")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    baseline = []
+    for _ in range(args.repeats):
+        elapsed, _ = run_import('pass')
+        baseline.append(elapsed)
+    results = [{
+        'operation': 'interpreter',
+        'repeats': args.repeats,
+        'process_ms': round(statistics.median(baseline) * 1000, 2),
+    }]
+    for module in args.modules.split(','):
+        print(f"Importing {module}...", file=sys.stderr)
+        results.append(measure_module(module, args.repeats, args.top))
+
+    write_report({'benchmark': 'startup', 'results': results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the benchmark scripts: sample data, latency summaries
+and JSON report output with enough metadata to compare runs between commits.
+"""
+
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+SAMPLE_FORM = {
+    'naam': 'Jan Jansen',
+    'email': 'jan@example.com',
+    'lidVanSamenwerkt': 'ja',
+    'komtNaarCafe': 'ja',
+    'telefoonnummer': '0612345678',
+    'opmerkingen': 'Ik neem een introducé mee.',
+}
+
+
+def sample_form(n: int) -> dict:
+    """Form fields for a distinct registration, so duplicate detection does not skip it"""
+    return dict(SAMPLE_FORM, email=f"bench{n}@example.com", komtNaarCafe='ja' if n % 3 else 'nee')
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(seconds: List[float]) -> dict:
+    """Mean, p50, p90, p99 and max of a list of durations, in milliseconds"""
+    values = sorted(seconds)
+    if not values:
+        return {'mean_ms': 0.0, 'p50_ms': 0.0, 'p90_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    return {
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(values, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def write_report(report: dict, output: Optional[str]):
+    """Print a report as JSON and optionally write it to a file"""
+    report = dict(report, environment=environment())
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text)
+    print(text)
+    sys.stdout.flush()
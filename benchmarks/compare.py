@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files from run_all.py
+
+Matches results by benchmark and by their identifying fields (operation,
+path, mode, concurrency, rows) and prints the relative change of every
+timing and throughput figure. Changes beyond --threshold in the wrong
+direction are marked as regressions, and the exit status is 1 if any
+were found.
+
+Usage: python benchmarks/compare.py base.json new.json [--threshold 10]
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+KEY_FIELDS = ('operation', 'path', 'mode', 'synchronous', 'concurrency', 'rows')
+
+# Figures where a higher value is better; for all other numbers lower is better
+HIGHER_IS_BETTER = ('rows_per_second', 'requests_per_second', 'ops_per_second')
+COMPARED_SUFFIXES = ('_ms', '_us', 'seconds', '_per_second', '_per_message', 'peak_rss_mb', 'error_rate')
+
+
+def index_results(report: dict) -> dict:
+    results = {}
+    for benchmark, data in report.get('benchmarks', {}).items():
+        for result in data.get('results', []):
+            key = (benchmark,) + tuple(f"{field}={result[field]}" for field in KEY_FIELDS if field in result)
+            results[key] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help="Regression threshold in percent")
+    args = parser.parse_args()
+
+    base_report = json.loads(Path(args.base).read_text())
+    new_report = json.loads(Path(args.new).read_text())
+    base, new = index_results(base_report), index_results(new_report)
+    print(f"base {base_report['environment'].get('commit')}  ->  new {new_report['environment'].get('commit')}")
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        for field, old_value in base[key].items():
+            new_value = new[key].get(field)
+            if (not field.endswith(COMPARED_SUFFIXES) or not isinstance(old_value, (int, float))
+                    or not isinstance(new_value, (int, float)) or not old_value):
+                continue
+            change = (new_value - old_value) / old_value * 100
+            worse = -change if field in HIGHER_IS_BETTER else change
+            marker = '  REGRESSION' if worse > args.threshold else ''
+            regressions += bool(marker)
+            print(f"{' '.join(key):<60} {field:<20} {old_value:>12} -> {new_value:<12} {change:+7.1f}%{marker}")
+
+    for key in sorted(base.keys() - new.keys()):
+        print(f"{' '.join(key):<60} missing in new results")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
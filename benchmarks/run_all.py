@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite and collect all reports in one JSON file
+
+Each benchmark runs as its own process. --quick uses small sizes, which
+is enough to spot large regressions in a few minutes. Compare two result
+files with benchmarks/compare.py.
+
+Usage: python benchmarks/run_all.py --output results/<commit>.json [--quick]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from common import environment
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+
+# (script, full arguments, quick arguments)
+SUITE = [
+    ('bench_micro.py', [], ['--iterations', '500']),
+    ('bench_email_render.py', [], ['--messages', '1000']),
+    ('bench_group_commit.py', [], ['--rows', '500']),
+    ('bench_api_load.py', [], ['--concurrency', '1,10,50', '--requests', '200']),
+    ('bench_export.py', [], ['--sizes', '1000,10000']),
+    ('bench_startup.py', [], ['--repeats', '3']),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', required=True, help="File to write the combined results to")
+    parser.add_argument('--quick', action='store_true', help="Use small sizes")
+    parser.add_argument('--only', help="Comma-separated benchmark names, e.g. micro,export")
+    args = parser.parse_args()
+    only = set(args.only.split(',')) if args.only else None
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for script, full_args, quick_args in SUITE:
+            name = script[len('bench_'):-len('.py')]
+            if only and name not in only:
+                continue
+            output = Path(tmp) / f"{name}.json"
+            command = [sys.executable, str(BENCHMARK_DIR / script), '--output', str(output)]
+            command += quick_args if args.quick else full_args
+            print(f"Running {script}...", file=sys.stderr)
+            completed = subprocess.run(command, stdout=subprocess.DEVNULL)
+            if completed.returncode != 0 or not output.exists():
+                reports[name] = {'error': f"exit status {completed.returncode}"}
+                continue
+            report = json.loads(output.read_text())
+            report.pop('environment', None)
+            reports[name] = report
+
+    combined = {'environment': environment(), 'quick': args.quick, 'benchmarks': reports}
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(combined, indent=2))
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
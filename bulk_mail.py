@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Bulk mailing to café registrants, such as the announcement of the date,
+time and location that the confirmation mail promises
+
+A campaign names one template, a subject and the values the template needs
+besides the recipient's naam and email. The template is compiled once and
+rendered per recipient.
+
+Recipients are the registrations for the campaign's event. Registrations
+made before events were recorded count for CAFE_EVENT: migration 8 gives
+the oldest one per address the event, and repeats keep no event. Only the
+first registration per address is mailed.
+
+Sending is resumable and sends every mail at most once:
+
+- recipients are read with a keyset cursor (id > last seen id, in batches),
+  so no read transaction stays open while mail goes out
+- before a batch is sent its recipients get a 'sending' row in
+  bulk_deliveries, committed in the same transaction that selects them;
+  after the SMTP session returns, each row becomes 'sent' or 'failed'
+- a restarted run skips every recipient that already has a row. Rows left
+  in 'sending' by a crash may or may not have been delivered and are not
+  sent again; failed rows are retried with --retry-failed
+- a lease on the campaign keeps two processes from running it at once
+- a pause request sets the campaign row to 'pausing'; the sender reads the
+  row with every batch it claims, so any process can pause a campaign
+- only a run that reaches the last recipient marks the campaign done; a
+  stop request or an error pauses it, and sending it again resumes it.
+  A batch that cannot be rendered or sent as a whole is recorded as
+  failed and pauses the campaign; refused recipients only fail themselves
+
+Campaigns and deliveries are kept in the SQLite database only; with
+STORAGE_BACKEND=postgres the backend refuses bulk requests.
+
+Several workers send batches over their own pooled SMTP session, and a
+token bucket caps the overall rate: a claimed batch waits for one token
+per recipient before it is sent.
+
+Usage: python bulk_mail.py send --name NAME --subject SUBJECT
+           [--template cafe_announcement.html] [--set key=value ...]
+           [--audience all|attending|members] [--retry-failed] [--dry-run]
+       python bulk_mail.py status --name NAME
+       python bulk_mail.py pause --name NAME
+"""
+
+import asyncio
+import os
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from db import Database
+from email_templates import TemplateEngine, build_html_message, templates
+from rate_limit import TokenBucket
+from serialization import dumps_text, loads
+from smtp_pool import SMTPPool, is_rejection, smtp_pool
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = Path(os.environ.get("DB_PATH", Path(__file__).parent / "politekcafe.db"))
+CAFE_EVENT = os.environ.get("CAFE_EVENT", "politiek-cafe")
+FROM_EMAIL = "info@samenwerktwbd.nl"
+DEFAULT_TEMPLATE = "cafe_announcement.html"
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "20"))
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", "2"))
+BULK_MAX_PER_MINUTE = float(os.environ.get("BULK_MAX_PER_MINUTE", "300"))
+BULK_LEASE_SECONDS = 300.0
+
+# Extra conditions on cafe_registrations per audience
+AUDIENCES = {
+    'all': '',
+    'attending': 'AND komt_naar_cafe_flag = 1',
+    'members': 'AND lid_van_samenwerkt_flag = 1',
+}
+
+# Campaign and delivery status values
+CAMPAIGN_NEW = 'new'
+CAMPAIGN_RUNNING = 'running'
+CAMPAIGN_PAUSING = 'pausing'
+CAMPAIGN_PAUSED = 'paused'
+CAMPAIGN_DONE = 'done'
+DELIVERY_SENDING = 'sending'
+DELIVERY_SENT = 'sent'
+DELIVERY_FAILED = 'failed'
+
+
+class BulkMailError(Exception):
+    """A campaign cannot be created or started"""
+
+
+CAMPAIGN_COLUMNS = ('id', 'name', 'template', 'subject', 'context', 'audience', 'event',
+                    'status', 'last_registration_id', 'created_at', 'finished_at')
+
+
+def get_campaign(db: Database, name: str) -> Optional[dict]:
+    rows = db.execute(f"SELECT {', '.join(CAMPAIGN_COLUMNS)} FROM bulk_campaigns WHERE name = ?", (name,))
+    if not rows:
+        return None
+    campaign = dict(zip(CAMPAIGN_COLUMNS, rows[0]))
+    campaign['context'] = loads(campaign['context'])
+    return campaign
+
+
+def create_campaign(db: Database, name: str, subject: str, context: Dict[str, str],
+                    template: str = DEFAULT_TEMPLATE, audience: str = 'all',
+                    event: str = CAFE_EVENT, engine: TemplateEngine = templates) -> dict:
+    """Create a campaign, or return the existing one with the same name
+
+    The template is rendered once with a sample recipient, so a missing
+    value fails here instead of halfway through the send.
+    """
+    if audience not in AUDIENCES:
+        raise BulkMailError(f"Unknown audience '{audience}', expected one of {tuple(AUDIENCES)}")
+    try:
+        engine.get(template).render({**context, 'naam': 'Voorbeeld', 'email': 'voorbeeld@example.com'})
+    except KeyError as e:
+        raise BulkMailError(f"Template {template} needs a value for {e}")
+    except OSError as e:
+        raise BulkMailError(f"Template {template} not found: {e}")
+    except ValueError as e:
+        raise BulkMailError(str(e))
+
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT OR IGNORE INTO bulk_campaigns (
+                name, template, subject, context, audience, event, status, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (name, template, subject, dumps_text(context), audience, event,
+              CAMPAIGN_NEW, datetime.now().isoformat()))
+    return get_campaign(db, name)
+
+
+def recipient_filter(campaign: dict) -> Tuple[str, tuple]:
+    """SQL conditions and parameters selecting the recipients of a campaign from cafe_registrations r"""
+    event = "(event = ? OR event IS NULL)" if campaign['event'] == CAFE_EVENT else "event = ?"
+    audience = AUDIENCES[campaign['audience']]
+    # Addresses compare case-insensitively; rows that were never backfilled have no email_normalized
+    address = "COALESCE(r.email_normalized, lower(trim(r.email)))"
+    # Unqualified columns refer to r outside the subquery and to e inside it
+    return f'''{event} {audience}
+          AND NOT EXISTS (
+              SELECT 1 FROM cafe_registrations e
+              WHERE (e.email_normalized = {address}
+                     OR (e.email_normalized IS NULL AND lower(trim(e.email)) = {address}))
+                AND e.id < r.id AND {event} {audience}
+          )''', (campaign['event'], campaign['event'])
+
+
+def request_pause(db: Database, name: str) -> bool:
+    """Ask the sender of a running campaign to pause; False when it is not running"""
+    with db.transaction() as cursor:
+        cursor.execute(
+            "UPDATE bulk_campaigns SET status = ? WHERE name = ? AND status = ?",
+            (CAMPAIGN_PAUSING, name, CAMPAIGN_RUNNING)
+        )
+        return cursor.rowcount > 0
+
+
+def campaign_status(db: Database, name: str) -> Optional[dict]:
+    """A campaign with its delivery counts and the number of recipients still to go"""
+    campaign = get_campaign(db, name)
+    if campaign is None:
+        return None
+    counts = {DELIVERY_SENDING: 0, DELIVERY_SENT: 0, DELIVERY_FAILED: 0}
+    counts.update(db.execute(
+        "SELECT status, COUNT(*) FROM bulk_deliveries WHERE campaign_id = ? GROUP BY status",
+        (campaign['id'],)
+    ))
+    recipients, params = recipient_filter(campaign)
+    remaining = db.execute(f'''
+        SELECT COUNT(*) FROM cafe_registrations r
+        WHERE {recipients}
+          AND NOT EXISTS (
+              SELECT 1 FROM bulk_deliveries d WHERE d.campaign_id = ? AND d.registration_id = r.id
+          )
+    ''', (*params, campaign['id']))[0][0]
+    return {
+        'name': campaign['name'],
+        'status': campaign['status'],
+        'template': campaign['template'],
+        'audience': campaign['audience'],
+        'sent': counts[DELIVERY_SENT],
+        'failed': counts[DELIVERY_FAILED],
+        # Interrupted mid-send: delivered or not, these are not sent again
+        'uncertain': counts[DELIVERY_SENDING],
+        'remaining': remaining,
+        'created_at': campaign['created_at'],
+        'finished_at': campaign['finished_at'],
+    }
+
+
+class BulkSender:
+    """Sends one campaign in batches with a fixed number of workers and a rate cap"""
+
+    def __init__(
+        self,
+        db: Database,
+        campaign: dict,
+        smtp: SMTPPool = smtp_pool,
+        engine: TemplateEngine = templates,
+        batch_size: int = BULK_BATCH_SIZE,
+        concurrency: int = BULK_CONCURRENCY,
+        max_per_minute: float = BULK_MAX_PER_MINUTE,
+        lease_seconds: float = BULK_LEASE_SECONDS,
+        from_addr: str = FROM_EMAIL,
+    ):
+        self.db = db
+        self.campaign = campaign
+        self.smtp = smtp
+        self.engine = engine
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.from_addr = from_addr
+        self._throttle = TokenBucket(max_per_minute / 60, batch_size) if max_per_minute > 0 else None
+        self._after_id = 0
+        self._stopping = False
+        self.sent = 0
+        self.failed = 0
+
+    def stop(self):
+        """Finish the batches in progress, then pause the campaign"""
+        self._stopping = True
+
+    def _claim_campaign(self, retry_failed: bool) -> int:
+        """Take the campaign lease; returns the id to resume after
+
+        A running or pausing campaign can only be taken over once the lease
+        of the process sending it has expired.
+        """
+        now = time.time()
+        # A finished campaign only runs again to retry its failures
+        startable = (CAMPAIGN_NEW, CAMPAIGN_PAUSED, CAMPAIGN_DONE if retry_failed else CAMPAIGN_PAUSED)
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                UPDATE bulk_campaigns SET status = ?, lease_until = ?
+                WHERE id = ? AND (status IN (?, ?, ?) OR (status IN (?, ?) AND lease_until < ?))
+            ''', (CAMPAIGN_RUNNING, now + self.lease_seconds, self.campaign['id'],
+                  *startable, CAMPAIGN_RUNNING, CAMPAIGN_PAUSING, now))
+            if cursor.rowcount == 0:
+                raise BulkMailError(f"Campaign {self.campaign['name']} is already running or done")
+            if retry_failed:
+                cursor.execute(
+                    "DELETE FROM bulk_deliveries WHERE campaign_id = ? AND status = ?",
+                    (self.campaign['id'], DELIVERY_FAILED)
+                )
+                return 0
+            return cursor.execute(
+                "SELECT last_registration_id FROM bulk_campaigns WHERE id = ?", (self.campaign['id'],)
+            ).fetchone()[0]
+
+    def _claim_batch(self, after_id: int) -> List[tuple]:
+        """Select the next recipients without a delivery row and mark them as sending
+
+        Returns no rows once a pause was requested through the campaign row.
+        """
+        campaign_id = self.campaign['id']
+        recipients, params = recipient_filter(self.campaign)
+        with self.db.transaction() as cursor:
+            status = cursor.execute("SELECT status FROM bulk_campaigns WHERE id = ?", (campaign_id,)).fetchone()[0]
+            if status != CAMPAIGN_RUNNING:
+                self._stopping = True
+                return []
+            rows = cursor.execute(f'''
+                SELECT r.id, r.naam, r.email FROM cafe_registrations r
+                WHERE r.id > ? AND {recipients}
+                  AND NOT EXISTS (
+                      SELECT 1 FROM bulk_deliveries d WHERE d.campaign_id = ? AND d.registration_id = r.id
+                  )
+                ORDER BY r.id LIMIT ?
+            ''', (after_id, *params, campaign_id, self.batch_size)).fetchall()
+            if rows:
+                now = datetime.now().isoformat()
+                cursor.executemany(
+                    "INSERT INTO bulk_deliveries (campaign_id, registration_id, status, updated_at) VALUES (?, ?, ?, ?)",
+                    [(campaign_id, registration_id, DELIVERY_SENDING, now) for registration_id, _, _ in rows]
+                )
+                # Checkpoint, and renew the lease while the campaign makes progress
+                cursor.execute('''
+                    UPDATE bulk_campaigns SET last_registration_id = MAX(last_registration_id, ?), lease_until = ?
+                    WHERE id = ?
+                ''', (rows[-1][0], time.time() + self.lease_seconds, campaign_id))
+        return rows
+
+    def _record_batch(self, rows: List[tuple], errors: List[Optional[Exception]]):
+        now = datetime.now().isoformat()
+        with self.db.transaction() as cursor:
+            cursor.executemany(
+                "UPDATE bulk_deliveries SET status = ?, error = ?, updated_at = ? WHERE campaign_id = ? AND registration_id = ?",
+                [
+                    (DELIVERY_SENT if error is None else DELIVERY_FAILED, None if error is None else str(error),
+                     now, self.campaign['id'], registration_id)
+                    for (registration_id, _, _), error in zip(rows, errors)
+                ]
+            )
+
+    def _finish(self, status: str):
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE bulk_campaigns SET status = ?, lease_until = 0, finished_at = ? WHERE id = ?",
+                (status, datetime.now().isoformat() if status == CAMPAIGN_DONE else None, self.campaign['id'])
+            )
+
+    def render_batch(self, rows: List[tuple]) -> List[tuple]:
+        """(from, to, message) for each recipient, from the template compiled once per run"""
+        template = self.engine.get(self.campaign['template'])
+        context = self.campaign['context']
+        subject = self.campaign['subject']
+        return [
+            (self.from_addr, email,
+             build_html_message(subject, self.from_addr, email, template.render({**context, 'naam': naam, 'email': email})))
+            for _, naam, email in rows
+        ]
+
+    async def _worker(self):
+        while not self._stopping:
+            rows = await asyncio.to_thread(self._claim_batch, self._after_id)
+            if not rows:
+                return
+            self._after_id = max(self._after_id, rows[-1][0])
+            if self._throttle:
+                # Only the claimed rows use up the rate, so a short last batch does not
+                # hold up the end of the campaign; they wait in 'sending' meanwhile
+                delay = max(self._throttle.reserve() for _ in rows)
+                if delay:
+                    await asyncio.sleep(delay)
+            batch_error = None
+            try:
+                messages = self.render_batch(rows)
+                errors = await asyncio.to_thread(self.smtp.send_many, messages)
+            except Exception as e:
+                batch_error = e
+                errors = [e] * len(rows)
+            await asyncio.to_thread(self._record_batch, rows, errors)
+            failed = sum(error is not None for error in errors)
+            self.sent += len(rows) - failed
+            self.failed += failed
+            logger.info(f"Campaign {self.campaign['name']}: {self.sent} sent, {self.failed} failed")
+            if batch_error is None and all(error is not None and not is_rejection(error) for error in errors):
+                # send_many opened a new connection for every mail and none got through
+                batch_error = errors[0]
+            if batch_error is not None:
+                # A broken template or mail server would fail every remaining recipient the same way
+                raise BulkMailError(f"Batch could not be sent: {batch_error}") from batch_error
+
+    async def _run_worker(self):
+        try:
+            await self._worker()
+        except Exception:
+            # The other workers finish their batches, then the campaign pauses
+            self._stopping = True
+            raise
+
+    def claim(self, retry_failed: bool = False):
+        """Take the campaign for this sender; raises BulkMailError when it is running elsewhere or done"""
+        self._after_id = self._claim_campaign(retry_failed)
+
+    async def run(self, retry_failed: bool = False) -> dict:
+        """Claim the campaign and send it"""
+        await asyncio.to_thread(self.claim, retry_failed)
+        return await self.send()
+
+    async def send(self) -> dict:
+        """Send a claimed campaign until every recipient has a delivery row, or it is paused
+
+        The campaign is only marked done when the workers ran out of
+        recipients. After stop(), a pause request, an error or cancellation
+        it is paused, so sending it again continues with the recipients that
+        are left.
+        """
+        logger.info(f"Sending campaign {self.campaign['name']} from registration id {self._after_id}")
+        status = CAMPAIGN_PAUSED
+        try:
+            results = await asyncio.gather(
+                *(self._run_worker() for _ in range(self.concurrency)), return_exceptions=True
+            )
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            if not self._stopping:
+                status = CAMPAIGN_DONE
+        finally:
+            await asyncio.to_thread(self._finish, status)
+        return {'sent': self.sent, 'failed': self.failed, 'stopped': self._stopping}
+
+
+def parse_values(pairs: List[str]) -> Dict[str, str]:
+    values = {}
+    for pair in pairs:
+        key, separator, value = pair.partition('=')
+        if not separator:
+            raise ValueError(f"Expected key=value, got '{pair}'")
+        values[key] = value
+    return values
+
+
+def main():
+    # CLI-only imports, kept out of the backend, which imports this module
+    import argparse
+    import signal
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Send a mail to every café registrant")
+    commands = parser.add_subparsers(dest='command', required=True)
+    send = commands.add_parser('send', help="Create a campaign if needed and send it, resuming where it stopped")
+    send.add_argument('--name', required=True, help="Campaign name; running it again resumes it")
+    send.add_argument('--subject', help="Required for a new campaign")
+    send.add_argument('--template', default=DEFAULT_TEMPLATE)
+    send.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                      help="Template value, e.g. --set datum='12 maart'")
+    send.add_argument('--audience', choices=tuple(AUDIENCES), default='all')
+    send.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE)
+    send.add_argument('--concurrency', type=int, default=BULK_CONCURRENCY)
+    send.add_argument('--max-per-minute', type=float, default=BULK_MAX_PER_MINUTE)
+    send.add_argument('--retry-failed', action='store_true', help="Send failed deliveries again")
+    send.add_argument('--dry-run', action='store_true', help="Show the first message instead of sending")
+    status = commands.add_parser('status', help="Show the progress of a campaign")
+    status.add_argument('--name', required=True)
+    pause = commands.add_parser('pause', help="Pause a running campaign, also when another process sends it")
+    pause.add_argument('--name', required=True)
+    args = parser.parse_args()
+
+    from migrations import run_migrations
+    db = Database(DB_PATH).open()
+    try:
+        run_migrations(db)
+        if args.command == 'status':
+            print(dumps_text(campaign_status(db, args.name), indent=True))
+            return
+        if args.command == 'pause':
+            if not request_pause(db, args.name):
+                print(f"❌ Campaign {args.name} is not running")
+                return
+            print(f"⏸️  Campaign {args.name} pauses after the batches in progress")
+            return
+
+        campaign = get_campaign(db, args.name)
+        if campaign is None:
+            if not args.subject:
+                parser.error("--subject is required for a new campaign")
+            try:
+                values = parse_values(args.set)
+            except ValueError as e:
+                parser.error(str(e))
+            campaign = create_campaign(db, args.name, args.subject, values, args.template, args.audience)
+
+        sender = BulkSender(db, campaign, batch_size=args.batch_size, concurrency=args.concurrency,
+                            max_per_minute=args.max_per_minute)
+        if args.dry_run:
+            pending = campaign_status(db, args.name)['remaining']
+            recipients, params = recipient_filter(campaign)
+            sample = db.execute(
+                f"SELECT r.id, r.naam, r.email FROM cafe_registrations r WHERE {recipients} ORDER BY r.id LIMIT 1",
+                params
+            )
+            print(f"{pending} recipients to go")
+            if sample:
+                print(sender.render_batch(sample)[0][2].decode('utf-8'))
+            return
+
+        async def run():
+            # Ctrl-C or SIGTERM pauses after the batches in progress
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, sender.stop)
+            return await sender.run(retry_failed=args.retry_failed)
+
+        result = asyncio.run(run())
+        print(dumps_text({**campaign_status(db, args.name), **result}, indent=True))
+    except BulkMailError as e:
+        print(f"❌ {e}")
+    finally:
+        smtp_pool.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
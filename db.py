@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Long-lived SQLite connection manager for the SamenWerkt backend
+
+One connection is opened at application startup and shared by the schema
+setup, the registration inserts, the mail queue and the health check.
+The database runs in WAL mode so readers never block the writer, and
+sqlite3's statement cache keeps the prepared INSERT alive between requests.
+GroupCommitWriter optionally merges concurrent writes into one transaction.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional
+
+from metrics import DB_LOCK_WAIT
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """Shared SQLite connection with WAL journaling and serialized transactions"""
+
+    def __init__(
+        self,
+        path: Path,
+        busy_timeout_ms: int = 5000,
+        synchronous: str = "NORMAL",
+        cache_size_kib: int = 8192,
+        close_checkpoint: str = "TRUNCATE",
+    ):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cache_size_kib = cache_size_kib
+        # PASSIVE when other processes keep using the file, so closing never waits on them
+        self.close_checkpoint = close_checkpoint
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def open(self) -> "Database":
+        """Open the connection and apply the journal and durability settings"""
+        with self._lock:
+            if self._conn is not None:
+                return self
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout_ms / 1000,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=256,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            # NORMAL is durable in WAL mode except for a power loss right after commit
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._conn = conn
+            logger.info(f"Opened SQLite database {self.path} in WAL mode")
+        return self
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.open()
+        return self._conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run a write transaction; commits on success and rolls back on error"""
+        started = time.perf_counter()
+        with span('sqlite.transaction'), self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            # Covers both the in-process lock and SQLite's busy wait for other processes
+            DB_LOCK_WAIT.observe(time.perf_counter() - started)
+            try:
+                yield cursor
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.close()
+
+    def execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run a single statement outside an explicit transaction and return its rows"""
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def close(self):
+        """Checkpoint the WAL and close the connection"""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute("PRAGMA optimize")
+                self._conn.execute(f"PRAGMA wal_checkpoint({self.close_checkpoint})")
+            except sqlite3.Error as e:
+                logger.warning(f"Could not checkpoint database on close: {e}")
+            self._conn.close()
+            self._conn = None
+            logger.info(f"Closed SQLite database {self.path}")
+
+
+class GroupCommitWriter:
+    """Collects concurrent writes and commits them together in one transaction
+
+    Callers await submit(); a single writer task gathers queued items until
+    max_batch items are waiting or max_delay seconds have passed, then runs
+    flush(cursor, items) inside one transaction. Every caller is resolved
+    only after the transaction holding its item has committed.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        flush: Callable[[sqlite3.Cursor, List[Any]], List[Any]],
+        max_batch: int = 100,
+        max_delay: float = 0.005,
+    ):
+        self.db = db
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the writer task"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name="group-commit-writer")
+        logger.info(f"Group commit enabled (batch {self.max_batch}, delay {self.max_delay * 1000:.0f} ms)")
+
+    async def stop(self):
+        """Flush everything still queued and stop the writer task"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait until it is durable; returns its flush result"""
+        if self._task is None:
+            raise RuntimeError("Group commit writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> tuple:
+        """Wait for the first item, then gather more until the batch is full or the delay expires"""
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _write(self, items: List[Any]) -> List[Any]:
+        with self.db.transaction() as cursor:
+            return self.flush(cursor, items)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = await asyncio.to_thread(self._write, items)
+            except Exception as e:
+                logger.error(f"Group commit of {len(items)} rows failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Precompiled email templates for SamenWerkt mails
+
+Templates live in the templates/ directory and use a deliberately small
+syntax:
+
+    {{ name }}                 value from the context, HTML-escaped
+    {{ name|raw }}             value inserted as-is (for prebuilt HTML)
+    {% include header.html %}  another template, inlined at compile time
+
+Each template is compiled once into a list of literal chunks and fields.
+Included fragments are merged into the literals, so the static header and
+footer cost nothing per render. Templates are recompiled when their
+files, or any file they include, change on disk.
+"""
+
+import base64
+import os
+import re
+import threading
+import time
+import logging
+from email.header import Header
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+_INCLUDE_RE = re.compile(r"\{%\s*include\s+([\w.\-]+)\s*%\}\n?")
+_FIELD_RE = re.compile(r"\{\{\s*(\w+)(\|raw)?\s*\}\}")
+
+
+class CompiledTemplate:
+    """A template split into (literal, field, raw) parts"""
+
+    __slots__ = ('name', 'parts', 'sources')
+
+    def __init__(self, name: str, parts: List[Tuple[str, Optional[str], bool]], sources: Dict[Path, float]):
+        self.name = name
+        self.parts = parts
+        # Every file this template was built from, with its mtime
+        self.sources = sources
+
+    def render(self, context: dict) -> str:
+        out = []
+        for literal, field, raw in self.parts:
+            out.append(literal)
+            if field is not None:
+                value = context[field]
+                out.append(value if raw else escape(str(value)))
+        return ''.join(out)
+
+
+class TemplateEngine:
+    """Loads, compiles and hot-reloads the templates in one directory"""
+
+    def __init__(self, directory: Path = TEMPLATE_DIR, reload_interval: float = 2.0):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._compiled: Dict[str, CompiledTemplate] = {}
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def _path(self, name: str) -> Path:
+        """The file of a template; names are plain file names inside the directory"""
+        if not name or name != os.path.basename(name) or name.startswith('.') or '\\' in name:
+            raise ValueError(f"Invalid template name '{name}'")
+        return self.directory / name
+
+    def _read(self, name: str, sources: Dict[Path, float], depth: int = 0) -> str:
+        """Read a template and inline its includes"""
+        if depth > 5:
+            raise ValueError(f"Template includes nested too deeply at {name}")
+        path = self._path(name)
+        sources[path] = os.stat(path).st_mtime
+        text = path.read_text(encoding='utf-8')
+        return _INCLUDE_RE.sub(lambda m: self._read(m.group(1), sources, depth + 1), text)
+
+    def compile(self, name: str) -> CompiledTemplate:
+        """Compile a template file into literal and field parts"""
+        sources: Dict[Path, float] = {}
+        text = self._read(name, sources)
+        parts = []
+        position = 0
+        for match in _FIELD_RE.finditer(text):
+            parts.append((text[position:match.start()], match.group(1), bool(match.group(2))))
+            position = match.end()
+        parts.append((text[position:], None, False))
+        return CompiledTemplate(name, parts, sources)
+
+    def load_all(self):
+        """Compile every template in the directory, typically at startup"""
+        with self._lock:
+            for path in sorted(self.directory.glob('*.html')):
+                self._compiled[path.name] = self.compile(path.name)
+            self._last_check = time.monotonic()
+        logger.info(f"Compiled {len(self._compiled)} email templates from {self.directory}")
+
+    def _is_stale(self, template: CompiledTemplate) -> bool:
+        try:
+            return any(os.stat(path).st_mtime != mtime for path, mtime in template.sources.items())
+        except OSError:
+            return True
+
+    def _reload_changed(self):
+        """Recompile templates whose source files changed since they were compiled"""
+        for name, template in list(self._compiled.items()):
+            if self._is_stale(template):
+                try:
+                    self._compiled[name] = self.compile(name)
+                    logger.info(f"Reloaded email template {name}")
+                except OSError as e:
+                    logger.error(f"Could not reload email template {name}: {e}")
+
+    def get(self, name: str) -> CompiledTemplate:
+        """Return a compiled template, reloading changed files at most every reload_interval"""
+        now = time.monotonic()
+        if now - self._last_check >= self.reload_interval:
+            with self._lock:
+                if now - self._last_check >= self.reload_interval:
+                    self._reload_changed()
+                    self._last_check = now
+        template = self._compiled.get(name)
+        if template is None:
+            with self._lock:
+                template = self._compiled.get(name) or self.compile(name)
+                self._compiled[name] = template
+        return template
+
+    def render(self, name: str, context: dict) -> str:
+        with span('template.render'):
+            return self.get(name).render(context)
+
+
+def _encode_header(value: str) -> str:
+    """RFC 2047-encode a header value only when it is not plain ASCII"""
+    if value.isascii():
+        return value
+    return Header(value, 'utf-8').encode().replace('\n', '\r\n')
+
+
+def build_html_message(subject: str, from_addr: str, to_addr: str, html: str) -> bytes:
+    """Build a single-part HTML message as wire bytes, ready for sendmail
+
+    Produces the same headers and base64 body as MIMEText(html, 'html', 'utf-8'),
+    without going through the email package's generator.
+    """
+    with span('mime.build'):
+        return _build_html_message(subject, from_addr, to_addr, html)
+
+
+def _build_html_message(subject: str, from_addr: str, to_addr: str, html: str) -> bytes:
+    headers = (
+        'Content-Type: text/html; charset="utf-8"\r\n'
+        'MIME-Version: 1.0\r\n'
+        'Content-Transfer-Encoding: base64\r\n'
+        f'Subject: {_encode_header(subject)}\r\n'
+        f'From: {from_addr}\r\n'
+        f'To: {to_addr}\r\n'
+        '\r\n'
+    )
+    body = base64.encodebytes(html.encode('utf-8')).replace(b'\n', b'\r\n')
+    return headers.encode('utf-8') + body
+
+
+# Shared engine for the backend's mail senders
+templates = TemplateEngine()
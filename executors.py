@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Bounded executors for blocking work in the SamenWerkt backend
+
+sqlite3, smtplib and MIME rendering are blocking calls. They run on a
+dedicated thread or process pool, so the event loop stays free for health
+checks and new submissions. Each pool has a size limit and a queue limit.
+When both are used up, run() raises ExecutorSaturated instead of queueing
+without bound.
+"""
+
+import asyncio
+import math
+import time
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KINDS = ('thread', 'process')
+
+
+class ExecutorSaturated(Exception):
+    """Raised when an executor's workers and queue are all in use"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Executor '{name}' is saturated, retry after {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Thread or process pool with a bounded queue and depth metrics"""
+
+    def __init__(self, name: str, kind: str = 'thread', max_workers: int = 4, max_queue: int = 64):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor kind '{kind}', expected one of {EXECUTOR_KINDS}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool: Executor = self._create_pool()
+        # Only touched from the event loop thread, so no lock is needed
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._avg_seconds = 0.0
+
+    def _create_pool(self) -> Executor:
+        if self.kind == 'process':
+            # Imported only for process pools; thread pools are the default
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Spawned workers do not inherit open sockets or SQLite handles
+            return ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-pool")
+
+    def retry_after(self) -> int:
+        """Estimate in whole seconds when a slot will be free again"""
+        queued = max(0, self._in_flight - self.max_workers) + 1
+        return max(1, math.ceil(self._avg_seconds * queued / self.max_workers))
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn in the pool, or raise ExecutorSaturated when the queue is full"""
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise ExecutorSaturated(self.name, self.retry_after())
+
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            call = partial(fn, *args, **kwargs)
+            if self.kind == 'thread':
+                # Keep a sampled trace going in the worker thread
+                call = tracing.bind(call)
+            result = await loop.run_in_executor(self._pool, call)
+            self._completed += 1
+            return result
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            elapsed = time.perf_counter() - started
+            self._avg_seconds = elapsed if not self._avg_seconds else 0.9 * self._avg_seconds + 0.1 * elapsed
+
+    def stats(self) -> dict:
+        """Current pool limits, queue depth and counters"""
+        return {
+            'kind': self.kind,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'active': min(self._in_flight, self.max_workers),
+            'queued': max(0, self._in_flight - self.max_workers),
+            'completed': self._completed,
+            'failed': self._failed,
+            'rejected': self._rejected,
+            'avg_seconds': round(self._avg_seconds, 6),
+        }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the pool after the running tasks have finished"""
+        self._pool.shutdown(wait=wait)
+        logger.info(f"Executor '{self.name}' shut down")
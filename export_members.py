@@ -3,35 +3,122 @@
 SamenWerkt Political Café Export Script
 
 This script reads all café registration data from the SQLite database,
-creates a pandas DataFrame, exports it to Excel, and emails the
-file to tijmenbaas83@outlook.com
+exports it to Excel (or CSV), and emails the file to tijmenbaas83@outlook.com
 
-Usage: python export_members.py
+Usage: python export_members.py [--full] [--engine lite|pandas]
+           [--format xlsx|csv] [--include-archive]
+
+By default only registrations added since the previous export are sent;
+the last exported id is kept in the export_state table. --full sends the
+complete table.
+
+Two engines produce the same sheet:
+
+    lite    (default) rows stream from a sqlite3 cursor through a small row
+            transformer into a write-only workbook or a CSV file. No pandas,
+            and memory use stays flat however many registrations there are.
+            --streaming is kept as another name for it.
+    pandas  reads the rows into a DataFrame first; needed for
+            --include-archive, which adds the months that archive.py moved
+            to Parquet to a --full export.
+
+The statistics in the mail always include the archive.
+
+With STORAGE_BACKEND=postgres the registrations are read from PostgreSQL
+(DATABASE_URL), by the lite engine through a server-side cursor;
+--include-archive is SQLite only.
 """
 
+import argparse
+import asyncio
+import csv
 import sqlite3
-import pandas as pd
-import json
-import smtplib
 import logging
 from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional
 import os
 
+import archive
+from db import Database
+from migrations import run_migrations
+from smtp_pool import smtp_pool
+from stats import STATS_QUERY, registration_stats_from_dataframe, summarize
+from storage import DATABASE_URL, STORAGE_BACKEND, PostgresStore
+
+if TYPE_CHECKING:
+    # pandas, openpyxl and email.mime are imported where they are used, so a
+    # run that has nothing to export, or no database, starts in milliseconds
+    import pandas as pd
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuration
-DB_PATH = Path(__file__).parent / "politekcafe.db"
+DB_PATH = Path(os.environ.get("DB_PATH", Path(__file__).parent / "politekcafe.db"))
 EXPORT_EMAIL = "tijmenbaas83@outlook.com"
 FROM_EMAIL = "info@samenwerktwbd.nl"
+SHEET_NAME = 'Politiek Café Aanmeldingen'
+DELTA_SHEET_NAME = 'Nieuwe Aanmeldingen'
+EXPORT_STATE_NAME = 'email_export'
+STREAM_CHUNKSIZE = 5000
+MAX_COLUMN_WIDTH = 50
+
+# Columns of the exported sheet, in order
+EXPORT_COLUMNS = [
+    'id', 'naam', 'email', 'telefoonnummer', 'lid_van_samenwerkt',
+    'komt_naar_cafe', 'opmerkingen', 'aanmeld_datum'
+]
+
+# Source columns for export_rows(): EXPORT_COLUMNS with the raw timestamp last
+SOURCE_COLUMNS = EXPORT_COLUMNS[:-1] + ['timestamp']
+EXPORT_QUERY = f"""
+    SELECT {', '.join(SOURCE_COLUMNS)}
+    FROM cafe_registrations
+    WHERE id > ? AND id <= ?
+    ORDER BY timestamp DESC
+"""
+YES_NO = {'ja': 'Ja', 'nee': 'Nee'}
+EXPORT_ENGINES = ('lite', 'pandas')
+EXPORT_FORMATS = ('xlsx', 'csv')
+# Excel with Dutch regional settings splits CSV columns on semicolons
+CSV_DELIMITER = ';'
+XLSX_MIME_SUBTYPE = 'vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def get_watermark(conn: sqlite3.Connection) -> int:
+    """Return the last exported registration id, or 0 if nothing was exported yet"""
+    row = conn.execute(
+        "SELECT last_id FROM export_state WHERE name = ?", (EXPORT_STATE_NAME,)
+    ).fetchone()
+    return row[0] if row else 0
+
+def save_watermark(conn: sqlite3.Connection, last_id: int):
+    """Record the highest exported registration id"""
+    last_timestamp = conn.execute(
+        "SELECT timestamp FROM cafe_registrations WHERE id = ?", (last_id,)
+    ).fetchone()
+    conn.execute('''
+        INSERT INTO export_state (name, last_id, last_timestamp, exported_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET
+            last_id = excluded.last_id,
+            last_timestamp = excluded.last_timestamp,
+            exported_at = excluded.exported_at
+    ''', (
+        EXPORT_STATE_NAME, last_id,
+        last_timestamp[0] if last_timestamp else None, datetime.now().isoformat()
+    ))
+    conn.commit()
+    logger.info(f"Export watermark set to id {last_id}")
 
-def read_database() -> pd.DataFrame:
-    """Read all café registration data from SQLite database and return as DataFrame"""
+def read_database(since_id: int = 0, until_id: int = None, include_archive: bool = False) -> 'pd.DataFrame':
+    """Read café registrations with since_id < id <= until_id from SQLite and return as DataFrame
+    
+    With include_archive, rows in the same id range from the Parquet archive
+    are added; only the selected columns are read from the archive files.
+    """
+    import pandas as pd
     try:
         # Connect to database
         conn = sqlite3.connect(DB_PATH)
@@ -46,13 +133,23 @@ def read_database() -> pd.DataFrame:
             komt_naar_cafe,
             telefoonnummer,
             opmerkingen,
-            timestamp,
-            submission_data
+            timestamp
         FROM cafe_registrations 
+        WHERE id > ? AND id <= ?
         ORDER BY timestamp DESC
         """
         
-        df = pd.read_sql_query(query, conn)
+        df = pd.read_sql_query(query, conn, params=(since_id, until_id if until_id is not None else 2 ** 63 - 1))
+        # ja/nee answers as categoricals instead of one Python string per row
+        df = df.astype({'lid_van_samenwerkt': 'category', 'komt_naar_cafe': 'category'})
+        
+        if include_archive and archive.has_archive():
+            archived = archive.read_archive(
+                df.columns, since_id, until_id, schema=archive.arrow_schema(conn)
+            )
+            logger.info(f"Read {len(archived)} archived café registration records")
+            df = pd.concat([df, archived], ignore_index=True)
+            df = df.sort_values('timestamp', ascending=False, ignore_index=True)
         conn.close()
         
         logger.info(f"Read {len(df)} café registration records from database")
@@ -62,15 +159,36 @@ def read_database() -> pd.DataFrame:
         logger.error(f"Error reading database: {e}")
         raise
 
-def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+async def read_postgres(store: PostgresStore, since_id: int, until_id: int) -> 'pd.DataFrame':
+    """Read café registrations with since_id < id <= until_id from PostgreSQL, like read_database"""
+    import pandas as pd
+    columns = [
+        'id', 'naam', 'email', 'lid_van_samenwerkt', 'komt_naar_cafe',
+        'telefoonnummer', 'opmerkingen', 'timestamp'
+    ]
+    rows = await store.fetch_registrations(columns, since_id, until_id)
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df = df.astype({'lid_van_samenwerkt': 'category', 'komt_naar_cafe': 'category'})
+    logger.info(f"Read {len(df)} café registration records from PostgreSQL")
+    return df
+
+def process_dataframe(df: 'pd.DataFrame') -> 'pd.DataFrame':
     """Process and clean the DataFrame for export"""
     if df.empty:
         logger.warning("No café registration data found in database")
         return df
     
+    df = transform_dataframe(df)
+    
+    logger.info(f"Processed DataFrame with {len(df)} rows and {len(df.columns)} columns")
+    return df
+
+def transform_dataframe(df: 'pd.DataFrame') -> 'pd.DataFrame':
+    """Apply the export formatting to a DataFrame; export_rows() does the same per row"""
+    import pandas as pd
     # Convert timestamp to readable format
     if 'timestamp' in df.columns:
-        df['aanmeld_datum'] = pd.to_datetime(df['timestamp']).dt.strftime('%d-%m-%Y %H:%M')
+        df['aanmeld_datum'] = pd.to_datetime(df['timestamp'], format='ISO8601').dt.strftime('%d-%m-%Y %H:%M')
     
     # Convert yes/no values to more readable Dutch
     if 'lid_van_samenwerkt' in df.columns:
@@ -82,18 +200,54 @@ def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     # Reorder columns for better readability
     column_order = [
         'id', 'naam', 'email', 'telefoonnummer', 'lid_van_samenwerkt', 
-        'komt_naar_cafe', 'opmerkingen', 'aanmeld_datum', 'timestamp', 'submission_data'
+        'komt_naar_cafe', 'opmerkingen', 'aanmeld_datum', 'timestamp'
     ]
     
     # Only include columns that exist in the dataframe
     column_order = [col for col in column_order if col in df.columns]
-    df = df[column_order]
-    
-    logger.info(f"Processed DataFrame with {len(df)} rows and {len(df.columns)} columns")
-    return df
+    return df[column_order]
+
+def format_timestamp(timestamp: Optional[str]) -> Optional[str]:
+    """ISO timestamp as shown in the sheet, e.g. 05-03-2025 14:30"""
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(timestamp).strftime('%d-%m-%Y %H:%M')
+
+def export_rows(rows: Iterable[tuple]) -> Iterator[tuple]:
+    """Format rows in SOURCE_COLUMNS order into EXPORT_COLUMNS order, like transform_dataframe"""
+    for row_id, naam, email, telefoonnummer, lid, komt, opmerkingen, timestamp in rows:
+        yield (
+            row_id, naam, email, telefoonnummer, YES_NO.get(lid), YES_NO.get(komt),
+            opmerkingen, format_timestamp(timestamp),
+        )
 
-def create_excel_export(df: pd.DataFrame) -> str:
+def cursor_rows(conn: sqlite3.Connection, since_id: int, until_id: int,
+                chunksize: int = STREAM_CHUNKSIZE) -> Iterator[tuple]:
+    """Rows with since_id < id <= until_id in SOURCE_COLUMNS order, fetched chunksize at a time"""
+    cursor = conn.execute(EXPORT_QUERY, (since_id, until_id))
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        yield from rows
+
+def async_cursor_rows(cursor, loop: asyncio.AbstractEventLoop,
+                      chunksize: int = STREAM_CHUNKSIZE) -> Iterator[tuple]:
+    """Rows from an asyncpg cursor for a writer on a worker thread, fetched chunksize at a time on loop"""
+    while True:
+        rows = asyncio.run_coroutine_threadsafe(cursor.fetch(chunksize), loop).result()
+        if not rows:
+            return
+        yield from (tuple(row) for row in rows)
+
+def export_filepath(suffix: str = '.xlsx') -> Path:
+    """Path for a new export file, named after the current time"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return Path(__file__).parent / f"samenwerkt_politiekcafe_export_{timestamp}{suffix}"
+
+def create_excel_export(df: 'pd.DataFrame', sheet_name: str = SHEET_NAME) -> str:
     """Create Excel file and return the filepath"""
+    import pandas as pd
     if df.empty:
         # Create empty Excel file with headers
         df = pd.DataFrame(columns=[
@@ -101,21 +255,18 @@ def create_excel_export(df: pd.DataFrame) -> str:
             'komt_naar_cafe', 'opmerkingen', 'aanmeld_datum'
         ])
     
-    # Generate filename with timestamp
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"samenwerkt_politiekcafe_export_{timestamp}.xlsx"
-    filepath = Path(__file__).parent / filename
+    filepath = export_filepath()
     
     try:
         # Create Excel writer with formatting
         with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
             # Remove technical columns for the main export
-            export_df = df.drop(['timestamp', 'submission_data'], axis=1, errors='ignore')
-            export_df.to_excel(writer, sheet_name='Politiek Café Aanmeldingen', index=False)
+            export_df = df.drop(['timestamp'], axis=1, errors='ignore')
+            export_df.to_excel(writer, sheet_name=sheet_name, index=False)
             
             # Get the workbook and worksheet
             workbook = writer.book
-            worksheet = writer.sheets['Politiek Café Aanmeldingen']
+            worksheet = writer.sheets[sheet_name]
             
             # Auto-adjust column widths
             for column in worksheet.columns:
@@ -139,35 +290,123 @@ def create_excel_export(df: pd.DataFrame) -> str:
         logger.error(f"Error creating Excel file: {e}")
         raise
 
-def send_export_email(excel_filepath: str, record_count: int):
-    """Send the Excel export via email"""
+def widths_from_lengths(max_lengths: Iterable[Optional[int]]) -> List[int]:
+    """Column widths for the longest value of each export column, capped at MAX_COLUMN_WIDTH"""
+    return [
+        min(max(len(header), length or 0) + 2, MAX_COLUMN_WIDTH)
+        for header, length in zip(EXPORT_COLUMNS, max_lengths)
+    ]
+
+def sql_column_widths(conn: sqlite3.Connection, since_id: int, until_id: int) -> list:
+    """Column widths for the export from MAX(LENGTH(...)) instead of a per-cell scan"""
+    max_lengths = conn.execute('''
+        SELECT MAX(LENGTH(id)), MAX(LENGTH(naam)), MAX(LENGTH(email)),
+               MAX(LENGTH(telefoonnummer)), 3, 3, MAX(LENGTH(opmerkingen)),
+               16
+        FROM cafe_registrations
+        WHERE id > ? AND id <= ?
+    ''', (since_id, until_id)).fetchone()
+    return widths_from_lengths(max_lengths)
+
+async def postgres_column_widths(store: PostgresStore, since_id: int, until_id: int) -> list:
+    """sql_column_widths for PostgreSQL"""
+    row_id, naam, email, telefoonnummer, opmerkingen = await store.max_lengths(
+        ['id', 'naam', 'email', 'telefoonnummer', 'opmerkingen'], since_id, until_id
+    )
+    return widths_from_lengths([row_id, naam, email, telefoonnummer, 3, 3, opmerkingen, 16])
+
+def write_xlsx(rows: Iterable[tuple], filepath: Path, sheet_name: str, widths: List[int]) -> int:
+    """Write EXPORT_COLUMNS and rows to a write-only workbook; returns the row count"""
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    
+    # Widths must be set before the first row is written
+    for index, width in enumerate(widths, start=1):
+        worksheet.column_dimensions[get_column_letter(index)].width = width
+    worksheet.append(EXPORT_COLUMNS)
+    
+    row_count = 0
+    for row in rows:
+        worksheet.append(row)
+        row_count += 1
+    workbook.save(filepath)
+    return row_count
+
+def write_csv(rows: Iterable[tuple], filepath: Path) -> int:
+    """Write EXPORT_COLUMNS and rows as CSV that Excel opens directly; returns the row count"""
+    row_count = 0
+    # The BOM tells Excel the file is UTF-8, so names with accents survive
+    with open(filepath, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file, delimiter=CSV_DELIMITER)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            row_count += 1
+    return row_count
+
+def create_excel_export_streaming(since_id: int, until_id: int, sheet_name: str = SHEET_NAME,
+                                  chunksize: int = STREAM_CHUNKSIZE) -> tuple:
+    """Stream rows with since_id < id <= until_id into a write-only workbook; returns (filepath, row count)
+    
+    The lite engine: rows go from the cursor through export_rows() into the
+    sheet, so neither pandas nor the whole table is ever loaded.
+    """
+    filepath = export_filepath()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        widths = sql_column_widths(conn, since_id, until_id)
+        row_count = write_xlsx(export_rows(cursor_rows(conn, since_id, until_id, chunksize)),
+                               filepath, sheet_name, widths)
+    finally:
+        conn.close()
+    
+    logger.info(f"Created streaming Excel export with {row_count} rows: {filepath}")
+    return str(filepath), row_count
+
+def create_csv_export(since_id: int, until_id: int, chunksize: int = STREAM_CHUNKSIZE) -> tuple:
+    """Stream rows with since_id < id <= until_id into a CSV file; returns (filepath, row count)"""
+    filepath = export_filepath('.csv')
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row_count = write_csv(export_rows(cursor_rows(conn, since_id, until_id, chunksize)), filepath)
+    finally:
+        conn.close()
+    
+    logger.info(f"Created CSV export with {row_count} rows: {filepath}")
+    return str(filepath), row_count
+
+def send_export_email(excel_filepath: str, stats: dict, new_count: int = None):
+    """Send the Excel export via email, with statistics from stats.registration_stats
+    
+    new_count is set for incremental exports: the attachment then only holds
+    the registrations added since the previous export.
+    """
+    from email import encoders
+    from email.mime.application import MIMEApplication
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
     try:
         # Create message
         msg = MIMEMultipart()
-        msg['Subject'] = f"SamenWerkt Politiek Café Export - {datetime.now().strftime('%d-%m-%Y')}"
+        kind = "Nieuwe aanmeldingen" if new_count is not None else "Export"
+        msg['Subject'] = f"SamenWerkt Politiek Café {kind} - {datetime.now().strftime('%d-%m-%Y %H:%M')}"
         msg['From'] = FROM_EMAIL
         msg['To'] = EXPORT_EMAIL
         
-        # Count participants by response
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT COUNT(*) FROM cafe_registrations WHERE komt_naar_cafe = 'ja'")
-            ja_count = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM cafe_registrations WHERE komt_naar_cafe = 'nee'")
-            nee_count = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM cafe_registrations WHERE lid_van_samenwerkt = 'ja'")
-            leden_count = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM cafe_registrations WHERE lid_van_samenwerkt = 'nee'")
-            niet_leden_count = cursor.fetchone()[0]
-            
-            conn.close()
-        except:
-            ja_count = nee_count = leden_count = niet_leden_count = 0
+        # Weekly breakdown of new registrations
+        week_lines = "".join(
+            f"📆 {week['week']}: {week['total']} aanmeldingen, {week['attending']} komen<br>"
+            for week in stats['per_week']
+        )
+        
+        if new_count is None:
+            intro = "Hierbij de export van alle aanmeldingen voor het politiek café van SamenWerkt Wijk bij Duurstede."
+        else:
+            intro = (f"Hierbij de {new_count} nieuwe aanmeldingen sinds de vorige export voor het politiek café "
+                     f"van SamenWerkt Wijk bij Duurstede. De statistieken hieronder gelden voor alle aanmeldingen.")
         
         # Create email body
         body = f"""
@@ -177,19 +416,24 @@ def send_export_email(excel_filepath: str, record_count: int):
             
             <p>Beste Tijmen,</p>
             
-            <p>Hierbij de export van alle aanmeldingen voor het politiek café van SamenWerkt Wijk bij Duurstede.</p>
+            <p>{intro}</p>
             
             <div style="background: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0;">
                 <strong>📊 Export Statistieken:</strong><br>
-                📋 Totaal aanmeldingen: {record_count}<br>
-                ✅ Komt naar café: {ja_count}<br>
-                ❌ Komt niet naar café: {nee_count}<br>
-                👥 Reeds lid van SamenWerkt: {leden_count}<br>
-                🆕 Nog geen lid: {niet_leden_count}<br>
+                📋 Totaal aanmeldingen: {stats['total']}<br>
+                ✅ Komt naar café: {stats['attending']}<br>
+                ❌ Komt niet naar café: {stats['not_attending']}<br>
+                👥 Reeds lid van SamenWerkt: {stats['members']}<br>
+                🆕 Nog geen lid: {stats['non_members']}<br>
                 📅 Export datum: {datetime.now().strftime('%d-%m-%Y om %H:%M')}<br>
                 📁 Bestand: {Path(excel_filepath).name}
             </div>
             
+            <div style="background: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0;">
+                <strong>📈 Aanmeldingen per week:</strong><br>
+                {week_lines or "Nog geen aanmeldingen"}
+            </div>
+            
             <p>Het Excel bestand bevat alle beschikbare gegevens inclusief:</p>
             <ul>
                 <li>Naam en contactgegevens</li>
@@ -212,16 +456,20 @@ def send_export_email(excel_filepath: str, record_count: int):
         html_part = MIMEText(body, 'html', 'utf-8')
         msg.attach(html_part)
         
-        # Attach Excel file
+        # Attach the Excel or CSV file
         with open(excel_filepath, 'rb') as file:
-            attachment = MIMEApplication(file.read(), _subtype='vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            if excel_filepath.endswith('.csv'):
+                # text/csv, base64-encoded so the BOM and CRLF line ends reach Excel unchanged
+                attachment = MIMEBase('text', 'csv', charset='utf-8')
+                attachment.set_payload(file.read())
+                encoders.encode_base64(attachment)
+            else:
+                attachment = MIMEApplication(file.read(), _subtype=XLSX_MIME_SUBTYPE)
             attachment.add_header('Content-Disposition', 'attachment', filename=Path(excel_filepath).name)
             msg.attach(attachment)
         
-        # Send via local Postfix
-        server = smtplib.SMTP('localhost', 25)
-        server.sendmail(FROM_EMAIL, EXPORT_EMAIL, msg.as_string())
-        server.quit()
+        # Send via local Postfix over the shared SMTP transport
+        smtp_pool.sendmail(FROM_EMAIL, EXPORT_EMAIL, msg.as_string())
         
         logger.info(f"Export email sent to {EXPORT_EMAIL}")
         return True
@@ -230,6 +478,16 @@ def send_export_email(excel_filepath: str, record_count: int):
         logger.error(f"Error sending email: {e}")
         return False
 
+def all_registration_stats(conn: sqlite3.Connection) -> dict:
+    """Statistics over the database and the Parquet archive together"""
+    groups = conn.execute(STATS_QUERY).fetchall()
+    if archive.has_archive():
+        try:
+            groups += archive.archived_stat_groups()
+        except RuntimeError as e:
+            logger.warning(f"Archived registrations left out of the statistics: {e}")
+    return summarize(groups)
+
 def cleanup_file(filepath: str):
     """Remove the temporary Excel file"""
     try:
@@ -238,36 +496,155 @@ def cleanup_file(filepath: str):
     except Exception as e:
         logger.warning(f"Could not remove temporary file {filepath}: {e}")
 
+async def export_postgres(full: bool, engine: str = 'lite', export_format: str = 'xlsx'):
+    """Export from PostgreSQL: the same steps as main() without the SQLite-only modes"""
+    store = PostgresStore(DATABASE_URL, event='', mail_kinds=(), min_size=1, max_size=2)
+    await store.open()
+    try:
+        await store.migrate()
+        since_id = 0 if full else await store.get_watermark(EXPORT_STATE_NAME)
+        until_id = await store.max_registration_id()
+        if not full and until_id <= since_id:
+            print("✅ No new café registrations since the previous export, nothing to send.")
+            return
+        
+        print("📖 Reading café registration data from PostgreSQL...")
+        sheet_name = SHEET_NAME if full else DELTA_SHEET_NAME
+        if engine == 'lite':
+            print(f"📊 Creating {export_format.upper()} export...")
+            filepath = export_filepath(f'.{export_format}')
+            widths = None if export_format == 'csv' else await postgres_column_widths(store, since_id, until_id)
+            # The writer runs on a thread and pulls rows from the cursor chunk by chunk,
+            # so the export never holds more than one chunk in memory
+            loop = asyncio.get_running_loop()
+            async with store.registration_cursor(SOURCE_COLUMNS, since_id, until_id) as cursor:
+                rows = export_rows(async_cursor_rows(cursor, loop))
+                if export_format == 'csv':
+                    record_count = await asyncio.to_thread(write_csv, rows, filepath)
+                else:
+                    record_count = await asyncio.to_thread(write_xlsx, rows, filepath, sheet_name, widths)
+            excel_filepath = str(filepath)
+        else:
+            df = await read_postgres(store, since_id, until_id)
+            record_count = len(df)
+            print("📊 Creating Excel export...")
+            excel_filepath = create_excel_export(process_dataframe(df), sheet_name)
+        export_stats = await store.registration_stats()
+        
+        print("📧 Sending export via email...")
+        if not send_export_email(excel_filepath, export_stats, None if full else record_count):
+            print(f"⚠️  Export created but email failed. File saved as: {excel_filepath}")
+            return
+        await store.save_watermark(EXPORT_STATE_NAME, until_id)
+        logger.info(f"Export watermark set to id {until_id}")
+        print(f"✅ Export successful! {record_count} café registrations sent to {EXPORT_EMAIL}")
+    finally:
+        await store.close()
+    
+    cleanup_file(excel_filepath)
+    print("🎉 Political café export completed successfully!")
+
 def main():
     """Main export function"""
+    parser = argparse.ArgumentParser(description="Export café registrations to Excel and email them")
+    parser.add_argument('--full', action='store_true',
+                        help="Export every registration instead of only the new ones")
+    parser.add_argument('--engine', choices=EXPORT_ENGINES,
+                        help="lite streams rows without pandas (default); pandas is used for --include-archive")
+    parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='xlsx',
+                        help="File to attach; csv needs the lite engine")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Same as --engine lite")
+    parser.add_argument('--include-archive', action='store_true',
+                        help="Also export registrations archived to Parquet (requires --full)")
+    args = parser.parse_args()
+    if args.streaming:
+        if args.engine == 'pandas':
+            parser.error("--streaming is the lite engine and cannot be combined with --engine pandas")
+        args.engine = 'lite'
+    if args.include_archive:
+        if not args.full:
+            parser.error("--include-archive only works with --full")
+        if args.engine == 'lite':
+            parser.error("--include-archive needs the pandas engine")
+        if STORAGE_BACKEND == 'postgres':
+            parser.error("--include-archive needs STORAGE_BACKEND=sqlite")
+    engine = args.engine or ('pandas' if args.include_archive else 'lite')
+    if args.export_format == 'csv' and engine != 'lite':
+        parser.error("--format csv needs the lite engine")
+    
     try:
         print("🍃 Starting SamenWerkt political café export...")
         
+        if STORAGE_BACKEND == 'postgres':
+            asyncio.run(export_postgres(args.full, engine, args.export_format))
+            return
+        
         # Check if database exists
         if not DB_PATH.exists():
             logger.error(f"Database not found at {DB_PATH}")
             print("❌ Database file not found!")
             return
         
-        # Read data from database
-        print("📖 Reading café registration data from database...")
-        df = read_database()
+        # Apply pending schema migrations (safe while the backend is running)
+        migration_db = Database(DB_PATH)
+        run_migrations(migration_db)
+        migration_db.close()
+        
+        # Fix the range of rows for this run, so rows added meanwhile go to the next one
+        conn = sqlite3.connect(DB_PATH)
+        since_id = 0 if args.full else get_watermark(conn)
+        until_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cafe_registrations").fetchone()[0]
+        if args.include_archive and archive.has_archive():
+            until_id = max(until_id, archive.archived_max_id())
+        conn.close()
         
-        # Process the data
-        print("🔄 Processing data...")
-        df_processed = process_dataframe(df)
+        if not args.full and until_id <= since_id:
+            print("✅ No new café registrations since the previous export, nothing to send.")
+            return
         
-        # Create Excel export
-        print("📊 Creating Excel export...")
-        excel_filepath = create_excel_export(df_processed)
+        sheet_name = SHEET_NAME if args.full else DELTA_SHEET_NAME
+        if engine == 'lite':
+            # Stream rows from the database straight into the file
+            export_stats = None
+            if args.export_format == 'csv':
+                print("📊 Creating CSV export...")
+                excel_filepath, record_count = create_csv_export(since_id, until_id)
+            else:
+                print("📊 Creating streaming Excel export...")
+                excel_filepath, record_count = create_excel_export_streaming(since_id, until_id, sheet_name)
+        else:
+            # Read data from database
+            print("📖 Reading café registration data from database...")
+            df = read_database(since_id, until_id, include_archive=args.include_archive)
+            record_count = len(df)
+            
+            # Statistics in one pass over the loaded rows, before they are reformatted
+            export_stats = registration_stats_from_dataframe(df) if args.full and args.include_archive else None
+            
+            # Process the data
+            print("🔄 Processing data...")
+            df_processed = process_dataframe(df)
+            
+            # Create Excel export
+            print("📊 Creating Excel export...")
+            excel_filepath = create_excel_export(df_processed, sheet_name)
+        
+        conn = sqlite3.connect(DB_PATH)
+        if export_stats is None:
+            # Statistics always cover every registration, via one GROUP BY query plus the archive
+            export_stats = all_registration_stats(conn)
         
         # Send email
         print("📧 Sending export via email...")
-        email_sent = send_export_email(excel_filepath, len(df))
+        email_sent = send_export_email(excel_filepath, export_stats, None if args.full else record_count)
         
         if email_sent:
-            print(f"✅ Export successful! {len(df)} café registrations sent to {EXPORT_EMAIL}")
+            save_watermark(conn, until_id)
+            conn.close()
+            print(f"✅ Export successful! {record_count} café registrations sent to {EXPORT_EMAIL}")
         else:
+            conn.close()
             print(f"⚠️  Export created but email failed. File saved as: {excel_filepath}")
             return  # Don't cleanup if email failed
         
@@ -281,4 +658,4 @@ def main():
         print(f"❌ Export failed: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Background health monitor for the SamenWerkt backend
+
+Load balancers poll the health endpoints far more often than anything
+changes, so the checks do not run per request. A background task probes
+the dependencies every HEALTH_INTERVAL seconds:
+
+    database    a heartbeat row is written, so a read-only or locked
+                database fails, not just an unreachable one
+    smtp        a separate connection to the mail server answers NOOP
+    mail_queue  pending mails stay under HEALTH_MAX_QUEUE_DEPTH
+    disk        the database directory has HEALTH_MIN_FREE_MB free
+
+Each round produces a snapshot that is serialized to JSON once, and the
+endpoints send those bytes as they are. A failing database or disk makes
+the process unready. SMTP problems and a long queue only mark it degraded,
+because registrations are still stored and the mails are retried.
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from serialization import dumps
+from smtp_pool import SMTPPool
+
+logger = logging.getLogger(__name__)
+
+HEALTH_INTERVAL = float(os.environ.get("HEALTH_INTERVAL", "10"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "3"))
+HEALTH_MAX_QUEUE_DEPTH = int(os.environ.get("HEALTH_MAX_QUEUE_DEPTH", "1000"))
+HEALTH_MIN_FREE_MB = int(os.environ.get("HEALTH_MIN_FREE_MB", "200"))
+
+STATUS_OK = 'OK'
+STATUS_DEGRADED = 'DEGRADED'
+STATUS_ERROR = 'ERROR'
+
+# Checks whose failure takes the process out of rotation
+CRITICAL_CHECKS = ('database', 'disk')
+
+
+class HealthMonitor:
+    """Runs the health checks on an interval and keeps the latest result ready to send"""
+
+    def __init__(
+        self,
+        store,
+        smtp: SMTPPool,
+        disk_path: Path,
+        interval: float = HEALTH_INTERVAL,
+        timeout: float = HEALTH_CHECK_TIMEOUT,
+        max_queue_depth: int = HEALTH_MAX_QUEUE_DEPTH,
+        min_free_mb: int = HEALTH_MIN_FREE_MB,
+        extra: Optional[Callable[[], dict]] = None,
+    ):
+        self.store = store
+        self.smtp = smtp
+        self.disk_path = disk_path
+        self.interval = interval
+        self.timeout = timeout
+        self.max_queue_depth = max_queue_depth
+        self.min_free_mb = min_free_mb
+        # Extra fields for the snapshot, such as executor statistics
+        self.extra = extra
+        # Heartbeat row of this process
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.snapshot: dict = {}
+        self.body = b''
+        self.ready = False
+        self.checked_at = 0.0
+        self._failing: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Run the first round of checks, then keep checking in the background"""
+        await self.check()
+        self._task = asyncio.create_task(self._run(), name="health-monitor")
+        logger.info(f"Health monitor started (every {self.interval:g}s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.ready = False
+
+    @property
+    def live(self) -> bool:
+        """The monitor is still completing rounds, so the event loop is not stuck"""
+        return self._task is not None and time.monotonic() - self.checked_at < 3 * self.interval + self.timeout
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Health check round failed: {e}")
+
+    async def _check_database(self) -> dict:
+        await self.store.probe_write(self.name)
+        return {'ok': True, 'backend': self.store.name}
+
+    async def _check_smtp(self) -> dict:
+        await asyncio.to_thread(self.smtp.probe, self.timeout)
+        return {'ok': True, 'server': f"{self.smtp.host}:{self.smtp.port}"}
+
+    async def _check_mail_queue(self) -> dict:
+        counts = await self.store.mail_queue_counts()
+        return {'ok': counts['pending'] <= self.max_queue_depth, **counts}
+
+    async def _check_disk(self) -> dict:
+        usage = await asyncio.to_thread(shutil.disk_usage, self.disk_path)
+        free_mb = usage.free // (1024 * 1024)
+        return {'ok': free_mb >= self.min_free_mb, 'free_mb': free_mb, 'used_percent': round(usage.used / usage.total * 100, 1)}
+
+    async def _timed(self, check) -> dict:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(check(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            result = {'ok': False, 'error': f"timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {'ok': False, 'error': str(e) or type(e).__name__}
+        result['ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    async def check(self) -> dict:
+        """Run all checks concurrently and publish a new snapshot"""
+        names = ('database', 'smtp', 'mail_queue', 'disk')
+        results = await asyncio.gather(*(self._timed(check) for check in (
+            self._check_database, self._check_smtp, self._check_mail_queue, self._check_disk
+        )))
+        checks = dict(zip(names, results))
+
+        if not all(checks[name]['ok'] for name in CRITICAL_CHECKS):
+            status = STATUS_ERROR
+        elif not all(check['ok'] for check in checks.values()):
+            status = STATUS_DEGRADED
+        else:
+            status = STATUS_OK
+        # Log changes only, not every round of a lasting outage
+        for name, check in checks.items():
+            if not check['ok'] and name not in self._failing:
+                details = check.get('error') or {key: value for key, value in check.items() if key not in ('ok', 'ms')}
+                logger.warning(f"Health check {name} failed: {details}")
+            elif check['ok'] and name in self._failing:
+                logger.info(f"Health check {name} recovered")
+        self._failing = {name for name, check in checks.items() if not check['ok']}
+
+        store_name = self.store.name
+        snapshot = {
+            "status": status,
+            "timestamp": datetime.now().isoformat(),
+            "database": store_name if checks['database']['ok'] else f"{store_name} (niet bereikbaar)",
+            "email": f"SMTP ({self.smtp.host}:{self.smtp.port})" + ("" if checks['smtp']['ok'] else " (niet bereikbaar)"),
+            "checks": checks,
+            **(self.extra() if self.extra else {}),
+        }
+        # Serialized once here instead of on every poll
+        self.body = dumps(snapshot)
+        self.snapshot = snapshot
+        self.ready = status != STATUS_ERROR
+        self.checked_at = time.monotonic()
+        return snapshot
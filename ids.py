@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Collision-free identifiers for café registrations
+
+Generates ULIDs: a 48-bit millisecond timestamp followed by 80 random
+bits, written as 26 Crockford base32 characters. They sort by creation
+time. Within one millisecond, successive IDs from this process increase
+monotonically, so they stay unique under load, unlike a bare
+millisecond timestamp.
+"""
+
+import os
+import threading
+import time
+
+_CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(_CROCKFORD[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def new_ulid() -> str:
+    """Return a new monotonic ULID string"""
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            # Same (or earlier) millisecond: increment the random part instead
+            now_ms = _last_ms
+            _last_random += 1
+            if _last_random > _RANDOM_MAX:
+                now_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), 'big') >> 1
+        else:
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        _last_ms = now_ms
+        return _encode(now_ms, 10) + _encode(_last_random, 16)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Durable outbound mail queue for SamenWerkt café registrations
+
+Mails are stored next to cafe_registrations, in SQLite or PostgreSQL
+(see storage.py), and sent by background worker tasks, so the API can
+answer as soon as a registration is committed. Failed sends are retried
+with exponential backoff. A mail the SMTP server rejects, or one of an
+unknown kind, fails at once; retrying would only be rejected again.
+Senders raise on failure, and the error is kept in last_error.
+
+Claiming a mail sets its status to 'sending' and its next_attempt_at to the
+end of a lease. If the process dies mid-send, the lease runs out and any
+worker, in this process or another, picks the mail up again. Several
+backend processes can therefore share one queue.
+
+max_per_minute caps the outbound mail rate of this process. Each claimed
+mail reserves a slot in a token bucket and waits for it, so a burst of
+registrations is sent out evenly instead of all at once.
+
+The payload of a mail is the submission serialized once, when it was
+stored; every mail of that submission shares it. Senders receive the
+payload text and parse it themselves, so they can reuse it as is.
+"""
+
+import asyncio
+import random
+import sqlite3
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db import Database
+from executors import BoundedExecutor
+from metrics import MAIL_ATTEMPTS, MAIL_THROTTLE_WAIT
+from rate_limit import TokenBucket
+from smtp_pool import is_rejection
+from serialization import dumps_text
+from tracing import maybe_trace
+
+logger = logging.getLogger(__name__)
+
+# Mail status values
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def create_mail_queue_table(cursor: sqlite3.Cursor):
+    """Create the mail_queue table and its index if they do not exist"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mail_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            registration_id INTEGER,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_mail_queue_due
+        ON mail_queue (status, next_attempt_at)
+    ''')
+
+
+def submission_payload(form_data: dict) -> str:
+    """The mail payload of a submission; indented, because the notification mail shows it"""
+    return dumps_text(form_data, indent=True)
+
+
+def enqueue_mails(cursor: sqlite3.Cursor, mails: List[Tuple[Optional[int], str, str]]):
+    """Queue (registration_id, kind, payload) mails inside the caller's transaction
+
+    They commit together with the registration, with one executemany.
+    """
+    now, created_at = time.time(), datetime.now().isoformat()
+    cursor.executemany('''
+        INSERT INTO mail_queue (
+            registration_id, kind, payload, status, attempts, next_attempt_at, created_at
+        ) VALUES (?, ?, ?, ?, 0, ?, ?)
+    ''', [
+        (registration_id, kind, payload, STATUS_PENDING, now, created_at)
+        for registration_id, kind, payload in mails
+    ])
+
+
+# Mails of one registration, looked up by its public registration_uid
+MAIL_STATUS_QUERY = '''
+    SELECT m.kind, m.status, m.attempts, m.last_error, m.created_at, m.sent_at
+    FROM mail_queue m JOIN cafe_registrations r ON r.id = m.registration_id
+    WHERE r.registration_uid = {} ORDER BY m.id
+'''
+
+
+def mail_status_rows(rows) -> List[dict]:
+    """Mail status rows as dicts, for the admin API"""
+    return [
+        {
+            'kind': kind, 'status': status, 'attempts': attempts,
+            'last_error': last_error, 'created_at': created_at, 'sent_at': sent_at
+        }
+        for kind, status, attempts, last_error, created_at, sent_at in rows
+    ]
+
+
+def get_mail_status(db: Database, registration_uid: str) -> List[dict]:
+    """Return the status of every queued mail for a registration"""
+    return mail_status_rows(db.execute(MAIL_STATUS_QUERY.format('?'), (registration_uid,)))
+
+
+def summarize_mail_counts(rows) -> dict:
+    """Fold (status, count, earliest next_attempt_at) rows into queue depth figures"""
+    counts = {STATUS_PENDING: 0, STATUS_SENDING: 0, STATUS_FAILED: 0}
+    oldest_due = None
+    for status, count, first_due in rows:
+        counts[status] = count
+        if status == STATUS_PENDING:
+            oldest_due = first_due
+    counts['oldest_due_seconds'] = round(max(0.0, time.time() - oldest_due), 1) if oldest_due else 0.0
+    return counts
+
+
+def mail_queue_counts(db: Database) -> dict:
+    """Number of pending, sending and failed mails, and how long the oldest due mail has waited"""
+    return summarize_mail_counts(db.execute('''
+        SELECT status, COUNT(*), MIN(next_attempt_at) FROM mail_queue
+        WHERE status IN (?, ?, ?) GROUP BY status
+    ''', (STATUS_PENDING, STATUS_SENDING, STATUS_FAILED)))
+
+
+def claim_mail(db: Database, lease_seconds: float) -> Optional[tuple]:
+    """Atomically lease the oldest due mail, or one whose lease ran out, and return it"""
+    now = time.time()
+    with db.transaction() as cursor:
+        row = cursor.execute('''
+            SELECT id, kind, payload, attempts FROM mail_queue
+            WHERE status IN (?, ?) AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id LIMIT 1
+        ''', (STATUS_PENDING, STATUS_SENDING, now)).fetchone()
+        if row:
+            cursor.execute(
+                "UPDATE mail_queue SET status = ?, next_attempt_at = ? WHERE id = ?",
+                (STATUS_SENDING, now + lease_seconds, row[0])
+            )
+    return row
+
+
+def update_mail(db: Database, mail_id: int, status: str, attempts: int,
+                error: Optional[str], next_attempt_at: Optional[float] = None):
+    """Record the outcome of a send attempt; a successful one also sets sent_at"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            UPDATE mail_queue SET status = ?, attempts = ?, last_error = ?,
+                next_attempt_at = COALESCE(?, next_attempt_at),
+                sent_at = CASE WHEN ? IS NULL THEN ? ELSE sent_at END
+            WHERE id = ?
+        ''', (status, attempts, error, next_attempt_at, error, datetime.now().isoformat(), mail_id))
+
+
+class MailQueue:
+    """Background workers that drain the mail queue of a storage backend
+
+    store is a storage.RegistrationStore; it claims mails and records the
+    results, the queue itself only decides when to retry.
+    """
+
+    def __init__(
+        self,
+        store,
+        senders: Dict[str, Callable[[str], None]],
+        workers: int = 2,
+        max_attempts: int = 6,
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0,
+        poll_interval: float = 5.0,
+        executor: Optional[BoundedExecutor] = None,
+        lease_seconds: float = 300.0,
+        max_per_minute: float = 0,
+        burst: int = 10,
+    ):
+        self.store = store
+        self.senders = senders
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.executor = executor
+        self.lease_seconds = lease_seconds
+        self._throttle = TokenBucket(max_per_minute / 60, burst) if max_per_minute > 0 else None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+
+    async def start(self):
+        """Start the worker tasks"""
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._worker(n), name=f"mail-worker-{n}")
+            for n in range(self.workers)
+        ]
+        logger.info(f"Mail queue started with {self.workers} workers")
+
+    async def stop(self):
+        """Stop the workers; sends in progress are allowed to finish"""
+        self._running = False
+        if self._wakeup:
+            self._wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Mail queue stopped")
+
+    def wake(self):
+        """Signal the workers that new mail has been queued"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _worker(self, number: int):
+        """Process due mails until stopped, sleeping when the queue is empty"""
+        while self._running:
+            try:
+                processed = await self._process_next()
+            except Exception as e:
+                logger.error(f"Mail worker {number} error: {e}")
+                processed = False
+
+            if processed:
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter for the given attempt count"""
+        delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _send(self, kind: str, payload: str) -> Optional[Exception]:
+        """Run the sender for a mail; returns the error it raised, or None on success"""
+        sender = self.senders.get(kind)
+        if sender is None:
+            return LookupError(f"Unknown mail kind: {kind}")
+        try:
+            if self.executor:
+                await self.executor.run(sender, payload)
+            else:
+                await asyncio.to_thread(sender, payload)
+            return None
+        except Exception as e:
+            return e
+
+    async def _process_next(self) -> bool:
+        """Send one due mail; returns False when nothing was due"""
+        row = await self.store.claim_mail(self.lease_seconds)
+        if row is None:
+            return False
+
+        # The database lock is not held while talking to the SMTP server
+        mail_id, kind, payload, attempts = row
+        if self._throttle:
+            # Wait for this mail's slot under the rate cap; the lease covers the wait
+            delay = self._throttle.reserve()
+            MAIL_THROTTLE_WAIT.observe(delay)
+            if delay:
+                await asyncio.sleep(delay)
+        async with maybe_trace(f"mail {kind}"):
+            error = await self._send(kind, payload)
+        await self._record_result(mail_id, kind, attempts + 1, error)
+        return True
+
+    async def _record_result(self, mail_id: int, kind: str, attempts: int, exc: Optional[Exception]):
+        """Mark a mail as sent, schedule a retry with backoff, or give up"""
+        if exc is None:
+            await self.store.update_mail(mail_id, STATUS_SENT, attempts, None)
+            MAIL_ATTEMPTS.inc(kind, 'sent')
+            return
+        error = str(exc) or type(exc).__name__
+        if attempts >= self.max_attempts or kind not in self.senders or is_rejection(exc):
+            await self.store.update_mail(mail_id, STATUS_FAILED, attempts, error)
+            MAIL_ATTEMPTS.inc(kind, 'failed')
+            logger.error(f"Mail {mail_id} ({kind}) failed permanently: {error}")
+        else:
+            await self.store.update_mail(
+                mail_id, STATUS_PENDING, attempts, error, time.time() + self._backoff(attempts)
+            )
+            MAIL_ATTEMPTS.inc(kind, 'retry')
+            logger.warning(f"Mail {mail_id} ({kind}) attempt {attempts} failed, will retry: {error}")
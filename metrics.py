@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+In-process metrics in the Prometheus text format
+
+Counters, gauges and histograms with optional labels, cheap enough to stay
+on in production: recording is a dict lookup and an addition under an
+uncontended per-metric lock. Every metric registers itself in REGISTRY,
+and render() produces the text served by /api/metrics.
+
+Metrics are kept per process. Work done in a process pool (MAIL_POOL=process)
+is recorded in the worker processes and does not show up here.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+# Latency buckets in seconds, from sub-millisecond SQLite inserts to slow SMTP sessions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        # Unlabeled counters start at 0 so they are exported before the first event
+        self._values: Dict[Labels, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; a callback gauge is read at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self.callback = callback
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    @contextmanager
+    def track(self, *labels: str):
+        """Count the block as in progress while it runs"""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+    def _samples(self) -> Iterator[str]:
+        if self.callback is not None:
+            values = list(self.callback().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, typically durations in seconds"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count above the last bucket], sum
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the duration of the block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), self._sums[labels]) for labels, counts in self._counts.items()]
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound) if bound == float("inf") else bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {repr(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+# Shared metrics; modules that own a resource record to these
+REQUESTS = Counter('http_requests_total', 'HTTP requests by method, route and status', ('method', 'route', 'status'))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'HTTP request latency by route', ('route',))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being handled')
+STAGE_DURATION = Histogram('cafe_submission_stage_seconds', 'Duration of each stage of a café submission', ('stage',))
+DB_LOCK_WAIT = Histogram('db_lock_wait_seconds', 'Time spent waiting for the SQLite write lock')
+SMTP_SEND_DURATION = Histogram('smtp_send_seconds', 'Duration of one SMTP message send')
+SMTP_FAILURES = Counter('smtp_failures_total', 'SMTP sends that failed, by error type', ('error',))
+SMTP_RETRIES = Counter('smtp_retries_total', 'SMTP sends retried on a new connection after a dropped session')
+MAIL_ATTEMPTS = Counter('mail_queue_attempts_total', 'Mail queue delivery attempts by kind and outcome', ('kind', 'outcome'))
+RATE_LIMITED = Counter('rate_limited_total', 'Requests rejected with 429 by the client or global limit', ('scope',))
+MAIL_THROTTLE_WAIT = Histogram('mail_throttle_wait_seconds', 'Time mails waited for the outbound mail rate cap')
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the SamenWerkt SQLite database
+
+Migrations run at startup in version order. Each applied version is
+recorded in the schema_migrations table. Every migration is safe to run
+against a live politekcafe.db:
+
+- new columns are added with ALTER TABLE ADD COLUMN, which does not rewrite the table
+- indexes are created with IF NOT EXISTS
+- backfills run in small batches, each in its own short transaction, and only
+  touch rows that are still NULL, so an interrupted run can simply continue
+"""
+
+import os
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from db import Database
+from ids import new_ulid
+from mail_queue import create_mail_queue_table
+from submissions import normalize_email
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 1000
+CAFE_EVENT = os.environ.get("CAFE_EVENT", "politiek-cafe")
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> set:
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_columns(cursor: sqlite3.Cursor, table: str, columns: List[Tuple[str, str]]):
+    """Add columns that do not exist yet"""
+    existing = _columns(cursor, table)
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _backfill(db: Database, update_sql: str, params: tuple = ()):
+    """Run an UPDATE ... WHERE id IN (... LIMIT ?) in batches until no rows change"""
+    while True:
+        with db.transaction() as cursor:
+            cursor.execute(update_sql, (*params, BACKFILL_BATCH))
+            if cursor.rowcount < BACKFILL_BATCH:
+                return
+
+
+def migration_001_initial_schema(db: Database):
+    """cafe_registrations and mail_queue tables"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cafe_registrations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                naam TEXT NOT NULL,
+                email TEXT NOT NULL,
+                lid_van_samenwerkt TEXT NOT NULL,
+                komt_naar_cafe TEXT NOT NULL,
+                telefoonnummer TEXT NOT NULL,
+                opmerkingen TEXT,
+                timestamp TEXT NOT NULL,
+                submission_data TEXT NOT NULL
+            )
+        ''')
+        create_mail_queue_table(cursor)
+
+
+def migration_002_duplicate_detection(db: Database):
+    """Registration IDs, normalized email, event and idempotency key with unique indexes"""
+    with db.transaction() as cursor:
+        _add_columns(cursor, 'cafe_registrations', [
+            ('registration_uid', 'TEXT'),
+            ('email_normalized', 'TEXT'),
+            ('event', 'TEXT'),
+            ('idempotency_key', 'TEXT'),
+        ])
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_cafe_registrations_email_event
+            ON cafe_registrations (email_normalized, event) WHERE event IS NOT NULL
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_cafe_registrations_idempotency_key
+            ON cafe_registrations (idempotency_key) WHERE idempotency_key IS NOT NULL
+        ''')
+
+
+def migration_003_flag_columns(db: Database):
+    """Compact 0/1 columns for the two ja/nee answers, backfilled from the text columns"""
+    with db.transaction() as cursor:
+        _add_columns(cursor, 'cafe_registrations', [
+            ('lid_van_samenwerkt_flag', 'INTEGER'),
+            ('komt_naar_cafe_flag', 'INTEGER'),
+        ])
+    _backfill(db, '''
+        UPDATE cafe_registrations
+        SET lid_van_samenwerkt_flag = (lid_van_samenwerkt = 'ja'),
+            komt_naar_cafe_flag = (komt_naar_cafe = 'ja')
+        WHERE id IN (
+            SELECT id FROM cafe_registrations
+            WHERE lid_van_samenwerkt_flag IS NULL OR komt_naar_cafe_flag IS NULL
+            LIMIT ?
+        )
+    ''')
+
+
+def migration_004_export_indexes(db: Database):
+    """Indexes for the export's ORDER BY timestamp, email lookups and flag counts"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cafe_registrations_timestamp
+            ON cafe_registrations (timestamp)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cafe_registrations_email
+            ON cafe_registrations (email)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cafe_registrations_komt_naar_cafe
+            ON cafe_registrations (komt_naar_cafe_flag)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cafe_registrations_lid_van_samenwerkt
+            ON cafe_registrations (lid_van_samenwerkt_flag)
+        ''')
+        cursor.execute("ANALYZE cafe_registrations")
+
+
+def migration_005_export_state(db: Database):
+    """High-water marks for incremental exports"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS export_state (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                last_timestamp TEXT,
+                exported_at TEXT NOT NULL
+            )
+        ''')
+
+
+def migration_006_health_state(db: Database):
+    """Heartbeat rows written by the health monitor to prove the database is writable"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS health_state (
+                name TEXT PRIMARY KEY,
+                checked_at TEXT NOT NULL
+            )
+        ''')
+
+
+def migration_007_bulk_mail(db: Database):
+    """Bulk mail campaigns and their per-recipient delivery checkpoints"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bulk_campaigns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                template TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                context TEXT NOT NULL,
+                audience TEXT NOT NULL,
+                event TEXT NOT NULL,
+                status TEXT NOT NULL,
+                last_registration_id INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                finished_at TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bulk_deliveries (
+                campaign_id INTEGER NOT NULL,
+                registration_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (campaign_id, registration_id)
+            ) WITHOUT ROWID
+        ''')
+
+
+def migration_008_backfill_duplicate_detection(db: Database):
+    """Registration IDs, normalized email and event for rows stored before migration 2"""
+    # The backend's own normalization and IDs, so old rows match new ones
+    db.connection.create_function('normalize_email', 1, normalize_email, deterministic=True)
+    db.connection.create_function('new_ulid', 0, new_ulid)
+    _backfill(db, '''
+        UPDATE cafe_registrations
+        SET email_normalized = COALESCE(email_normalized, normalize_email(email)),
+            registration_uid = COALESCE(registration_uid, new_ulid())
+        WHERE id IN (
+            SELECT id FROM cafe_registrations
+            WHERE email_normalized IS NULL OR registration_uid IS NULL
+            LIMIT ?
+        )
+    ''')
+    # The unique index allows one registration per address and event: the
+    # oldest gets the event, later repeats keep NULL
+    _backfill(db, '''
+        UPDATE cafe_registrations SET event = ?
+        WHERE id IN (
+            SELECT r.id FROM cafe_registrations r
+            WHERE r.event IS NULL AND NOT EXISTS (
+                SELECT 1 FROM cafe_registrations e
+                WHERE e.email_normalized = r.email_normalized
+                  AND (e.event = ? OR (e.event IS NULL AND e.id < r.id))
+            )
+            LIMIT ?
+        )
+    ''', (CAFE_EVENT, CAFE_EVENT))
+
+
+def migration_009_email_normalized_index(db: Database):
+    """Index for finding every registration of an address, whatever its event"""
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cafe_registrations_email_normalized
+            ON cafe_registrations (email_normalized)
+        ''')
+
+
+MIGRATIONS: List[Tuple[int, Callable[[Database], None]]] = [
+    (1, migration_001_initial_schema),
+    (2, migration_002_duplicate_detection),
+    (3, migration_003_flag_columns),
+    (4, migration_004_export_indexes),
+    (5, migration_005_export_state),
+    (6, migration_006_health_state),
+    (7, migration_007_bulk_mail),
+    (8, migration_008_backfill_duplicate_detection),
+    (9, migration_009_email_normalized_index),
+]
+
+
+def applied_versions(db: Database) -> set:
+    with db.transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        return {row[0] for row in cursor.execute("SELECT version FROM schema_migrations")}
+
+
+def run_migrations(db: Database) -> int:
+    """Apply all pending migrations in order and return how many were applied"""
+    done = applied_versions(db)
+    applied = 0
+    for version, migration in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"Applying migration {version}: {migration.__doc__}")
+        migration(db)
+        with db.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, migration.__name__, datetime.now().isoformat())
+            )
+        applied += 1
+    if applied:
+        logger.info(f"Database schema is at version {MIGRATIONS[-1][0]}")
+    return applied
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Token-bucket admission control for the SamenWerkt backend
+
+A TokenBucket holds up to `burst` tokens and refills at `rate` tokens per
+second. RateLimiter keeps one bucket per key (the client IP) in an
+OrderedDict ordered by last use. A bucket left alone for burst / rate
+seconds is full again, which is the same as having no bucket, so idle
+buckets are dropped from the front of the dict as new requests come in.
+That keeps memory bounded by the number of recently active clients, with
+O(1) work per request and no background sweeper.
+
+All methods are called from the event loop thread only, so no lock is used.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """Tokens refill continuously at rate per second, up to burst"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: Optional[float] = None) -> float:
+        """Take one token if available; returns 0, or the seconds until one is"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self, now: Optional[float] = None) -> float:
+        """Take one token, borrowing from the future; returns the seconds to wait before using it"""
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Token bucket per key with expiry of idle buckets and a cap on the number of keys"""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 100000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        # After this long unused a bucket is full again and can be forgotten
+        self.idle_seconds = burst / self.rate
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def _expire(self, now: float):
+        """Drop buckets that are full again, oldest first"""
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket.updated < self.idle_seconds:
+                break
+            del buckets[key]
+
+    def check(self, key: str) -> float:
+        """Count one request for key; returns 0 to admit it, or the seconds to wait"""
+        now = time.monotonic()
+        self._expire(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                # Under a flood of distinct clients, forget the least recently seen
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+JSON serialization for the SamenWerkt backend
+
+One set of functions for every place that turns submissions and responses
+into JSON, backed by the fastest library that is installed:
+
+    orjson      preferred; several times faster than the json module
+    msgspec     used when orjson is not installed
+    json        the standard library, always available
+
+JSON_BACKEND forces one of them (default "auto"). dumps() returns UTF-8
+bytes, compact or indented by two spaces; loads() accepts str or bytes.
+No backend escapes non-ASCII characters, so their output can be stored
+interchangeably."""
+
+import json
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+
+JSON_BACKENDS = ('auto', 'orjson', 'msgspec', 'json')
+
+
+def _select_backend(requested: str) -> str:
+    if requested not in JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON_BACKEND '{requested}', expected one of {JSON_BACKENDS}")
+    available = {'orjson': orjson is not None, 'msgspec': msgspec is not None, 'json': True}
+    if requested == 'auto':
+        return next(name for name, ok in available.items() if ok)
+    if not available[requested]:
+        raise ValueError(f"JSON_BACKEND is '{requested}' but that package is not installed")
+    return requested
+
+
+BACKEND = _select_backend(JSON_BACKEND)
+
+if BACKEND == 'orjson':
+    def dumps(obj: Any, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+    loads = orjson.loads
+
+elif BACKEND == 'msgspec':
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any, indent: bool = False) -> bytes:
+        data = _encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if indent else data
+
+    loads = _decoder.decode
+
+else:
+    def dumps(obj: Any, indent: bool = False) -> bytes:
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+
+
+def dumps_text(obj: Any, indent: bool = False) -> str:
+    """Serialize obj to a JSON string, for TEXT columns and templates"""
+    return dumps(obj, indent).decode('utf-8')
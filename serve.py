@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Launcher for the SamenWerkt backend with one or more worker processes
+
+Applies the schema migrations once, before any worker starts, and then
+runs uvicorn with the requested number of workers. The workers share the
+SQLite database in WAL mode: writes are serialized by SQLite's own lock
+(BEGIN IMMEDIATE plus a busy timeout), and the mail queue hands out leases
+so each mail is sent by one worker.
+
+With STORAGE_BACKEND=postgres the schema is created in PostgreSQL instead,
+and each worker opens its own connection pool.
+
+On SIGTERM or SIGINT uvicorn stops accepting connections and waits up to
+GRACEFUL_TIMEOUT seconds for requests in progress. Each worker then flushes
+its group-commit writer, lets running mail sends finish and closes the
+database before it exits.
+
+Usage: python serve.py [--workers 4] [--host 0.0.0.0] [--port 8521]
+"""
+
+import argparse
+import asyncio
+import os
+import logging
+from pathlib import Path
+
+import uvicorn
+
+from db import Database
+from migrations import run_migrations
+from storage import DATABASE_URL, STORAGE_BACKEND, PostgresStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DB_PATH = Path(os.environ.get("DB_PATH", Path(__file__).parent / "politekcafe.db"))
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8521"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+
+async def prepare_postgres():
+    store = PostgresStore(DATABASE_URL, event='', mail_kinds=(), min_size=1, max_size=1)
+    await store.open()
+    try:
+        applied = await store.migrate()
+        logger.info(f"PostgreSQL database ready ({applied} migrations applied)")
+    finally:
+        await store.close()
+
+
+def prepare_database(path: Path):
+    """Apply pending migrations once, so workers do not race to do it"""
+    if STORAGE_BACKEND == 'postgres':
+        asyncio.run(prepare_postgres())
+        return
+    db = Database(path).open()
+    try:
+        applied = run_migrations(db)
+        logger.info(f"Database ready ({applied} migrations applied)")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SamenWerkt backend")
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS,
+                        help="Number of worker processes (default: WEB_WORKERS or 1)")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--graceful-timeout', type=int, default=GRACEFUL_TIMEOUT,
+                        help="Seconds to wait for requests in progress on shutdown")
+    args = parser.parse_args()
+
+    prepare_database(DB_PATH)
+    # Inherited by the workers: skip migrations and leave the WAL to the other processes on exit
+    os.environ["SCHEMA_READY"] = "1"
+    os.environ["WEB_WORKERS"] = str(args.workers)
+
+    logger.info(f"Starting {args.workers} worker(s) on {args.host}:{args.port}")
+    uvicorn.run(
+        "backend:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+if __name__ == "__main__":
+    main()
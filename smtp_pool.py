@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Shared SMTP transport for SamenWerkt mail senders
+
+Keeps a bounded pool of persistent connections to the local Postfix,
+health-checks idle connections with NOOP, reconnects after errors and
+lets several messages share one session.
+
+smtplib (and ssl with it) is imported when the first connection opens,
+not when this module loads, which keeps worker start-up fast.
+"""
+
+import atexit
+import os
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, Tuple, Union
+
+from metrics import SMTP_FAILURES, SMTP_RETRIES, SMTP_SEND_DURATION
+from tracing import span
+
+if TYPE_CHECKING:
+    import smtplib
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "25"))
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "4"))
+
+Recipients = Union[str, Sequence[str]]
+
+
+def is_rejection(error: BaseException) -> bool:
+    """True when the server refused one message but the session is still usable"""
+    import smtplib
+    return isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                              smtplib.SMTPSenderRefused))
+
+
+class SMTPPool:
+    """Bounded pool of reusable smtplib.SMTP connections"""
+
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        max_connections: int = SMTP_POOL_SIZE,
+        timeout: float = 30.0,
+        max_idle: float = 120.0,
+        noop_after: float = 10.0,
+        max_messages: int = 100,
+    ):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.noop_after = noop_after
+        self.max_messages = max_messages
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        # Idle connections as (server, last_used, messages_sent)
+        self._idle = deque()
+
+    def _open(self) -> 'smtplib.SMTP':
+        import smtplib
+        with span('smtp.connect'):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            server.ehlo_or_helo_if_needed()
+        return server
+
+    @staticmethod
+    def _discard(server: 'smtplib.SMTP'):
+        """Close a connection without raising"""
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_healthy(self, server: 'smtplib.SMTP', last_used: float) -> bool:
+        """NOOP-check connections that have been idle for a while"""
+        idle = time.monotonic() - last_used
+        if idle > self.max_idle:
+            return False
+        if idle < self.noop_after:
+            return True
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self, fresh: bool = False) -> Tuple['smtplib.SMTP', int]:
+        if fresh:
+            return self._open(), 0
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                return self._open(), 0
+            server, last_used, sent = entry
+            if self._is_healthy(server, last_used):
+                return server, sent
+            self._discard(server)
+
+    def _checkin(self, server: 'smtplib.SMTP', sent: int):
+        if sent >= self.max_messages:
+            self._discard(server)
+            return
+        with self._lock:
+            self._idle.append((server, time.monotonic(), sent))
+
+    @contextmanager
+    def connection(self, fresh: bool = False):
+        """Borrow a connection; it is returned to the pool unless an error occurred
+
+        With fresh, a new connection is opened instead of reusing an idle one.
+        """
+        self._slots.acquire()
+        server = None
+        try:
+            server, sent = self._checkout(fresh)
+            session = _Session(server, sent)
+            yield session
+            self._checkin(server, session.sent)
+        except Exception:
+            if server is not None:
+                self._discard(server)
+            raise
+        finally:
+            self._slots.release()
+
+    def sendmail(self, from_addr: str, to_addrs: Recipients, message: Union[str, bytes]):
+        """Send one message, reconnecting once if the pooled session was dropped"""
+        import smtplib
+        try:
+            try:
+                with self.connection() as session:
+                    session.sendmail(from_addr, to_addrs, message)
+            except (smtplib.SMTPServerDisconnected, ConnectionResetError, BrokenPipeError):
+                # The other idle sessions were most likely dropped at the same time
+                logger.warning("SMTP connection lost, retrying on a new connection")
+                SMTP_RETRIES.inc()
+                self.close()
+                with self.connection(fresh=True) as session:
+                    session.sendmail(from_addr, to_addrs, message)
+        except Exception as e:
+            SMTP_FAILURES.inc(type(e).__name__)
+            raise
+
+    def send_many(self, messages: Iterable[Tuple[str, Recipients, Union[str, bytes]]]) -> List[Optional[Exception]]:
+        """Send several messages over one session; returns one error (or None) per message"""
+        results: List[Optional[Exception]] = []
+        pending = list(messages)
+        fresh = False
+        while pending:
+            try:
+                with self.connection(fresh) as session:
+                    while pending:
+                        from_addr, to_addrs, message = pending[0]
+                        try:
+                            session.sendmail(from_addr, to_addrs, message)
+                            results.append(None)
+                        except Exception as e:
+                            if not is_rejection(e):
+                                raise
+                            # Rejected message, the session itself is still usable
+                            SMTP_FAILURES.inc(type(e).__name__)
+                            results.append(e)
+                        pending.pop(0)
+            except Exception as e:
+                # Session broke: fail the current message and continue on a new connection
+                logger.warning(f"SMTP session error during batch send: {e}")
+                SMTP_FAILURES.inc(type(e).__name__)
+                results.append(e)
+                pending.pop(0)
+                self.close()
+                fresh = True
+        return results
+
+    def probe(self, timeout: float = 5.0):
+        """Connect and NOOP on a separate connection, leaving the pool alone; raises on failure"""
+        import smtplib
+        server = smtplib.SMTP(self.host, self.port, timeout=timeout)
+        try:
+            code, message = server.noop()
+            if code != 250:
+                raise smtplib.SMTPResponseException(code, message)
+        finally:
+            self._discard(server)
+
+    def close(self):
+        """Close all idle connections; later sends open new ones as needed"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for server, _, _ in idle:
+            self._discard(server)
+
+
+class _Session:
+    """A borrowed connection that counts the messages sent on it"""
+
+    def __init__(self, server: 'smtplib.SMTP', sent: int):
+        self.server = server
+        self.sent = sent
+
+    def sendmail(self, from_addr: str, to_addrs: Recipients, message: Union[str, bytes]):
+        with SMTP_SEND_DURATION.time(), span('smtp.sendmail'):
+            self.server.sendmail(from_addr, to_addrs, message)
+        self.sent += 1
+
+
+# Shared pool used by all mail senders in this process
+smtp_pool = SMTPPool()
+atexit.register(smtp_pool.close)
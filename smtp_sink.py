@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Local stand-in SMTP server for development and benchmarks
+
+Accepts mail like Postfix on localhost would, but keeps the messages in
+memory instead of delivering them. Run it next to the backend with
+SMTP_PORT pointed at it:
+
+Usage: python smtp_sink.py [--port 8025]
+"""
+
+import argparse
+import asyncio
+import threading
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSink:
+    """Minimal asyncio SMTP server that records every accepted message"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, keep_messages: bool = True):
+        self.host = host
+        self.port = port
+        self.keep_messages = keep_messages
+        self.messages: List[dict] = []
+        self.message_count = 0
+        self.connection_count = 0
+        # Recipients answered with 550, like unknown mailboxes
+        self.rejected_recipients: set = set()
+        self._writers: set = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connection_count += 1
+        self._writers.add(writer)
+        mail_from, rcpt_to = None, []
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 smtp-sink ESMTP ready")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                command = line[:4].upper()
+
+                if command == "EHLO":
+                    await reply("250-smtp-sink\r\n250-8BITMIME\r\n250 SIZE 10485760")
+                elif command == "HELO":
+                    await reply("250 smtp-sink")
+                elif command == "MAIL":
+                    mail_from, rcpt_to = line.split(":", 1)[1].strip(), []
+                    await reply("250 OK")
+                elif command == "RCPT":
+                    recipient = line.split(":", 1)[1].strip()
+                    if recipient.strip("<>") in self.rejected_recipients:
+                        await reply("550 5.1.1 Mailbox unavailable")
+                    else:
+                        rcpt_to.append(recipient)
+                        await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    chunks = []
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line in (b".\r\n", b".\n"):
+                            break
+                        chunks.append(data_line)
+                    self.message_count += 1
+                    if self.keep_messages:
+                        self.messages.append({
+                            "from": mail_from,
+                            "to": rcpt_to,
+                            "data": b"".join(chunks).decode("utf-8", "replace"),
+                        })
+                    mail_from, rcpt_to = None, []
+                    await reply("250 OK: queued")
+                elif command == "RSET":
+                    mail_from, rcpt_to = None, []
+                    await reply("250 OK")
+                elif command == "NOOP":
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _drop_connections(self):
+        writers = list(self._writers)
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*(writer.wait_closed() for writer in writers), return_exceptions=True)
+
+    async def serve(self):
+        """Start listening on the configured host and port"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"SMTP sink listening on {self.host}:{self.port}")
+
+    def start(self) -> "SMTPSink":
+        """Run the sink in a background thread and return once it is listening"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="smtp-sink", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def drop_connections(self):
+        """Close every open client connection, like a restarted or timed-out server"""
+        asyncio.run_coroutine_threadsafe(self._drop_connections(), self._loop).result(timeout=5)
+
+    def stop(self):
+        """Stop a sink started with start()"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+async def _main(host: str, port: int):
+    sink = SMTPSink(host, port, keep_messages=False)
+    await sink.serve()
+    async with sink._server:
+        await sink._server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local stand-in SMTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
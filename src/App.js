@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import {
   Container,
   Paper,
@@ -23,12 +23,13 @@ import {
 import Header from './components/Header';
 import SuccessModal from './components/SuccessModal';
 import { useForm } from './hooks/useForm';
-import { submitForm } from './services/api';
+import { newIdempotencyKey, submitForm } from './services/api';
 
 function App() {
   const { formData, isSubmitting, setIsSubmitting, errors, handleChange, validateForm, resetForm } = useForm();
   const [submitStatus, setSubmitStatus] = useState({ type: '', message: '' });
   const [showSuccessModal, setShowSuccessModal] = useState(false);
+  const idempotencyKey = useRef(newIdempotencyKey());
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -45,7 +46,8 @@ function App() {
     setSubmitStatus({ type: '', message: '' });
 
     try {
-      await submitForm(formData);
+      await submitForm(formData, idempotencyKey.current);
+      idempotencyKey.current = newIdempotencyKey();
       
       // Clear any error states and show success modal
       setSubmitStatus({ type: '', message: '' });
@@ -3,12 +3,19 @@ const API_BASE_URL =
     ? "/api" // Use relative path in production (proxied by Apache)
     : "http://localhost:8521/api"; // Use direct localhost in development
 
-export const submitForm = async (formData) => {
+// One key per filled-in form, so double clicks and retries are recognised by the server
+export const newIdempotencyKey = () =>
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
+export const submitForm = async (formData, idempotencyKey) => {
   try {
     const response = await fetch(`${API_BASE_URL}/cafe`, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
+        ...(idempotencyKey && { "Idempotency-Key": idempotencyKey }),
       },
       body: JSON.stringify(formData),
     });
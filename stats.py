@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Attendance and membership statistics for café registrations
+
+All counts come from one aggregated pass over the data: either a single
+GROUP BY query against SQLite, or one vectorized value_counts() over a
+DataFrame that has already been loaded. Both return the same structure:
+
+    {
+        "total": ..., "attending": ..., "not_attending": ...,
+        "members": ..., "non_members": ...,
+        "per_day": [{"date": "2025-01-31", "total": ..., "attending": ..., "members": ...}, ...],
+        "per_week": [{"week": "2025-W05", "total": ..., "attending": ..., "members": ...}, ...]
+    }
+"""
+
+import sqlite3
+from datetime import date
+from typing import TYPE_CHECKING, Iterable, Tuple, Union
+
+if TYPE_CHECKING:
+    from db import Database
+
+# (day, attending flag, member flag, count)
+Group = Tuple[str, int, int, int]
+
+STATS_QUERY = '''
+    SELECT substr(timestamp, 1, 10) AS day,
+           komt_naar_cafe_flag,
+           lid_van_samenwerkt_flag,
+           COUNT(*)
+    FROM cafe_registrations
+    GROUP BY day, komt_naar_cafe_flag, lid_van_samenwerkt_flag
+'''
+
+
+def _empty_bucket() -> dict:
+    return {'total': 0, 'attending': 0, 'members': 0}
+
+
+def summarize(groups: Iterable[Group]) -> dict:
+    """Fold grouped counts into totals and per-day and per-week breakdowns"""
+    totals = {'total': 0, 'attending': 0, 'not_attending': 0, 'members': 0, 'non_members': 0}
+    per_day, per_week = {}, {}
+
+    for day, attending, member, count in groups:
+        totals['total'] += count
+        totals['attending' if attending else 'not_attending'] += count
+        totals['members' if member else 'non_members'] += count
+
+        try:
+            year, week, _ = date.fromisoformat(day).isocalendar()
+            week_key = f"{year}-W{week:02d}"
+        except (TypeError, ValueError):
+            week_key = 'onbekend'
+        for buckets, key in ((per_day, day or 'onbekend'), (per_week, week_key)):
+            bucket = buckets.setdefault(key, _empty_bucket())
+            bucket['total'] += count
+            bucket['attending'] += count if attending else 0
+            bucket['members'] += count if member else 0
+
+    totals['per_day'] = [dict(date=key, **per_day[key]) for key in sorted(per_day)]
+    totals['per_week'] = [dict(week=key, **per_week[key]) for key in sorted(per_week)]
+    return totals
+
+
+def registration_stats(conn: Union[sqlite3.Connection, "Database"]) -> dict:
+    """Compute all statistics with one GROUP BY query on a connection or Database"""
+    return summarize(conn.execute(STATS_QUERY))
+
+
+def registration_stats_from_dataframe(df) -> dict:
+    """Compute all statistics from a DataFrame as returned by read_database()"""
+    if df.empty:
+        return summarize([])
+    counts = (
+        df.assign(
+            day=df['timestamp'].str.slice(0, 10),
+            attending=(df['komt_naar_cafe'] == 'ja').astype(int),
+            member=(df['lid_van_samenwerkt'] == 'ja').astype(int),
+        )[['day', 'attending', 'member']]
+        .value_counts(sort=False)
+    )
+    return summarize(
+        (day, attending, member, int(count))
+        for (day, attending, member), count in counts.items()
+    )
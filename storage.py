@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Storage backends for café registrations and the mail queue
+
+The backend talks to its storage through the async RegistrationStore
+interface, so a request never blocks the event loop on the database:
+
+    sqlite      (default) the shared SQLite connection from db.py. Like
+                aiosqlite, the blocking sqlite3 calls run on worker threads
+                (the storage executor) and are awaited from the event loop.
+                Optional group commit merges concurrent inserts.
+    postgres    a PostgreSQL-compatible server through asyncpg, with a
+                connection pool shared by all requests. Several backend
+                processes, or several events, can use one database.
+
+STORAGE_BACKEND selects the backend. The PostgreSQL backend reads its
+connection string from DATABASE_URL and needs the asyncpg package.
+"""
+
+import asyncio
+import importlib.util
+import os
+import time
+import logging
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple
+
+import archive
+from db import Database, GroupCommitWriter
+from executors import BoundedExecutor
+from mail_queue import (
+    MAIL_STATUS_QUERY, STATUS_FAILED, STATUS_PENDING, STATUS_SENDING,
+    claim_mail, get_mail_status, mail_queue_counts, mail_status_rows, submission_payload,
+    summarize_mail_counts, update_mail,
+)
+from migrations import run_migrations
+from stats import STATS_QUERY, summarize
+from submissions import normalize_email, registration_row
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" or "postgres"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+PG_POOL_MIN = int(os.environ.get("PG_POOL_MIN", "2"))
+PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", "10"))
+
+STORAGE_BACKENDS = ('sqlite', 'postgres')
+
+
+class RegistrationStore(ABC):
+    """Async interface to the registrations and the mail queue"""
+
+    name = ''
+
+    async def open(self):
+        """Connect; called once on startup"""
+
+    async def close(self):
+        """Release connections; called once on shutdown"""
+
+    @abstractmethod
+    async def migrate(self) -> int:
+        """Bring the schema up to date and return how many migrations were applied"""
+
+    @abstractmethod
+    async def store_submission(self, form_data: dict, idempotency_key: Optional[str] = None) -> Optional[Tuple[str, bool]]:
+        """Store a registration and queue its emails in one transaction
+
+        Returns (registration_uid, created), or None when storing failed.
+        """
+
+    @abstractmethod
+    async def claim_mail(self, lease_seconds: float) -> Optional[tuple]:
+        """Lease the oldest due mail and return (id, kind, payload, attempts)"""
+
+    @abstractmethod
+    async def update_mail(self, mail_id: int, status: str, attempts: int,
+                          error: Optional[str], next_attempt_at: Optional[float] = None):
+        """Record the outcome of a send attempt"""
+
+    @abstractmethod
+    async def registration_stats(self) -> dict:
+        """Statistics in the format of stats.summarize"""
+
+    @abstractmethod
+    async def mail_queue_counts(self) -> dict:
+        """Pending, sending and failed mails, and the wait of the oldest due one"""
+
+    @abstractmethod
+    async def mail_status(self, registration_uid: str) -> List[dict]:
+        """Status of each mail queued for a registration; empty when there is none"""
+
+    @abstractmethod
+    async def probe_write(self, name: str):
+        """Write a heartbeat row under name; raises when the database is not writable"""
+
+
+class SQLiteStore(RegistrationStore):
+    """Registrations in the shared SQLite database from db.py
+
+    store is the synchronous insert function; it runs on the storage
+    executor and must be importable by name when that is a process pool.
+    With a group-commit writer, inserts go through the writer instead.
+    Statistics include the months archive.py moved to archive_dir.
+    """
+
+    name = 'SQLite (WAL)'
+
+    def __init__(
+        self,
+        db: Database,
+        store: Callable[[dict, Optional[str]], Optional[Tuple[str, bool]]],
+        executor: Optional[BoundedExecutor] = None,
+        group_writer: Optional[GroupCommitWriter] = None,
+        archive_dir: Path = archive.ARCHIVE_DIR,
+    ):
+        self.db = db
+        self.store = store
+        self.executor = executor
+        self.group_writer = group_writer
+        self.archive_dir = archive_dir
+
+    async def _run(self, fn, *args):
+        if self.executor:
+            return await self.executor.run(fn, *args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def open(self):
+        self.db.open()
+        if self.group_writer:
+            await self.group_writer.start()
+
+    async def close(self):
+        if self.group_writer:
+            await self.group_writer.stop()
+        self.db.close()
+
+    async def migrate(self) -> int:
+        return await asyncio.to_thread(run_migrations, self.db)
+
+    async def store_submission(self, form_data: dict, idempotency_key: Optional[str] = None) -> Optional[Tuple[str, bool]]:
+        if not self.group_writer:
+            return await self._run(self.store, form_data, idempotency_key)
+        try:
+            result = await self.group_writer.submit((form_data, idempotency_key))
+            if result[1]:
+                logger.info(f"Stored café registration for {form_data.get('naam', '')}")
+            return result
+        except Exception as e:
+            logger.error(f"Error storing café registration: {e}")
+            return None
+
+    async def claim_mail(self, lease_seconds: float) -> Optional[tuple]:
+        # Mail bookkeeping bypasses the storage executor, so a full queue of inserts cannot stall it
+        return await asyncio.to_thread(claim_mail, self.db, lease_seconds)
+
+    async def update_mail(self, mail_id: int, status: str, attempts: int,
+                          error: Optional[str], next_attempt_at: Optional[float] = None):
+        await asyncio.to_thread(update_mail, self.db, mail_id, status, attempts, error, next_attempt_at)
+
+    def _registration_stats(self) -> dict:
+        groups = self.db.execute(STATS_QUERY)
+        if archive.has_archive(self.archive_dir):
+            try:
+                groups += archive.archived_stat_groups(self.archive_dir)
+            except RuntimeError as e:
+                logger.warning(f"Archived registrations left out of the statistics: {e}")
+        return summarize(groups)
+
+    async def registration_stats(self) -> dict:
+        return await asyncio.to_thread(self._registration_stats)
+
+    async def mail_queue_counts(self) -> dict:
+        return await asyncio.to_thread(mail_queue_counts, self.db)
+
+    async def mail_status(self, registration_uid: str) -> List[dict]:
+        return await asyncio.to_thread(get_mail_status, self.db, registration_uid)
+
+    def _probe_write(self, name: str):
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR REPLACE INTO health_state (name, checked_at) VALUES (?, ?)",
+                (name, datetime.now().isoformat())
+            )
+
+    async def probe_write(self, name: str):
+        await asyncio.to_thread(self._probe_write, name)
+
+
+# PostgreSQL version of migrations 001-006, applied as one schema
+POSTGRES_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS cafe_registrations (
+        id BIGSERIAL PRIMARY KEY,
+        naam TEXT NOT NULL,
+        email TEXT NOT NULL,
+        lid_van_samenwerkt TEXT NOT NULL,
+        komt_naar_cafe TEXT NOT NULL,
+        telefoonnummer TEXT NOT NULL,
+        opmerkingen TEXT,
+        timestamp TEXT NOT NULL,
+        submission_data TEXT NOT NULL,
+        registration_uid TEXT,
+        email_normalized TEXT,
+        event TEXT,
+        idempotency_key TEXT,
+        lid_van_samenwerkt_flag SMALLINT,
+        komt_naar_cafe_flag SMALLINT
+    )
+    ''',
+    '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_cafe_registrations_email_event
+    ON cafe_registrations (email_normalized, event) WHERE event IS NOT NULL
+    ''',
+    '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_cafe_registrations_idempotency_key
+    ON cafe_registrations (idempotency_key) WHERE idempotency_key IS NOT NULL
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_cafe_registrations_timestamp ON cafe_registrations (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_cafe_registrations_email ON cafe_registrations (email)",
+    '''
+    CREATE TABLE IF NOT EXISTS mail_queue (
+        id BIGSERIAL PRIMARY KEY,
+        registration_id BIGINT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DOUBLE PRECISION NOT NULL,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_mail_queue_due ON mail_queue (status, next_attempt_at)",
+    '''
+    CREATE TABLE IF NOT EXISTS export_state (
+        name TEXT PRIMARY KEY,
+        last_id BIGINT NOT NULL,
+        last_timestamp TEXT,
+        exported_at TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS health_state (
+        name TEXT PRIMARY KEY,
+        checked_at TEXT NOT NULL
+    )
+    ''',
+]
+
+POSTGRES_INSERT_REGISTRATION_SQL = '''
+    INSERT INTO cafe_registrations (
+        naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer,
+        opmerkingen, timestamp, submission_data,
+        registration_uid, email_normalized, event, idempotency_key,
+        lid_van_samenwerkt_flag, komt_naar_cafe_flag
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
+    ON CONFLICT DO NOTHING
+    RETURNING id
+'''
+
+POSTGRES_FIND_REGISTRATION_SQL = '''
+    SELECT registration_uid FROM cafe_registrations
+    WHERE idempotency_key = $1 OR (email_normalized = $2 AND event = $3)
+    -- A key match wins over an email match; the comparison is NULL for rows without a key
+    ORDER BY (idempotency_key = $1) IS TRUE DESC
+    LIMIT 1
+'''
+
+
+class PostgresStore(RegistrationStore):
+    """Registrations in a PostgreSQL-compatible database through an asyncpg pool"""
+
+    name = 'PostgreSQL'
+
+    def __init__(self, dsn: str, event: str, mail_kinds: Iterable[str],
+                 min_size: int = PG_POOL_MIN, max_size: int = PG_POOL_MAX):
+        if importlib.util.find_spec('asyncpg') is None:
+            raise RuntimeError("STORAGE_BACKEND=postgres needs asyncpg: pip install asyncpg")
+        if not dsn:
+            raise RuntimeError("STORAGE_BACKEND=postgres needs DATABASE_URL")
+        self.dsn = dsn
+        self.event = event
+        self.mail_kinds = tuple(mail_kinds)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def open(self):
+        if self.pool is None:
+            # Imported here, so SQLite deployments never load it
+            import asyncpg
+            self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+            logger.info(f"Opened PostgreSQL pool ({self.min_size}-{self.max_size} connections)")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            logger.info("Closed PostgreSQL pool")
+
+    async def migrate(self) -> int:
+        """Create the tables and indexes that do not exist yet; counts as one migration"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            # Serializes concurrent startups, like BEGIN IMMEDIATE does for SQLite
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('cafe_registrations_schema'))")
+            exists = await conn.fetchval("SELECT to_regclass('cafe_registrations') IS NOT NULL")
+            for statement in POSTGRES_SCHEMA:
+                await conn.execute(statement)
+        return 0 if exists else 1
+
+    async def _find_registration(self, conn, email_normalized: str, idempotency_key: Optional[str]) -> Optional[str]:
+        return await conn.fetchval(POSTGRES_FIND_REGISTRATION_SQL, idempotency_key, email_normalized, self.event)
+
+    async def store_submission(self, form_data: dict, idempotency_key: Optional[str] = None) -> Optional[Tuple[str, bool]]:
+        email_normalized = normalize_email(form_data.get('email', ''))
+        try:
+            async with self.pool.acquire() as conn, conn.transaction():
+                original = await self._find_registration(conn, email_normalized, idempotency_key)
+                if original:
+                    return original, False
+                registration_id = await conn.fetchval(
+                    POSTGRES_INSERT_REGISTRATION_SQL, *registration_row(form_data, self.event, idempotency_key)
+                )
+                if registration_id is None:
+                    # A concurrent request stored the same email or key first
+                    return await self._find_registration(conn, email_normalized, idempotency_key), False
+
+                now, created_at, payload = time.time(), datetime.now().isoformat(), submission_payload(form_data)
+                await conn.executemany('''
+                    INSERT INTO mail_queue (
+                        registration_id, kind, payload, status, attempts, next_attempt_at, created_at
+                    ) VALUES ($1, $2, $3, $4, 0, $5, $6)
+                ''', [(registration_id, kind, payload, STATUS_PENDING, now, created_at) for kind in self.mail_kinds])
+
+            logger.info(f"Stored café registration for {form_data.get('naam', '')}")
+            return form_data['id'], True
+
+        except Exception as e:
+            logger.error(f"Error storing café registration: {e}")
+            return None
+
+    async def claim_mail(self, lease_seconds: float) -> Optional[tuple]:
+        now = time.time()
+        # SKIP LOCKED lets workers in every process claim different mails without waiting
+        row = await self.pool.fetchrow('''
+            UPDATE mail_queue SET status = $1, next_attempt_at = $2
+            WHERE id = (
+                SELECT id FROM mail_queue
+                WHERE status IN ($3, $1) AND next_attempt_at <= $4
+                ORDER BY next_attempt_at, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, payload, attempts
+        ''', STATUS_SENDING, now + lease_seconds, STATUS_PENDING, now)
+        return tuple(row) if row else None
+
+    async def update_mail(self, mail_id: int, status: str, attempts: int,
+                          error: Optional[str], next_attempt_at: Optional[float] = None):
+        await self.pool.execute('''
+            UPDATE mail_queue SET status = $1, attempts = $2, last_error = $3,
+                next_attempt_at = COALESCE($4, next_attempt_at),
+                sent_at = CASE WHEN $3::text IS NULL THEN $5 ELSE sent_at END
+            WHERE id = $6
+        ''', status, attempts, error, next_attempt_at, datetime.now().isoformat(), mail_id)
+
+    async def registration_stats(self) -> dict:
+        return summarize(tuple(row) for row in await self.pool.fetch(STATS_QUERY))
+
+    async def mail_queue_counts(self) -> dict:
+        rows = await self.pool.fetch('''
+            SELECT status, COUNT(*), MIN(next_attempt_at) FROM mail_queue
+            WHERE status IN ($1, $2, $3) GROUP BY status
+        ''', STATUS_PENDING, STATUS_SENDING, STATUS_FAILED)
+        return summarize_mail_counts(rows)
+
+    async def mail_status(self, registration_uid: str) -> List[dict]:
+        return mail_status_rows(await self.pool.fetch(MAIL_STATUS_QUERY.format('$1'), registration_uid))
+
+    async def probe_write(self, name: str):
+        await self.pool.execute('''
+            INSERT INTO health_state (name, checked_at) VALUES ($1, $2)
+            ON CONFLICT (name) DO UPDATE SET checked_at = excluded.checked_at
+        ''', name, datetime.now().isoformat())
+
+    async def fetch_registrations(self, columns: List[str], since_id: int, until_id: int) -> List[tuple]:
+        """Rows with since_id < id <= until_id, newest first, for the export"""
+        rows = await self.pool.fetch(f'''
+            SELECT {', '.join(columns)} FROM cafe_registrations
+            WHERE id > $1 AND id <= $2
+            ORDER BY timestamp DESC
+        ''', since_id, until_id)
+        return [tuple(row) for row in rows]
+
+    @asynccontextmanager
+    async def registration_cursor(self, columns: List[str], since_id: int, until_id: int) -> AsyncIterator:
+        """A server-side cursor over the rows of fetch_registrations, for exports too large to hold at once"""
+        async with self.pool.acquire() as conn:
+            # asyncpg cursors only live inside a transaction
+            async with conn.transaction():
+                yield await conn.cursor(f'''
+                    SELECT {', '.join(columns)} FROM cafe_registrations
+                    WHERE id > $1 AND id <= $2
+                    ORDER BY timestamp DESC
+                ''', since_id, until_id)
+
+    async def max_lengths(self, columns: List[str], since_id: int, until_id: int) -> List[Optional[int]]:
+        """Longest text value of each column over the rows with since_id < id <= until_id"""
+        row = await self.pool.fetchrow(f'''
+            SELECT {', '.join(f"MAX(LENGTH({column}::text))" for column in columns)}
+            FROM cafe_registrations
+            WHERE id > $1 AND id <= $2
+        ''', since_id, until_id)
+        return list(row)
+
+    async def max_registration_id(self) -> int:
+        return await self.pool.fetchval("SELECT COALESCE(MAX(id), 0) FROM cafe_registrations")
+
+    async def get_watermark(self, name: str) -> int:
+        return await self.pool.fetchval("SELECT last_id FROM export_state WHERE name = $1", name) or 0
+
+    async def save_watermark(self, name: str, last_id: int):
+        await self.pool.execute('''
+            INSERT INTO export_state (name, last_id, last_timestamp, exported_at)
+            VALUES ($1, $2, (SELECT timestamp FROM cafe_registrations WHERE id = $2), $3)
+            ON CONFLICT (name) DO UPDATE SET
+                last_id = excluded.last_id,
+                last_timestamp = excluded.last_timestamp,
+                exported_at = excluded.exported_at
+        ''', name, last_id, datetime.now().isoformat())
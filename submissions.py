@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Normalized storage of raw café form submissions
+
+Every form field that has its own cafe_registrations column is stored
+only in that column. submission_data keeps the remaining fields as
+compact JSON, which for the current form is just '{}'. Rows written
+before this change still hold the full JSON; submission_data() reads
+both kinds.
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Mapping, Optional
+
+from serialization import dumps_text, loads
+
+# Form field -> cafe_registrations column
+FORM_COLUMNS = {
+    'id': 'registration_uid',
+    'naam': 'naam',
+    'email': 'email',
+    'lidVanSamenwerkt': 'lid_van_samenwerkt',
+    'komtNaarCafe': 'komt_naar_cafe',
+    'telefoonnummer': 'telefoonnummer',
+    'opmerkingen': 'opmerkingen',
+    'timestamp': 'timestamp',
+}
+
+
+def normalize_submission(form_data: dict) -> str:
+    """JSON of the form fields that are not stored in their own column"""
+    extra = {key: value for key, value in form_data.items() if key not in FORM_COLUMNS}
+    return dumps_text(extra)
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def registration_row(form_data: dict, event: str, idempotency_key: Optional[str] = None) -> tuple:
+    """Extract the cafe_registrations column values from a form submission"""
+    return (
+        form_data.get('naam', ''),
+        form_data.get('email', ''),
+        form_data.get('lidVanSamenwerkt', ''),
+        form_data.get('komtNaarCafe', ''),
+        form_data.get('telefoonnummer', ''),
+        form_data.get('opmerkingen', ''),
+        form_data.get('timestamp') or datetime.now().isoformat(),
+        normalize_submission(form_data),
+        form_data['id'],
+        normalize_email(form_data.get('email', '')),
+        event,
+        idempotency_key,
+        int(form_data.get('lidVanSamenwerkt') == 'ja'),
+        int(form_data.get('komtNaarCafe') == 'ja'),
+    )
+
+
+def submission_data(row: Mapping) -> dict:
+    """Rebuild the original form submission from a cafe_registrations row"""
+    form_data = {key: row[column] for key, column in FORM_COLUMNS.items()}
+    form_data.update(loads(row['submission_data'] or '{}'))
+    return form_data
+
+
+def load_submission(conn: sqlite3.Connection, registration_id: int) -> Optional[dict]:
+    """Decode the stored submission of one registration, or None if it does not exist"""
+    columns = ', '.join(sorted(set(FORM_COLUMNS.values()) | {'submission_data'}))
+    cursor = conn.execute(
+        f"SELECT {columns} FROM cafe_registrations WHERE id = ?", (registration_id,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return submission_data(dict(zip((d[0] for d in cursor.description), row)))
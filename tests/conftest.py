@@ -0,0 +1,76 @@
+"""Shared fixtures; the modules under test live in the repository root"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database
+from migrations import run_migrations
+from smtp_sink import SMTPSink
+
+
+@pytest.fixture
+def sink():
+    """A local SMTP server that keeps the messages it accepts"""
+    server = SMTPSink().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A migrated SQLite database in a temporary directory"""
+    database = Database(tmp_path / 'test.db').open()
+    run_migrations(database)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def backend_db(db, monkeypatch):
+    """The backend module, storing in the temporary database"""
+    import backend
+    monkeypatch.setattr(backend, 'db', db)
+    return backend
+
+
+@pytest.fixture
+def mail_to_sink(sink, monkeypatch):
+    """Point the shared SMTP pool at the sink"""
+    from smtp_pool import smtp_pool
+    smtp_pool.close()
+    monkeypatch.setattr(smtp_pool, 'port', sink.port)
+    yield smtp_pool
+    smtp_pool.close()
+
+
+@pytest.fixture
+def postgres_url():
+    """A connection string for a fresh schema in TEST_DATABASE_URL, dropped afterwards"""
+    import asyncio
+    import importlib.util
+    import os
+    from ids import new_ulid
+
+    url = os.environ.get("TEST_DATABASE_URL", "")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    if importlib.util.find_spec('asyncpg') is None:
+        pytest.skip("asyncpg is not installed")
+    import asyncpg
+    schema = f"test_{new_ulid().lower()}"
+
+    async def admin(statement: str):
+        conn = await asyncpg.connect(url)
+        try:
+            await conn.execute(statement)
+        finally:
+            await conn.close()
+
+    asyncio.run(admin(f"CREATE SCHEMA {schema}"))
+    separator = '&' if '?' in url else '?'
+    yield f"{url}{separator}search_path={schema}"
+    asyncio.run(admin(f"DROP SCHEMA {schema} CASCADE"))
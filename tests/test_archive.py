@@ -0,0 +1,54 @@
+"""Archiving old months to Parquet, with the rows that depend on them"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import archive
+from storage import SQLiteStore
+
+
+def add_registration(db, timestamp: str) -> int:
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO cafe_registrations (
+                naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer, timestamp, submission_data,
+                lid_van_samenwerkt_flag, komt_naar_cafe_flag
+            ) VALUES ('Jan', 'jan@x.nl', 'ja', 'ja', '0612345678', ?, '{}', 1, 1)
+        ''', (timestamp,))
+        registration_id = cursor.lastrowid
+        cursor.execute('''
+            INSERT INTO mail_queue (registration_id, kind, payload, status, next_attempt_at, created_at)
+            VALUES (?, 'cafe_confirmation', '{}', 'sent', 0, ?)
+        ''', (registration_id, timestamp))
+        cursor.execute('''
+            INSERT INTO bulk_deliveries (campaign_id, registration_id, status, updated_at)
+            VALUES (1, ?, 'sent', ?)
+        ''', (registration_id, timestamp))
+        return registration_id
+
+
+def test_archive_drops_mails_and_deliveries_of_archived_registrations(db, tmp_path):
+    old = add_registration(db, '2020-01-15T20:00:00')
+    recent = add_registration(db, '9999-01-15T20:00:00')
+
+    assert archive.archive_registrations(db, directory=tmp_path / 'archive') == 1
+
+    assert db.execute("SELECT id FROM cafe_registrations") == [(recent,)]
+    assert db.execute("SELECT registration_id FROM mail_queue") == [(recent,)]
+    assert db.execute("SELECT registration_id FROM bulk_deliveries") == [(recent,)]
+    assert archive.read_archive(['id'], directory=tmp_path / 'archive')['id'].tolist() == [old]
+
+
+def test_stats_include_archived_months(db, tmp_path):
+    add_registration(db, '2020-01-15T20:00:00')
+    add_registration(db, '9999-01-15T20:00:00')
+    archive.archive_registrations(db, directory=tmp_path / 'archive')
+    store = SQLiteStore(db, None, archive_dir=tmp_path / 'archive')
+
+    stats = asyncio.run(store.registration_stats())
+
+    assert stats['total'] == 2
+    assert [day['date'] for day in stats['per_day']] == ['2020-01-15', '9999-01-15']
@@ -0,0 +1,137 @@
+"""Bulk campaigns against the SMTP sink"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import bulk_mail
+from smtp_pool import SMTPPool
+from storage import SQLiteStore
+
+CONTEXT = {'datum': '12 maart', 'tijd': '20:00', 'locatie': 'Het Wapen', 'bericht': 'Tot dan!'}
+
+
+def add_registration(db, email: str, event=bulk_mail.CAFE_EVENT, normalized: bool = True, attending: bool = True) -> int:
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO cafe_registrations (
+                naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer, timestamp, submission_data,
+                email_normalized, event, lid_van_samenwerkt_flag, komt_naar_cafe_flag
+            ) VALUES ('Jan', ?, 'ja', ?, '0612345678', '2025-01-01T20:00:00', '{}', ?, ?, 1, ?)
+        ''', (email, 'ja' if attending else 'nee', email.strip().lower() if normalized else None, event,
+              int(attending)))
+        return cursor.lastrowid
+
+
+@pytest.fixture
+def smtp(sink):
+    pool = SMTPPool(port=sink.port, timeout=5)
+    yield pool
+    pool.close()
+
+
+def sender_for(db, smtp, name: str = 'maart', **options) -> bulk_mail.BulkSender:
+    campaign = bulk_mail.get_campaign(db, name) or bulk_mail.create_campaign(db, name, 'Politiek café', CONTEXT)
+    return bulk_mail.BulkSender(db, campaign, smtp=smtp, max_per_minute=0, **options)
+
+
+def send(db, smtp, name: str = 'maart', retry_failed: bool = False, **options) -> dict:
+    return asyncio.run(sender_for(db, smtp, name, **options).run(retry_failed=retry_failed))
+
+
+class PausingPool:
+    """Passes mail on to the sink and requests a pause after the first batch, like another worker would"""
+
+    def __init__(self, db, smtp):
+        self.db = db
+        self.smtp = smtp
+
+    def send_many(self, messages):
+        bulk_mail.request_pause(self.db, 'maart')
+        return self.smtp.send_many(messages)
+
+
+def recipients(sink) -> list:
+    return sorted(message['to'][0] for message in sink.messages)
+
+
+def test_one_mail_per_address_whatever_its_case(db, smtp, sink):
+    add_registration(db, 'Foo@x.nl', event=None, normalized=False)
+    add_registration(db, 'foo@x.nl')
+    add_registration(db, 'FOO@X.NL ', event=None)
+    add_registration(db, 'bar@x.nl')
+
+    send(db, smtp)
+
+    assert recipients(sink) == ['<Foo@x.nl>', '<bar@x.nl>']
+    assert bulk_mail.campaign_status(db, 'maart')['remaining'] == 0
+
+
+def test_a_running_campaign_cannot_be_claimed_twice(db, smtp):
+    first = sender_for(db, smtp)
+    first.claim()
+
+    with pytest.raises(bulk_mail.BulkMailError):
+        sender_for(db, smtp).claim()
+
+    # Once the lease of the first sender expires, another process takes over
+    db.execute("UPDATE bulk_campaigns SET lease_until = 0")
+    sender_for(db, smtp).claim()
+
+
+def test_paused_campaign_resumes_after_its_checkpoint(db, smtp, sink):
+    for i in range(5):
+        add_registration(db, f'lid{i}@x.nl')
+
+    result = send(db, PausingPool(db, smtp), batch_size=2, concurrency=1)
+
+    assert result == {'sent': 2, 'failed': 0, 'stopped': True}
+    status = bulk_mail.campaign_status(db, 'maart')
+    assert (status['status'], status['sent'], status['remaining']) == (bulk_mail.CAMPAIGN_PAUSED, 2, 3)
+
+    send(db, smtp, batch_size=2, concurrency=1)
+
+    assert recipients(sink) == [f'<lid{i}@x.nl>' for i in range(5)]
+    assert bulk_mail.campaign_status(db, 'maart')['status'] == bulk_mail.CAMPAIGN_DONE
+
+
+def test_failed_batch_pauses_the_campaign(db, smtp, sink):
+    for i in range(5):
+        add_registration(db, f'lid{i}@x.nl')
+    # Nothing listens on port 1, so every mail of the batch fails to connect
+    dead = SMTPPool(port=1, timeout=5)
+
+    with pytest.raises(bulk_mail.BulkMailError):
+        send(db, dead, batch_size=2, concurrency=1)
+
+    status = bulk_mail.campaign_status(db, 'maart')
+    assert (status['status'], status['failed'], status['remaining']) == (bulk_mail.CAMPAIGN_PAUSED, 2, 3)
+    assert sink.messages == []
+
+    send(db, smtp, retry_failed=True, batch_size=2, concurrency=1)
+
+    assert recipients(sink) == [f'<lid{i}@x.nl>' for i in range(5)]
+    status = bulk_mail.campaign_status(db, 'maart')
+    assert (status['status'], status['sent'], status['failed']) == (bulk_mail.CAMPAIGN_DONE, 5, 0)
+
+
+def test_admin_endpoints_see_a_campaign_running_in_another_worker(backend_db, db, smtp, monkeypatch):
+    backend = backend_db
+    monkeypatch.setattr(backend, 'store', SQLiteStore(db, backend.store_cafe_submission))
+    monkeypatch.setattr(backend, 'ADMIN_TOKEN', 'geheim')
+    add_registration(db, 'lid@x.nl')
+    other_worker = sender_for(db, smtp)
+    other_worker.claim()
+    client = TestClient(backend.app)
+    headers = {'X-Admin-Token': 'geheim'}
+
+    assert client.post('/api/admin/bulk', json={'name': 'maart'}, headers=headers).status_code == 409
+    response = client.post('/api/admin/bulk/maart/pause', headers=headers)
+    assert response.status_code == 200
+    assert response.json()['status'] == bulk_mail.CAMPAIGN_PAUSING
+
+    assert asyncio.run(other_worker.send())['stopped']
+    assert bulk_mail.campaign_status(db, 'maart')['status'] == bulk_mail.CAMPAIGN_PAUSED
+    assert client.post('/api/admin/bulk/maart/pause', headers=headers).status_code == 409
+    assert client.post('/api/admin/bulk/nergens/pause', headers=headers).status_code == 404
@@ -0,0 +1,72 @@
+"""CafeForm validation: email acceptance matches EmailStr, errors keep the Dutch messages"""
+
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import EmailStr, TypeAdapter, ValidationError
+
+import backend
+
+FORM = {
+    'naam': 'Jan Jansen',
+    'email': 'jan@example.com',
+    'lidVanSamenwerkt': 'ja',
+    'komtNaarCafe': 'nee',
+    'telefoonnummer': '06 12345678',
+}
+
+ADDRESSES = [
+    # Matched by FAST_EMAIL_PATTERN
+    'jan@example.com', 'jan.de.vries@samenwerktwbd.nl', 'j_an+cafe@mail.example.org',
+    'a@b.nl', 'JAN@gemeente.nl', 'x%y@a-b-c.eu', '1@2.be',
+    f"{'a' * 20}.{'b' * 20}.{'c' * 20}@{'d' * 20}-{'e' * 20}-{'f' * 20}.info",
+    # Valid, but left to email-validator
+    'Jan@Example.COM', 'jan@example.co.uk', 'jan@example.amsterdam', "o'brien@example.com",
+    'jan.de.vries.jr@example.com', f"{'a' * 64}@example.com", 'jan@bücher.de', 'jörg@example.de',
+    'jan@xn--bcher-kva.de', 'a@x.example', 'jan@123.nl', '{jan}@example.com',
+    # Invalid
+    f"{'a' * 65}@example.com", 'jan', 'jan@', '@example.com', 'jan@@example.com', 'jan..x@example.com',
+    '.jan@example.com', 'jan.@example.com', 'jan@-example.com', 'jan@example-.com', 'jan@ab--cd.nl',
+    'jan@example', 'jan@localhost', 'jan@example.test', 'jan@example.local', 'jan@x.123',
+    '"jan jansen"@example.com', 'jan jansen@example.com', ' jan@example.com', 'jan@example.com ',
+    f"jan@{'d' * 64}.com", 'jan@exa_mple.com', '',
+]
+
+
+def email_str(address: str):
+    try:
+        return TypeAdapter(EmailStr).validate_python(address)
+    except ValidationError:
+        return None
+
+
+def cafe_form_email(address: str):
+    try:
+        return backend.CafeForm(**dict(FORM, email=address)).email
+    except ValidationError:
+        return None
+
+
+@pytest.mark.parametrize('address', ADDRESSES)
+def test_email_accepted_and_normalized_like_email_str(address):
+    assert cafe_form_email(address) == email_str(address)
+
+
+@pytest.mark.parametrize('address', [a for a in ADDRESSES if re.match(backend.FAST_EMAIL_PATTERN, a)])
+def test_fast_pattern_only_matches_addresses_email_str_keeps(address):
+    assert email_str(address) == address
+
+
+def test_invalid_fields_get_the_dutch_messages():
+    client = TestClient(backend.app)
+    form = dict(FORM, email='jan@example', telefoonnummer='abc')
+
+    response = client.post('/api/cafe', json=form)
+
+    assert response.status_code == 422
+    messages = {error['loc'][1]: error['msg'] for error in response.json()['detail']}
+    assert messages == {
+        'email': backend.CAFE_FORM_MESSAGES['email'],
+        'telefoonnummer': backend.CAFE_FORM_MESSAGES['telefoonnummer'],
+    }
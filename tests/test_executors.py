@@ -0,0 +1,55 @@
+"""BoundedExecutor backpressure, and the 503 the café endpoint turns it into"""
+
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from executors import BoundedExecutor, ExecutorSaturated
+
+FORM = {
+    'naam': 'Jan Jansen', 'email': 'jan@example.com', 'lidVanSamenwerkt': 'ja',
+    'komtNaarCafe': 'nee', 'telefoonnummer': '06 12345678',
+}
+
+
+def test_full_executor_rejects_instead_of_queueing():
+    executor = BoundedExecutor('test', max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        busy = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(ExecutorSaturated) as saturated:
+            await executor.run(release.wait)
+        release.set()
+        await asyncio.gather(*busy)
+        # A free slot accepts work again
+        assert await executor.run(lambda: 'ok') == 'ok'
+        return saturated.value
+
+    try:
+        saturated = asyncio.run(main())
+    finally:
+        release.set()
+        executor.shutdown()
+
+    assert saturated.name == 'test' and saturated.retry_after >= 1
+    stats = executor.stats()
+    assert (stats['rejected'], stats['completed']) == (1, 3)
+
+
+def test_saturated_storage_answers_503_with_retry_after(monkeypatch):
+    import backend
+
+    class SaturatedStore:
+        async def store_submission(self, form_data, idempotency_key=None):
+            raise ExecutorSaturated('storage', 7)
+
+    monkeypatch.setattr(backend, 'store', SaturatedStore())
+
+    response = TestClient(backend.app).post('/api/cafe', json=FORM)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
@@ -0,0 +1,135 @@
+"""Incremental export: the watermark advances only after the mail went out"""
+
+import csv
+import io
+import sys
+from email import message_from_string
+
+import pytest
+
+import export_members
+
+
+def add_registration(db, naam: str) -> int:
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO cafe_registrations (
+                naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer, timestamp, submission_data,
+                lid_van_samenwerkt_flag, komt_naar_cafe_flag
+            ) VALUES (?, 'jan@x.nl', 'ja', 'nee', '0612345678', '2025-01-15T20:00:00', '{}', 1, 0)
+        ''', (naam,))
+        return cursor.lastrowid
+
+
+@pytest.fixture
+def export(db, tmp_path, mail_to_sink, monkeypatch, capsys):
+    """Run the export command as a script would, in CSV format so the attachment is easy to read"""
+    monkeypatch.setattr(export_members, 'DB_PATH', db.path)
+    monkeypatch.setattr(export_members, 'export_filepath', lambda suffix='.xlsx': tmp_path / f"export{suffix}")
+
+    def run(*args):
+        monkeypatch.setattr(sys, 'argv', ['export_members.py', '--format', 'csv', *args])
+        export_members.main()
+        return capsys.readouterr().out
+    return run
+
+
+def exported_names(message: dict) -> list:
+    attachment = [part for part in message_from_string(message['data']).walk()
+                  if part.get_content_type() == 'text/csv'][0]
+    text = attachment.get_payload(decode=True).decode('utf-8-sig')
+    return [row[1] for row in list(csv.reader(io.StringIO(text), delimiter=export_members.CSV_DELIMITER))[1:]]
+
+
+def watermark(db) -> int:
+    return export_members.get_watermark(db.connection)
+
+
+def test_each_export_sends_only_the_new_registrations(db, sink, export):
+    add_registration(db, 'Jan')
+    add_registration(db, 'Piet')
+
+    export()
+    third = add_registration(db, 'Kees')
+    export()
+
+    assert [exported_names(message) for message in sink.messages] == [['Jan', 'Piet'], ['Kees']]
+    assert watermark(db) == third
+
+
+def test_nothing_new_sends_no_mail(db, sink, export):
+    last = add_registration(db, 'Jan')
+    export()
+
+    output = export()
+
+    assert 'nothing to send' in output
+    assert sink.message_count == 1
+    assert watermark(db) == last
+
+
+def test_failed_mail_keeps_the_watermark(db, sink, export, mail_to_sink, monkeypatch):
+    add_registration(db, 'Jan')
+    # Nothing listens on port 1
+    monkeypatch.setattr(mail_to_sink, 'port', 1)
+
+    output = export()
+
+    assert 'email failed' in output
+    assert watermark(db) == 0
+
+
+def test_full_export_sends_everything_and_moves_the_watermark(db, sink, export):
+    add_registration(db, 'Jan')
+    export()
+    last = add_registration(db, 'Piet')
+
+    export('--full')
+
+    assert sorted(exported_names(sink.messages[-1])) == ['Jan', 'Piet']
+    assert watermark(db) == last
+
+
+@pytest.mark.parametrize('export_format', ['csv', 'xlsx'])
+def test_postgres_export_streams_every_new_row(postgres_url, tmp_path, mail_to_sink, sink, monkeypatch,
+                                               export_format):
+    import asyncio
+    from storage import PostgresStore
+
+    def with_store(test):
+        async def main():
+            store = PostgresStore(postgres_url, event='politiek-cafe', mail_kinds=(), min_size=1, max_size=1)
+            await store.open()
+            try:
+                await store.migrate()
+                return await test(store)
+            finally:
+                await store.close()
+        return asyncio.run(main())
+
+    async def register(store):
+        for naam in ('Jan', 'Piet', 'Kees'):
+            await store.store_submission({
+                'naam': naam, 'email': f"{naam.lower()}@x.nl", 'lidVanSamenwerkt': 'ja',
+                'komtNaarCafe': 'nee', 'telefoonnummer': '0612345678', 'opmerkingen': None,
+                'timestamp': '2025-01-15T20:00:00', 'id': naam,
+            })
+        return await store.max_registration_id()
+
+    async def postgres_watermark(store):
+        return await store.get_watermark(export_members.EXPORT_STATE_NAME)
+
+    monkeypatch.setattr(export_members, 'DATABASE_URL', postgres_url)
+    monkeypatch.setattr(export_members, 'cleanup_file', lambda filepath: None)
+    monkeypatch.setattr(export_members, 'export_filepath', lambda suffix='.xlsx': tmp_path / f"export{suffix}")
+    last_id = with_store(register)
+
+    asyncio.run(export_members.export_postgres(full=False, export_format=export_format))
+
+    if export_format == 'csv':
+        assert sorted(exported_names(sink.messages[0])) == ['Jan', 'Kees', 'Piet']
+    else:
+        from openpyxl import load_workbook
+        sheet = load_workbook(tmp_path / 'export.xlsx').active
+        assert sorted(row[1] for row in sheet.iter_rows(min_row=2, values_only=True)) == ['Jan', 'Kees', 'Piet']
+    assert with_store(postgres_watermark) == last_id
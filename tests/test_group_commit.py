@@ -0,0 +1,104 @@
+"""GroupCommitWriter batching against a real SQLite database"""
+
+import asyncio
+import time
+
+import pytest
+
+from db import GroupCommitWriter
+
+
+class Recorder:
+    """A flush function that stores each item as a health_state row and records the batch sizes"""
+
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, cursor, items):
+        self.batches.append(len(items))
+        if self.fail:
+            raise ValueError("disk full")
+        cursor.executemany(
+            "INSERT INTO health_state (name, checked_at) VALUES (?, '2025-01-01')", [(item,) for item in items]
+        )
+        return [f"stored {item}" for item in items]
+
+
+def run(db, recorder, submit, **options):
+    async def main():
+        writer = GroupCommitWriter(db, recorder, **options)
+        await writer.start()
+        try:
+            return await submit(writer)
+        finally:
+            await writer.stop()
+    return asyncio.run(main())
+
+
+def stored(db) -> list:
+    return [name for name, in db.execute("SELECT name FROM health_state ORDER BY name")]
+
+
+def test_full_batch_is_flushed_without_waiting_for_the_delay(db):
+    recorder = Recorder()
+
+    async def submit(writer):
+        started = time.monotonic()
+        results = await asyncio.gather(*(writer.submit(f"r{n}") for n in range(3)))
+        return results, time.monotonic() - started
+
+    results, elapsed = run(db, recorder, submit, max_batch=3, max_delay=10)
+
+    assert results == ['stored r0', 'stored r1', 'stored r2']
+    assert recorder.batches == [3]
+    assert elapsed < 5
+    assert stored(db) == ['r0', 'r1', 'r2']
+
+
+def test_partial_batch_is_flushed_when_the_delay_expires(db):
+    recorder = Recorder()
+
+    async def submit(writer):
+        started = time.monotonic()
+        result = await writer.submit('r0')
+        # Durable by the time the caller hears back
+        return result, time.monotonic() - started, stored(db)
+
+    result, elapsed, rows = run(db, recorder, submit, max_batch=100, max_delay=0.05)
+
+    assert result == 'stored r0'
+    assert elapsed >= 0.04
+    assert rows == ['r0']
+    assert recorder.batches == [1]
+
+
+def test_more_items_than_a_batch_are_split(db):
+    recorder = Recorder()
+
+    async def submit(writer):
+        return await asyncio.gather(*(writer.submit(f"r{n}") for n in range(5)))
+
+    run(db, recorder, submit, max_batch=2, max_delay=0.05)
+
+    assert recorder.batches == [2, 2, 1]
+    assert stored(db) == ['r0', 'r1', 'r2', 'r3', 'r4']
+
+
+def test_failed_flush_reaches_every_caller_in_the_batch(db):
+    recorder = Recorder(fail=True)
+
+    async def submit(writer):
+        return await asyncio.gather(*(writer.submit(f"r{n}") for n in range(2)), return_exceptions=True)
+
+    results = run(db, recorder, submit, max_batch=2, max_delay=10)
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert stored(db) == []
+
+
+def test_submit_before_start_is_refused(db):
+    writer = GroupCommitWriter(db, Recorder())
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(writer.submit('r0'))
@@ -0,0 +1,89 @@
+"""Liveness and readiness when the database, SMTP server or disk fails"""
+
+import asyncio
+import socket
+
+import pytest
+
+import backend
+from health import STATUS_DEGRADED, STATUS_ERROR, STATUS_OK, HealthMonitor
+from smtp_pool import SMTPPool
+from storage import SQLiteStore
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def probe(db, sink, tmp_path, monkeypatch):
+    """Start a HealthMonitor as the backend's, and return the live and ready status codes and the snapshot"""
+
+    def run(smtp_port: int = sink.port, min_free_mb: int = 0, before=None):
+        async def main():
+            monitor = HealthMonitor(SQLiteStore(db, None), SMTPPool(port=smtp_port, timeout=2), tmp_path,
+                                    interval=60, timeout=2, min_free_mb=min_free_mb)
+            monkeypatch.setattr(backend, 'health_monitor', monitor)
+            await monitor.start()
+            try:
+                if before:
+                    before(monitor)
+                live, ready = await backend.health_live(), await backend.health_ready()
+                return live.status_code, ready.status_code, monitor.snapshot
+            finally:
+                await monitor.stop()
+        return asyncio.run(main())
+    return run
+
+
+def test_healthy_process_is_live_and_ready(probe):
+    live, ready, snapshot = probe()
+
+    assert (live, ready) == (200, 200)
+    assert snapshot['status'] == STATUS_OK
+
+
+def test_smtp_down_degrades_but_stays_ready(probe):
+    live, ready, snapshot = probe(smtp_port=unused_port())
+
+    assert (live, ready) == (200, 200)
+    assert snapshot['status'] == STATUS_DEGRADED
+    assert not snapshot['checks']['smtp']['ok']
+    assert snapshot['email'].endswith('(niet bereikbaar)')
+
+
+def test_unwritable_database_is_live_but_not_ready(probe, db):
+    db.execute("PRAGMA query_only = 1")
+
+    live, ready, snapshot = probe()
+
+    assert (live, ready) == (200, 503)
+    assert snapshot['status'] == STATUS_ERROR
+    assert 'readonly' in snapshot['checks']['database']['error']
+    assert snapshot['database'].endswith('(niet bereikbaar)')
+
+
+def test_full_disk_is_not_ready(probe):
+    live, ready, snapshot = probe(min_free_mb=10 ** 12)
+
+    assert (live, ready) == (200, 503)
+    assert not snapshot['checks']['disk']['ok']
+
+
+def test_stalled_health_rounds_are_not_live(probe):
+    def stall(monitor):
+        # The last round finished long before three intervals ago
+        monitor.checked_at -= 1000
+
+    live, ready, _ = probe(before=stall)
+
+    assert (live, ready) == (503, 200)
+
+
+def test_no_monitor_is_neither_live_nor_ready(monkeypatch):
+    monkeypatch.setattr(backend, 'health_monitor', None)
+
+    assert asyncio.run(backend.health_live()).status_code == 503
+    assert asyncio.run(backend.health_ready()).status_code == 503
@@ -0,0 +1,80 @@
+"""MailQueue delivery, retries and error reporting against the SMTP sink"""
+
+import asyncio
+import socket
+
+from mail_queue import STATUS_FAILED, STATUS_PENDING, STATUS_SENT, MailQueue, get_mail_status
+from storage import SQLiteStore
+
+FORM = {
+    'naam': 'Jan Jansen',
+    'email': 'jan@example.com',
+    'lidVanSamenwerkt': 'ja',
+    'komtNaarCafe': 'ja',
+    'telefoonnummer': '0612345678',
+}
+
+
+def register(backend, **fields) -> str:
+    form_data = dict(FORM, **fields, timestamp='2025-01-01T20:00:00', id=backend.new_ulid())
+    registration_uid, created = backend.store_cafe_submission(form_data)
+    assert created
+    return registration_uid
+
+
+def mail_queue(backend) -> MailQueue:
+    return MailQueue(
+        SQLiteStore(backend.db, backend.store_cafe_submission),
+        senders={
+            'cafe_notification': backend.send_cafe_notification_email,
+            'cafe_confirmation': backend.send_cafe_confirmation_email,
+        },
+    )
+
+
+def drain(queue: MailQueue):
+    async def run():
+        while await queue._process_next():
+            pass
+    asyncio.run(run())
+
+
+def mails(backend, registration_uid: str) -> dict:
+    return {mail['kind']: mail for mail in get_mail_status(backend.db, registration_uid)}
+
+
+def test_queued_mails_are_sent(backend_db, mail_to_sink, sink):
+    registration_uid = register(backend_db)
+
+    drain(mail_queue(backend_db))
+
+    status = mails(backend_db, registration_uid)
+    assert {mail['status'] for mail in status.values()} == {STATUS_SENT}
+    assert sorted(message['to'][0] for message in sink.messages) == ['<info@samenwerktwbd.nl>', '<jan@example.com>']
+
+
+def test_rejected_recipient_fails_at_once_with_the_server_reply(backend_db, mail_to_sink, sink):
+    sink.rejected_recipients.add('jan@example.com')
+    registration_uid = register(backend_db)
+
+    drain(mail_queue(backend_db))
+
+    confirmation = mails(backend_db, registration_uid)['cafe_confirmation']
+    assert confirmation['status'] == STATUS_FAILED
+    assert confirmation['attempts'] == 1
+    assert 'Mailbox unavailable' in confirmation['last_error']
+    assert mails(backend_db, registration_uid)['cafe_notification']['status'] == STATUS_SENT
+
+
+def test_connection_failure_is_retried_later(backend_db, mail_to_sink, monkeypatch):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        monkeypatch.setattr(mail_to_sink, 'port', s.getsockname()[1])
+    registration_uid = register(backend_db)
+
+    drain(mail_queue(backend_db))
+
+    for mail in mails(backend_db, registration_uid).values():
+        assert mail['status'] == STATUS_PENDING
+        assert mail['attempts'] == 1
+        assert 'refused' in mail['last_error'].lower()
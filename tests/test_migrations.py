@@ -0,0 +1,72 @@
+"""Schema migrations on a database with registrations from before duplicate detection"""
+
+import pytest
+
+import migrations
+from db import Database
+from mail_queue import get_mail_status
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """A database at schema version 1 with registrations, some for the same address"""
+    monkeypatch.setattr(migrations, 'BACKFILL_BATCH', 2)
+    database = Database(tmp_path / 'legacy.db').open()
+    migrations.migration_001_initial_schema(database)
+    with database.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO cafe_registrations (
+                naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer, timestamp, submission_data
+            ) VALUES (?, ?, 'ja', 'ja', '0612345678', '2024-01-01T20:00:00', '{}')
+        ''', [('Jan', 'Jan@Example.com'), ('Piet', 'piet@example.com'), ('Jan', ' jan@example.com'),
+              ('Kees', 'kees@example.com'), ('Jan', 'JAN@example.com')])
+        cursor.execute('''
+            INSERT INTO mail_queue (registration_id, kind, payload, status, next_attempt_at, created_at)
+            VALUES (1, 'cafe_confirmation', '{}', 'sent', 0, '2024-01-01T20:00:00')
+        ''')
+    yield database
+    database.close()
+
+
+def rows(db: Database) -> list:
+    return db.execute("SELECT id, email_normalized, event, registration_uid FROM cafe_registrations ORDER BY id")
+
+
+def test_backfill_gives_old_rows_ids_email_and_event(legacy_db):
+    migrations.run_migrations(legacy_db)
+
+    backfilled = rows(legacy_db)
+    assert [email for _, email, _, _ in backfilled] == [
+        'jan@example.com', 'piet@example.com', 'jan@example.com', 'kees@example.com', 'jan@example.com'
+    ]
+    # Only the oldest registration per address gets the event
+    assert [event for _, _, event, _ in backfilled] == [
+        migrations.CAFE_EVENT, migrations.CAFE_EVENT, None, migrations.CAFE_EVENT, None
+    ]
+    uids = [uid for _, _, _, uid in backfilled]
+    assert all(uids) and len(set(uids)) == len(uids)
+    assert get_mail_status(legacy_db, uids[0])[0]['kind'] == 'cafe_confirmation'
+
+
+def test_backfill_is_idempotent(legacy_db):
+    migrations.run_migrations(legacy_db)
+    before = rows(legacy_db)
+
+    migrations.migration_008_backfill_duplicate_detection(legacy_db)
+
+    assert rows(legacy_db) == before
+
+
+def test_old_registration_is_detected_as_duplicate(legacy_db, monkeypatch):
+    import backend
+    migrations.run_migrations(legacy_db)
+    monkeypatch.setattr(backend, 'db', legacy_db)
+    form_data = {
+        'naam': 'Jan', 'email': 'JAN@example.com ', 'lidVanSamenwerkt': 'ja', 'komtNaarCafe': 'ja',
+        'telefoonnummer': '0612345678', 'timestamp': '2025-01-01T20:00:00', 'id': backend.new_ulid(),
+    }
+
+    registration_uid, created = backend.store_cafe_submission(form_data)
+
+    assert not created
+    assert registration_uid == rows(legacy_db)[0][3]
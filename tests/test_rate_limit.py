@@ -0,0 +1,112 @@
+"""Token buckets: 429s from the per-client and global limits, and the mail rate cap"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import rate_limit
+from mail_queue import MailQueue
+from metrics import RATE_LIMITED
+from rate_limit import RateLimiter, TokenBucket
+from storage import SQLiteStore
+
+FORM = {
+    'naam': 'Jan Jansen', 'lidVanSamenwerkt': 'ja', 'komtNaarCafe': 'nee', 'telefoonnummer': '06 12345678',
+}
+
+
+def test_bucket_admits_a_burst_then_refills_at_its_rate():
+    bucket = TokenBucket(rate=1, burst=2, now=0)
+
+    assert [bucket.take(now=0) for _ in range(3)] == [0, 0, 1]
+    assert bucket.take(now=0.5) == 0.5
+    assert bucket.take(now=1) == 0
+
+
+def test_reserve_spaces_out_everything_over_the_burst():
+    bucket = TokenBucket(rate=2, burst=1, now=0)
+
+    assert [bucket.reserve(now=0) for _ in range(4)] == [0, 0.5, 1, 1.5]
+
+
+def test_limiter_keeps_a_bucket_per_key_and_forgets_idle_ones(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: clock[0])
+    limiter = RateLimiter(per_minute=60, burst=1, max_keys=2)
+
+    assert limiter.check('a') == 0
+    assert limiter.check('a') == 1
+    assert limiter.check('b') == 0
+    # A third client pushes out the least recently seen one
+    assert limiter.check('c') == 0 and len(limiter) == 2
+    clock[0] = 1.0
+    limiter.check('d')
+    # Buckets full again after burst / rate seconds are dropped
+    assert len(limiter) == 1
+
+
+@pytest.fixture
+def client(backend_db, db, monkeypatch):
+    """TestClient posting to a backend that stores in the test database"""
+    monkeypatch.setattr(backend_db, 'store', SQLiteStore(db, backend_db.store_cafe_submission))
+    monkeypatch.setattr(backend_db, 'mail_queue', None)
+
+    def post(n: int, host: str = 'testclient'):
+        return TestClient(backend_db.app, client=(host, 50000)).post(
+            '/api/cafe', json=dict(FORM, email=f"lid{n}@example.com")
+        )
+    return post
+
+
+def test_one_client_over_its_burst_gets_429(client, backend_db, monkeypatch):
+    monkeypatch.setattr(backend_db, 'client_limiter', RateLimiter(per_minute=60, burst=2))
+    monkeypatch.setattr(backend_db, 'global_bucket', None)
+    limited = RATE_LIMITED.value('client')
+
+    statuses = [client(n).status_code for n in range(3)]
+    other = client(3, host='10.0.0.2')
+
+    assert statuses == [200, 200, 429]
+    assert other.status_code == 200
+    rejected = client(4)
+    assert rejected.headers['Retry-After'] == '1'
+    assert backend_db.db.execute("SELECT COUNT(*) FROM cafe_registrations") == [(3,)]
+    assert RATE_LIMITED.value('client') == limited + 2
+
+
+def test_all_clients_together_over_the_global_rate_get_429(client, backend_db, monkeypatch):
+    monkeypatch.setattr(backend_db, 'client_limiter', RateLimiter(per_minute=60, burst=5))
+    monkeypatch.setattr(backend_db, 'global_bucket', TokenBucket(rate=1 / 60, burst=2))
+
+    statuses = [client(n, host=f"10.0.0.{n}").status_code for n in range(3)]
+
+    assert statuses == [200, 200, 429]
+    assert int(client(4, host='10.0.0.9').headers['Retry-After']) > 1
+
+
+def test_mail_queue_sends_no_faster_than_its_cap(backend_db, db, mail_to_sink, sink):
+    for n in range(2):
+        backend_db.store_cafe_submission(dict(
+            FORM, email=f"lid{n}@example.com", timestamp='2025-01-01T20:00:00', id=backend_db.new_ulid()
+        ))
+    # 20 mails a second after a burst of one: four mails take at least 0.15 s
+    queue = MailQueue(
+        SQLiteStore(db, backend_db.store_cafe_submission),
+        senders={
+            'cafe_notification': backend_db.send_cafe_notification_email,
+            'cafe_confirmation': backend_db.send_cafe_confirmation_email,
+        },
+        max_per_minute=1200, burst=1,
+    )
+
+    async def drain():
+        while await queue._process_next():
+            pass
+
+    started = time.monotonic()
+    asyncio.run(drain())
+
+    assert sink.message_count == 4
+    assert time.monotonic() - started >= 0.15
@@ -0,0 +1,112 @@
+"""SMTPPool against the local SMTP sink"""
+
+import socket
+
+import pytest
+
+from metrics import SMTP_RETRIES
+from smtp_pool import SMTPPool
+
+
+@pytest.fixture
+def pool(sink):
+    smtp = SMTPPool(port=sink.port, timeout=5)
+    yield smtp
+    smtp.close()
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fill_idle(pool: SMTPPool, count: int):
+    """Leave count established connections idle in the pool"""
+    sessions = [pool.connection() for _ in range(count)]
+    for session in sessions:
+        session.__enter__().sendmail('a@example.com', 'b@example.com', 'Subject: warm-up\r\n\r\nhoi')
+    for session in sessions:
+        session.__exit__(None, None, None)
+
+
+def test_sends_reuse_one_connection(pool, sink):
+    for n in range(3):
+        pool.sendmail('a@example.com', ['b@example.com'], f'Subject: {n}\r\n\r\nhoi')
+
+    assert sink.message_count == 3
+    assert sink.connection_count == 1
+    assert sink.messages[0]['to'] == ['<b@example.com>']
+
+
+def test_connection_recycled_after_max_messages(sink):
+    pool = SMTPPool(port=sink.port, max_messages=2)
+    for _ in range(5):
+        pool.sendmail('a@example.com', 'b@example.com', 'Subject: x\r\n\r\nhoi')
+    pool.close()
+
+    assert sink.message_count == 5
+    assert sink.connection_count == 3
+
+
+def test_idle_connection_past_max_idle_is_replaced(sink):
+    pool = SMTPPool(port=sink.port, max_idle=0)
+    pool.sendmail('a@example.com', 'b@example.com', 'Subject: x\r\n\r\nhoi')
+    pool.sendmail('a@example.com', 'b@example.com', 'Subject: y\r\n\r\nhoi')
+    pool.close()
+
+    assert sink.connection_count == 2
+
+
+def test_reconnects_once_when_every_idle_session_was_dropped(pool, sink):
+    fill_idle(pool, 3)
+    sink.drop_connections()
+    retries = SMTP_RETRIES.value()
+
+    pool.sendmail('a@example.com', 'b@example.com', 'Subject: after drop\r\n\r\nhoi')
+
+    assert SMTP_RETRIES.value() == retries + 1
+    assert sink.message_count == 4
+    assert sink.connection_count == 4
+    # The stale sessions were thrown away, not handed out later
+    pool.sendmail('a@example.com', 'b@example.com', 'Subject: next\r\n\r\nhoi')
+    assert sink.connection_count == 4
+
+
+def test_refused_connection_is_not_retried():
+    pool = SMTPPool(port=unused_port(), timeout=2)
+    retries = SMTP_RETRIES.value()
+
+    with pytest.raises(ConnectionRefusedError):
+        pool.sendmail('a@example.com', 'b@example.com', 'Subject: x\r\n\r\nhoi')
+    assert SMTP_RETRIES.value() == retries
+
+
+def test_pool_still_sends_after_close(pool, sink):
+    pool.sendmail('a@example.com', 'b@example.com', 'Subject: x\r\n\r\nhoi')
+    pool.close()
+    pool.sendmail('a@example.com', 'b@example.com', 'Subject: y\r\n\r\nhoi')
+
+    assert sink.message_count == 2
+    assert sink.connection_count == 2
+
+
+def test_send_many_continues_on_a_fresh_connection(pool, sink):
+    fill_idle(pool, 2)
+    sink.drop_connections()
+    messages = [('a@example.com', 'b@example.com', f'Subject: {n}\r\n\r\nhoi') for n in range(4)]
+
+    results = pool.send_many(messages)
+
+    # The first message fails with the dropped session, the rest share one new one
+    assert results[0] is not None
+    assert results[1:] == [None, None, None]
+    assert sink.message_count == 2 + 3
+    assert sink.connection_count == 3
+
+
+def test_probe_leaves_the_pool_alone(pool, sink):
+    pool.probe()
+
+    assert sink.connection_count == 1
+    assert not pool._idle
@@ -0,0 +1,166 @@
+"""The RegistrationStore contract, run against SQLiteStore and PostgresStore
+
+SQLiteStore works in a temporary database. For PostgresStore, set
+TEST_DATABASE_URL to a database the tests may write to, e.g.
+postgresql://postgres@localhost/samenwerkt_test. Each test works in its
+own schema, which is dropped afterwards. Without TEST_DATABASE_URL, or
+without asyncpg, the PostgreSQL tests are skipped.
+"""
+
+import asyncio
+
+import pytest
+
+from export_members import async_cursor_rows
+from ids import new_ulid
+from mail_queue import STATUS_SENT
+from storage import PostgresStore, RegistrationStore, SQLiteStore
+
+MAILS = ('cafe_notification', 'cafe_confirmation')
+
+
+def form(email: str) -> dict:
+    return {
+        'naam': 'Jan Jansen', 'email': email, 'lidVanSamenwerkt': 'ja', 'komtNaarCafe': 'nee',
+        'telefoonnummer': '0612345678', 'opmerkingen': None,
+        'timestamp': '2025-01-01T20:00:00', 'id': new_ulid(),
+    }
+
+
+def sqlite_runner(backend):
+    """Run a coroutine function against an SQLiteStore on the backend's test database"""
+    def run(test):
+        async def main():
+            store = SQLiteStore(backend.db, backend.store_cafe_submission)
+            await store.open()
+            try:
+                await store.migrate()
+                return await test(store)
+            finally:
+                await store.close()
+        return asyncio.run(main())
+    return run
+
+
+def postgres_runner(url: str):
+    """Run a coroutine function against a migrated PostgresStore"""
+    def run(test):
+        async def main():
+            store = PostgresStore(url, event='politiek-cafe', mail_kinds=MAILS, min_size=1, max_size=2)
+            await store.open()
+            try:
+                await store.migrate()
+                return await test(store)
+            finally:
+                await store.close()
+        return asyncio.run(main())
+    return run
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def run_store(request):
+    """Run a coroutine function against each store"""
+    if request.param == 'sqlite':
+        return sqlite_runner(request.getfixturevalue('backend_db'))
+    return postgres_runner(request.getfixturevalue('postgres_url'))
+
+
+@pytest.fixture
+def run_postgres_store(postgres_url):
+    """Run a coroutine function against PostgresStore only"""
+    return postgres_runner(postgres_url)
+
+
+def test_migrate_is_idempotent(run_store):
+    async def test(store):
+        assert await store.migrate() == 0
+    run_store(test)
+
+
+def test_duplicate_email_returns_the_original(run_store):
+    async def test(store):
+        first = form('jan@example.com')
+        assert await store.store_submission(first) == (first['id'], True)
+        assert await store.store_submission(form(' Jan@Example.com ')) == (first['id'], False)
+        assert (await store.mail_queue_counts())['pending'] == len(MAILS)
+    run_store(test)
+
+
+def test_idempotency_key_wins_over_email_match(run_store):
+    async def test(store):
+        by_email = form('a@example.com')
+        by_key = form('b@example.com')
+        await store.store_submission(by_email)
+        await store.store_submission(by_key, idempotency_key='retry-1')
+
+        # Both rows match; the one with the key must be returned
+        result = await store.store_submission(form('a@example.com'), idempotency_key='retry-1')
+        assert result == (by_key['id'], False)
+    run_store(test)
+
+
+def test_mail_claim_update_and_status(run_store):
+    async def test(store):
+        registration = form('jan@example.com')
+        await store.store_submission(registration)
+
+        claimed = await store.claim_mail(lease_seconds=60)
+        assert claimed is not None
+        mail_id, kind, payload, attempts = claimed
+        assert kind in MAILS and attempts == 0 and 'jan@example.com' in payload
+        await store.update_mail(mail_id, STATUS_SENT, 1, None)
+
+        statuses = {mail['kind']: mail for mail in await store.mail_status(registration['id'])}
+        assert statuses[kind]['status'] == STATUS_SENT and statuses[kind]['sent_at']
+        assert await store.mail_status('unknown') == []
+        counts = await store.mail_queue_counts()
+        assert counts['pending'] == 1 and counts['sending'] == 0
+    run_store(test)
+
+
+def test_stats_and_write_probe(run_store):
+    async def test(store):
+        for n in range(3):
+            await store.store_submission(form(f"lid{n}@example.com"))
+        assert (await store.registration_stats())['total'] == 3
+        await store.probe_write('test')
+    run_store(test)
+
+
+def test_export_reads_and_watermark(run_postgres_store):
+    async def test(store):
+        for n in range(3):
+            await store.store_submission(form(f"lid{n}@example.com"))
+        until_id = await store.max_registration_id()
+
+        rows = await store.fetch_registrations(['id', 'email'], 0, until_id)
+        assert len(rows) == 3
+        assert await store.get_watermark('test') == 0
+        await store.save_watermark('test', until_id)
+        assert await store.get_watermark('test') == until_id
+    run_postgres_store(test)
+
+
+def test_export_cursor_streams_the_same_rows(run_postgres_store):
+    async def test(store):
+        for n in range(5):
+            await store.store_submission(form(f"lid{n}@example.com"))
+        until_id = await store.max_registration_id()
+
+        loop = asyncio.get_running_loop()
+        async with store.registration_cursor(['id', 'email'], 1, until_id) as cursor:
+            # Pulled from a worker thread two rows at a time, as the export's writers do
+            streamed = await asyncio.to_thread(list, async_cursor_rows(cursor, loop, chunksize=2))
+        assert streamed == await store.fetch_registrations(['id', 'email'], 1, until_id)
+        assert len(streamed) == 4
+        assert await store.max_lengths(['id', 'email'], 0, until_id) == [len(str(until_id)), len('lid0@example.com')]
+    run_postgres_store(test)
+
+
+def test_a_store_must_implement_the_whole_interface():
+    class PartialStore(RegistrationStore):
+        async def migrate(self) -> int:
+            return 0
+
+    with pytest.raises(TypeError):
+        PartialStore()
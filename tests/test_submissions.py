@@ -0,0 +1,45 @@
+"""Reading stored submissions back, from rows in the old and the normalized format"""
+
+from serialization import dumps_text
+from submissions import load_submission
+
+FORM = {
+    'naam': 'Jan Jansen',
+    'email': 'jan@example.com',
+    'lidVanSamenwerkt': 'ja',
+    'komtNaarCafe': 'nee',
+    'telefoonnummer': '0612345678',
+    'opmerkingen': 'Graag vooraan',
+    'timestamp': '2025-03-01T20:00:00',
+}
+
+
+def test_normalized_row_keeps_only_the_extra_fields(backend_db):
+    form_data = dict(FORM, id=backend_db.new_ulid(), bron='flyer')
+    registration_uid, _ = backend_db.store_cafe_submission(form_data)
+
+    (registration_id, stored), = backend_db.db.execute(
+        "SELECT id, submission_data FROM cafe_registrations WHERE registration_uid = ?", (registration_uid,)
+    )
+    assert stored == '{"bron":"flyer"}'
+    assert load_submission(backend_db.db.connection, registration_id) == form_data
+
+
+def test_row_with_the_full_json_is_read_as_stored(db):
+    # Written before submission_data was normalized: every field in the JSON, no registration_uid
+    form_data = dict(FORM, id='1700000000000')
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO cafe_registrations (
+                naam, email, lid_van_samenwerkt, komt_naar_cafe, telefoonnummer,
+                opmerkingen, timestamp, submission_data
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ('Jan Jansen', 'jan@example.com', 'ja', 'nee', '0612345678', 'Graag vooraan',
+              '2025-03-01T20:00:00', dumps_text(form_data, indent=True)))
+        registration_id = cursor.lastrowid
+
+    assert load_submission(db.connection, registration_id) == form_data
+
+
+def test_unknown_registration(db):
+    assert load_submission(db.connection, 12345) is None
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Request tracing and sampled profiling for the SamenWerkt backend
+
+A trace is started for a fraction of requests (TRACE_SAMPLE_RATE) or for
+one request on demand (X-Profile: 1 together with a valid X-Admin-Token).
+While a trace is active, span() records how long each stage takes:
+validation, SQLite transactions, template rendering, MIME building and
+SMTP sends. The request is also run under cProfile. Work handed to the
+thread pools through BoundedExecutor is included, because the executor
+carries the trace into the worker thread. Mail deliveries by the mail queue
+are sampled the same way and produce their own traces.
+
+Finished traces are written to PROFILE_DIR as <trace id>.json (spans and
+the top functions) and <trace id>.prof (pstats, for snakeviz or
+python -m pstats). Only the newest PROFILE_KEEP traces are kept.
+
+Without an active trace, span() is a context variable lookup that returns
+a shared no-op object, so the instrumentation can stay in place. Note that
+the profiler on the event loop thread also sees work for other requests
+that runs on the loop during a traced one.
+"""
+
+import asyncio
+import io
+import json
+import os
+import random
+import threading
+import time
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterator, List, Optional
+
+from ids import new_ulid
+
+if TYPE_CHECKING:
+    # Imported by the first profiled request, not at start-up
+    import cProfile
+    import pstats
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", Path(__file__).parent / "profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+PROFILE_TOP = 40
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar('current_span', default=None)
+
+# Threads that already run a profiler; a second one would take over its hook
+_profiled_threads = set()
+_profiled_lock = threading.Lock()
+
+
+class Trace:
+    """Spans and profiler data collected for one request or mail delivery"""
+
+    def __init__(self, name: str, profile: bool = True):
+        self.trace_id = new_ulid()
+        self.name = name
+        self.profile = profile
+        self.started_at = datetime.now().isoformat()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.spans: List[dict] = []
+        self._profilers: List['cProfile.Profile'] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, parent: Optional[str], started: float, ended: float):
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'parent': parent,
+                'start_ms': round((started - self._started) * 1000, 3),
+                'duration_ms': round((ended - started) * 1000, 3),
+                'thread': threading.current_thread().name,
+            })
+
+    @contextmanager
+    def profiling(self) -> Iterator[None]:
+        """Profile the current thread while the block runs"""
+        thread_id = threading.get_ident()
+        with _profiled_lock:
+            busy = thread_id in _profiled_threads
+            if self.profile and not busy:
+                _profiled_threads.add(thread_id)
+        if not self.profile or busy:
+            yield
+            return
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active in this interpreter; keep the spans only
+                yield
+                return
+            try:
+                yield
+            finally:
+                profiler.disable()
+                with self._lock:
+                    self._profilers.append(profiler)
+        finally:
+            with _profiled_lock:
+                _profiled_threads.discard(thread_id)
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+
+    def stats(self) -> Optional['pstats.Stats']:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        import pstats
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    def to_dict(self, stats: Optional['pstats.Stats'] = None) -> dict:
+        summary = None
+        if stats is not None:
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            summary = out.getvalue()
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'spans': sorted(self.spans, key=lambda span: span['start_ms']),
+            'profile': summary,
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'parent', 'started', 'token')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.token = _current_span.set(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_span(self.name, self.parent, self.started, time.perf_counter())
+        _current_span.reset(self.token)
+        return False
+
+
+def span(name: str):
+    """Time a block as part of the active trace; a no-op when nothing is traced"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def bind(fn: Callable) -> Callable:
+    """Carry the active trace into another thread, profiling fn there as well"""
+    trace = _current_trace.get()
+    if trace is None:
+        return fn
+    context = copy_context()
+
+    def run():
+        with trace.profiling():
+            return fn()
+    return lambda: context.run(run)
+
+
+def should_sample(force: bool = False) -> bool:
+    return force or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)
+
+
+@asynccontextmanager
+async def maybe_trace(name: str, force: bool = False) -> AsyncIterator[Optional[Trace]]:
+    """Trace and profile the block when it is sampled or forced; yields the Trace or None
+
+    The finished trace is saved on a worker thread, so formatting the
+    profile and writing the files does not hold up the event loop.
+    """
+    if not should_sample(force) or _current_trace.get() is not None:
+        yield None
+        return
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        with trace.profiling():
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        await asyncio.to_thread(save_trace, trace)
+
+
+def save_trace(trace: Trace, directory: Path = PROFILE_DIR):
+    """Write a finished trace to disk and prune the oldest ones"""
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        stats = trace.stats()
+        if stats is not None:
+            stats.dump_stats(directory / f"{trace.trace_id}.prof")
+        with open(directory / f"{trace.trace_id}.json", 'w', encoding='utf-8') as f:
+            json.dump(trace.to_dict(stats), f, ensure_ascii=False, indent=2)
+        # Trace ids are ULIDs, so name order is age order
+        for old in sorted(directory.glob('*.json'))[:-PROFILE_KEEP]:
+            old.unlink(missing_ok=True)
+            old.with_suffix('.prof').unlink(missing_ok=True)
+    except OSError as e:
+        logger.error(f"Could not save trace {trace.trace_id}: {e}")
+
+
+def list_traces(directory: Path = PROFILE_DIR) -> List[dict]:
+    """Summaries of the saved traces, newest first"""
+    traces = []
+    for path in sorted(directory.glob('*.json'), reverse=True):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        traces.append({
+            'trace_id': data['trace_id'],
+            'name': data['name'],
+            'started_at': data['started_at'],
+            'duration_ms': data['duration_ms'],
+        })
+    return traces